@@ -12,63 +12,56 @@ Suggested anity checks:
 @author: Pedro
 """
 from __future__ import print_function
+import os
 import math
 import numpy as np
 import warnings
 
-try:
-    from abaqus import *
-    in_Abaqus = True
-except:
-    in_Abaqus = False
-
-if in_Abaqus != True:
-    from scipy.integrate import quad
-    from scipy.optimize import fsolve, minimize
-    from scipy import optimize
-    from scipy.optimize import differential_evolution
-
-from aeropy.geometry.airfoil import CST
+from aeropy.geometry.airfoil import CST, least_squares_shape_coefficients, \
+                                   ShapeDifference, normalize_airfoil
+from aeropy.geometry.bernstein import K, binomial, degree_elevation
 from aeropy.xfoil_module import output_reader
 
-# Bersntein Polynomial
-def K(r,n):
-    K=math.factorial(n)/(math.factorial(r)*math.factorial(n-r))
-    return K
-
 # Upper surface differential
 def dxi_u(psi, Au, delta_xi, N1=0.5, N2=1):
     """Calculate upper derivate of xi for a given psi"""
     n = len(Au)-1
-   
+    i = np.arange(n+1)
+    psi_i = np.asarray(psi)[..., np.newaxis]
+
     if N1==0.5 and N2==1:
         diff = delta_xi/2.
     else:
         diff = delta_xi
-    for i in range(n+1):
-        # print N1-1., N2-1.
-        # print psi**(N1-1.), (1-psi)**(N2-1.)
-        # print Au[i]*K(i,n)*(psi**i)*((1-psi)**(n-i))*(i+N1-psi*(n+N1+N2))
-        diff += (psi**(N1-1))*((1-psi)**(N2-1))*Au[i]*K(i,n)*(psi**i)*((1-psi)**(n-i))*(i+N1-psi*(n+N1+N2))
+    diff += (psi**(N1-1))*((1-psi)**(N2-1))*np.sum(
+        Au*binomial(n)*(psi_i**i)*((1-psi_i)**(n-i))*(i+N1-psi_i*(n+N1+N2)),
+        axis=-1)
     return  diff
 
 # Lower surface differential
 def dxi_l(psi, Al, delta_xi):
     """Calculate lower derivate of xi for a given psi"""
-    n = len(Al)-1  
+    n = len(Al)-1
+    i = np.arange(n+1)
+    psi_i = np.asarray(psi)[..., np.newaxis]
     diff = -delta_xi/2.
-    for i in range(n+1):
-        diff -= Al[i]*K(i,n)*psi**i*(1-psi)**(n-i)/(2*psi**0.5)*(-(3+2*n)*psi +2*i + 1)
+    diff -= np.sum(Al*binomial(n)*psi_i**i*(1-psi_i)**(n-i)/(2*psi_i**0.5)* \
+                   (-(3+2*n)*psi_i +2*i + 1), axis=-1)
     return diff
 
+def _ddxi(psi, A):
+    """Sum of the second derivative terms shared by ddxi_u and ddxi_l."""
+    n = len(A)-1
+    i = np.arange(n+1)
+    psi_i = np.asarray(psi)[..., np.newaxis]
+    return np.sum(A*binomial(n)*(psi_i**i)*((1-psi_i)**(n-i-1.))/(4*psi_i**1.5)* \
+                  ((4*n**2 + 8*n +3)*psi_i**2+(-4*(2*i+1)*n - 4*i -2)*psi_i + \
+                   4*i**2 - 1), axis=-1)
+
 # Upper surface second differential
 def ddxi_u(psi, Au, abs_output = False):
     """Calculate upper second derivate of xi for a given psi"""
-    n = len(Au)-1
-   
-    diff = 0
-    for i in range(n+1):
-        diff -= Au[i]*K(i,n)*(psi**i)*((1-psi)**(n-i-1))/(4*psi**1.5)*((4*n**2 + 8*n +3)*psi**2+(-4*(2*i+1)*n - 4*i -2)*psi + 4*i**2 - 1)
+    diff = -_ddxi(psi, Au)
     if abs_output:
         return abs(diff)
     else:
@@ -77,10 +70,7 @@ def ddxi_u(psi, Au, abs_output = False):
 # Lower surface second differential
 def ddxi_l(psi, Al, abs_output = False):
     """Calculate lower second derivate of xi for a given psi"""
-    n = len(Al)-1  
-    diff = 0
-    for i in range(n+1):
-        diff += Al[i]*K(i,n)*(psi**i)*((1-psi)**(n-i-1))/(4*psi**1.5)*((4*n**2 + 8*n +3)*psi**2+(-4*(2*i+1)*n-4*i-2)*psi +4*i**2 - 1)
+    diff = _ddxi(psi, Al)
     if abs_output:
         return abs(diff)
     else:
@@ -89,7 +79,9 @@ def ddxi_l(psi, Al, abs_output = False):
 def calculate_c_baseline(c_L, Au_C, Au_L, deltaz):
     """Equations in the New_CST.pdf. Calculates the upper chord in order for
        the cruise and landing airfoils ot have the same length."""
-    
+    from scipy.integrate import quad
+    from scipy import optimize
+
     def integrand(psi, Au, delta_xi ):
         return np.sqrt(1 + dxi_u(psi, Au, delta_xi)**2)
     
@@ -111,20 +103,27 @@ def calculate_psi_goal(psi_baseline, Au_baseline, Au_goal, deltaz,
     """Find the value for psi that has the same location w on the upper 
     surface of the goal as psi_baseline on the upper surface of the 
     baseline"""
-    
+    from scipy.integrate import quad
+    from scipy.optimize import fsolve
+
     def integrand(psi_baseline, Au, deltaz, c ):
         return c*np.sqrt(1 + dxi_u(psi_baseline, Au, deltaz/c)**2)
     
     def equation(psi_goal, L_baseline, Au_goal, deltaz, c):
-        y, err = quad(integrand, 0, psi_goal, args=(Au_goal, deltaz, c))
+        # fsolve works with arrays, quad needs a float as limit
+        y, err = quad(integrand, 0, np.ravel(psi_goal)[0], args=(Au_goal, deltaz, c))
         return y - L_baseline
+
+    def dequation(psi_goal, L_baseline, Au_goal, deltaz, c):
+        # The derivative of the arc length is the integrand at psi_goal
+        return np.reshape(integrand(psi_goal, Au_goal, deltaz, c), (1,1))
     
     L_baseline, err =  quad(integrand, 0, psi_baseline, args=(Au_baseline, deltaz, 
                                                          c_baseline))
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
         y = fsolve(equation, psi_baseline, args=(L_baseline, Au_goal, deltaz,
-                                                 c_goal))
+                                                 c_goal), fprime=dequation)
     return y[0]
     
 def calculate_cbeta(psi_i, Au, delta_xi):
@@ -164,7 +163,8 @@ def calculate_spar_direction(psi_baseline, Au_baseline, Au_goal, deltaz, c_goal)
 def calculate_spar_distance(psi_baseline, Au_baseline, Au_goal, Al_goal, 
                             deltaz, c_goal):
     """Calculate spar distance (dimensional)"""
-    
+    from scipy import optimize
+
     def f(psi_lower_goal):
         y_lower_goal = CST(psi_lower_goal*c_goal, c_goal, [deltaz/2., deltaz/2.], Au_goal, Al_goal)
         y_lower_goal = y_lower_goal['l']
@@ -197,6 +197,8 @@ def calculate_arc_length(psi_initial, psi_final, A_j, deltaz, c_j):
     """Calculate arc length from psi_initial to psi_final for
        shape coefficient A_j, trailing edge thickness deltaz, and
        chord c_j. Output is the dimensional length"""
+    from scipy.integrate import quad
+
     def integrand(psi_baseline, A_j, deltaz, c_j):
         return c_j*np.sqrt(1 + dxi_u(psi_baseline, A_j, deltaz/c_j)**2)
     
@@ -205,34 +207,31 @@ def calculate_arc_length(psi_initial, psi_final, A_j, deltaz, c_j):
     
 def fitting_shape_coefficients(filename, bounds = 'Default', n = 5,
                                return_data = False, return_error = False,
-                               optimize_deltaz = False):
+                               optimize_deltaz = False,
+                               solver = 'differential_evolution',
+                               popsize = 10, workers = 1, vectorized = False,
+                               seed = None, x0 = None):
     """Fit shape parameters to given data points
         Inputs:
-        - filename: name of the file where the original data is
+        - filename: name of the file where the original data is. If a
+                dictionary with x and y keys, it is used as the data.
         - bounds: bounds for the shape parameters. If not defined,
                     Default values are used.
         - n: order of the Bernstein polynomial. If bounds is default
                 this input will define the order of the polynomial.
                 Otherwise the length of bounds (minus one) is taken into 
-                consideration"""
-
-    from hausdorff_distance import hausdorff_distance_2D
-
-    def shape_difference(inputs, optimize_deltaz = False):
-
-        if optimize_deltaz == True or optimize_deltaz == [True]:
-            y_u = CST(upper['x'], 1, deltasz = inputs[-1]/2., Au = list(inputs[:n+1]))
-            y_l = CST(lower['x'], 1, deltasz = inputs[-1]/2.,  Al = list(inputs[n+1:-1]))
-        else:
-            y_u = CST(upper['x'], 1, deltasz = deltaz/2., Au = list(inputs[:n+1]))
-            y_l = CST(lower['x'], 1, deltasz = deltaz/2.,  Al = list(inputs[n+1:]))
-        # Vector to be compared with
-        a_u = {'x':upper['x'], 'y':y_u}
-        a_l = {'x':lower['x'], 'y':y_l}
-        
-        b_u = upper
-        b_l = lower
-        return hausdorff_distance_2D(a_u, b_u) + hausdorff_distance_2D(a_l, b_l)
+                consideration
+        - solver: 'differential_evolution' or 'lstsq'. 'lstsq' solves the
+                linear least-squares problem directly (N1=0.5 and N2=1),
+                using BVLS if bounds are given (the default bounds are
+                not applied).
+        - popsize, workers, seed: differential evolution settings.
+                workers = -1 uses all the cores.
+        - vectorized: if True, each generation is evaluated at once.
+        - x0: initial guess for differential evolution (Au + Al
+                (+ deltaz)), clipped to the bounds. Not used by 'lstsq',
+                which solves the coefficients directly."""
+    from scipy.optimize import differential_evolution
 
     # def shape_difference_upper(inputs, optimize_deltaz = False):
         # if optimize_deltaz == True:
@@ -267,43 +266,15 @@ def fitting_shape_coefficients(filename, bounds = 'Default', n = 5,
         n = len(bounds) - 1
 
     # Obtaining data
-    data = output_reader(filename, separator = ', ', header = ['x', 'y'])
-
-    # Rotating airfoil 
-    x_TE = (data['x'][0] + data['x'][-1])/2.
-    y_TE = (data['y'][0] + data['y'][-1])/2.
-
-    theta_TE = math.atan(-y_TE/x_TE)
-
-    # position trailing edge at the x-axis
-    processed_data = {'x':[], 'y':[]}
-    for i in range(len(data['x'])):
-        x = data['x'][i]
-        y = data['y'][i]
-        c_theta = math.cos(theta_TE)
-        s_theta = math.sin(theta_TE)
-        x_rotated = c_theta*x - s_theta*y
-        y_rotated = s_theta*x + c_theta*y
-        processed_data['x'].append(x_rotated)
-        processed_data['y'].append(y_rotated)
-    data = processed_data
-
-    # determine what is the leading edge and the rotation angle beta
-    processed_data = {'x':[], 'y':[]}
-    min_x_list = []
-    min_y_list = []
-
-    min_x = min(data['x'])
-    min_index = data['x'].index(min_x)
-    min_y = data['y'][min_index]
-
-    chord = max(data['x']) - min(data['x'])
-    beta = math.atan((y_TE - min_y)/(x_TE - min_x))
-    
-    for i in range(len(data['x'])):
-        processed_data['x'].append((data['x'][i] - min_x)/chord)
-        processed_data['y'].append(data['y'][i]/chord)    
-    data = processed_data
+    if type(filename) == dict:
+        data = {'x': list(filename['x']), 'y': list(filename['y'])}
+    else:
+        data = output_reader(filename, separator = ', ', header = ['x', 'y'])
+
+    # Translate the leading edge to the origin, position the trailing edge
+    # at the x-axis and normalize the chord
+    x, y, edges = normalize_airfoil(data['x'], data['y'])
+    data = {'x': x.tolist(), 'y': y.tolist()}
 
     #==============================================================================
     # Optimizing shape
@@ -312,6 +283,33 @@ def fitting_shape_coefficients(filename, bounds = 'Default', n = 5,
     if bounds == 'Default':
         upper_bounds = [[0, 1.]]*(n+1)
         lower_bounds = [[0, 1]] +  [[-1., 1.]]*n
+    else:
+        upper_bounds = list(bounds)
+        lower_bounds = list(bounds)
+
+    if solver == 'lstsq':
+        upper, lower = separate_upper_lower(data)
+        if optimize_deltaz == False:
+            deltaz = (data['y'][0] - data['y'][-1])
+        else:
+            deltaz = 0.
+        if bounds == 'Default':
+            lstsq_bounds = None
+        elif optimize_deltaz:
+            lstsq_bounds = upper_bounds + lower_bounds + [[0, 0.1]]
+        else:
+            lstsq_bounds = upper_bounds + lower_bounds
+        Au, Al, deltaz, error = least_squares_shape_coefficients(
+            upper, lower, n, deltaz = deltaz, bounds = lstsq_bounds,
+            optimize_deltaz = optimize_deltaz)
+        Au = list(Au)
+        Al = list(Al)
+        if return_data:
+            return data, deltaz, Al, Au
+        elif return_error:
+            return error, deltaz, Al, Au
+        else:
+            return deltaz, Al, Au
 
     if optimize_deltaz:
         bounds = upper_bounds + lower_bounds + [[0, 0.1]]
@@ -322,9 +320,24 @@ def fitting_shape_coefficients(filename, bounds = 'Default', n = 5,
     upper, lower = separate_upper_lower(data)
     # a = data
     # x = data['x']
-    result = differential_evolution(shape_difference, bounds, 
-                                            disp=True, popsize = 10, 
-                                            args = [optimize_deltaz])
+    if optimize_deltaz:
+        objective = ShapeDifference(upper, lower, n, N1 = 0.5, N2 = 1.,
+                                    error = 'hausdorff', optimize_deltaz = True)
+    else:
+        objective = ShapeDifference(upper, lower, n, deltaz, N1 = 0.5,
+                                    N2 = 1., error = 'hausdorff')
+    # Parallel and vectorized evaluations need deferred updating
+    if workers != 1 or vectorized:
+        updating = 'deferred'
+    else:
+        updating = 'immediate'
+    if x0 is not None:
+        x0 = np.clip(x0, np.array(bounds)[:,0], np.array(bounds)[:,1])
+    result = differential_evolution(objective, bounds, 
+                                            disp=True, popsize = popsize, 
+                                            seed = seed, workers = workers,
+                                            vectorized = vectorized,
+                                            updating = updating, x0 = x0)
     print('order %i upper done' % n)
     # x = lower['x']
     # a = lower
@@ -368,8 +381,189 @@ def shape_parameter_study(filename, n = 5):
     pickle.dump(Data, file)
     return Data
 
+def read_coordinates(filename):
+    """Read an airfoil coordinates file in the UIUC database formats.
+
+    Both the Selig format (from the trailing edge along the upper surface
+    and back along the lower surface) and the Lednicer format (number of
+    points followed by the upper and the lower surfaces from the leading
+    edge) are accepted. Lines that are not pairs of numbers (name, blank
+    lines) are ignored.
+
+    :param filename: path of the coordinates file.
+
+    :rtype: dictionary with x and y lists in the Selig order (as used by
+            fitting_shape_coefficients). An exception is raised if the
+            file does not have at least three pairs of coordinates.
+    """
+    points = []
+    with open(filename, 'r', errors='replace') as f:
+        for line in f:
+            components = line.replace(',', ' ').split()
+            if len(components) != 2:
+                continue
+            try:
+                points.append([float(components[0]), float(components[1])])
+            except ValueError:
+                continue
+    points = np.array(points)
+
+    # Lednicer format: first pair is the number of points of each surface
+    if len(points) and points[0][0] > 1.5:
+        n_upper = int(points[0][0])
+        upper = points[1:n_upper+1]
+        lower = points[n_upper+1:]
+        # Remove repeated leading edge
+        if len(lower) and np.allclose(lower[0], upper[0]):
+            lower = lower[1:]
+        points = np.concatenate([upper[::-1], lower])
+    if points.ndim != 2 or points.shape[1] != 2 or len(points) < 3:
+        raise Exception(filename + ' does not have airfoil coordinates')
+    return {'x': points[:,0].tolist(), 'y': points[:,1].tolist()}
+
+def _fit_file(task):
+    """Fit all orders of one file (module-level so that it can be used
+    by a pool of processes). With differential evolution each order
+    starts from the previous solution elevated by one degree.
+
+    Files or orders that can not be fitted give a row with 'failed' as
+    metric and the error message, so that the rest of the database is
+    still fitted and a restarted study does not try them again."""
+    filename, orders, fitting_kwargs = task
+    solver = fitting_kwargs.get('solver', 'differential_evolution')
+    # lstsq minimizes the sum of the squared differences and differential
+    # evolution the Hausdorff distance
+    metric = 'sse' if solver == 'lstsq' else 'hausdorff'
+
+    def failed(order, exception):
+        return {'file': filename, 'order': order, 'error': np.nan,
+                'deltaz': np.nan, 'Au': [], 'Al': [], 'metric': 'failed',
+                'message': '%s: %s' % (type(exception).__name__, exception)}
+
+    try:
+        data = read_coordinates(filename)
+    except Exception as exception:
+        return [failed(order, exception) for order in orders]
+    rows = []
+    x0 = None
+    for order in orders:
+        kwargs = dict(fitting_kwargs)
+        if solver != 'lstsq':
+            kwargs['x0'] = x0
+        try:
+            error, deltaz, Al, Au = fitting_shape_coefficients(
+                data, n = order, return_error = True, **kwargs)
+        except Exception as exception:
+            rows.append(failed(order, exception))
+            x0 = None
+            continue
+        rows.append({'file': filename, 'order': order, 'error': error,
+                     'deltaz': deltaz, 'Au': Au, 'Al': Al, 'metric': metric})
+        x0 = list(degree_elevation(Au)) + list(degree_elevation(Al))
+        if kwargs.get('optimize_deltaz', False):
+            x0.append(deltaz)
+    return rows
+
+def read_shape_database(filename = 'shape_database.csv'):
+    """Read the results stored by fit_database.
+
+    :rtype: dictionary with lists for the keys file, order, error, deltaz,
+            Au, Al and metric (the error is the sum of the squared
+            differences for 'sse' and the Hausdorff distance for
+            'hausdorff'; 'failed' rows have nan errors and no
+            coefficients).
+    """
+    import csv
+    Data = {'file': [], 'order': [], 'error': [], 'deltaz': [], 'Au': [],
+            'Al': [], 'metric': []}
+    if not os.path.isfile(filename):
+        return Data
+    with open(filename, 'r', newline='') as f:
+        for row in csv.DictReader(f):
+            Data['file'].append(row['file'])
+            Data['order'].append(int(row['order']))
+            Data['error'].append(float(row['error']))
+            Data['deltaz'].append(float(row['deltaz']))
+            Data['Au'].append([float(A) for A in row['Au'].split()])
+            Data['Al'].append([float(A) for A in row['Al'].split()])
+            Data['metric'].append(row.get('metric', ''))
+    return Data
+
+def fit_database(directory, orders = [1, 2, 3, 4, 5],
+                 output = 'shape_database.csv', pattern = '*.dat',
+                 processes = None, solver = 'lstsq', **fitting_kwargs):
+    """Fit the shape coefficients of every coordinate file in a directory
+    (e.g. the UIUC airfoil database) for several orders.
+
+    Files are distributed in a pool of processes and every fitted file is
+    immediately appended to the output table, so an interrupted study can
+    be restarted and only the missing (file, order) pairs are fitted.
+    Files that can not be read or fitted are reported and stored with
+    'failed' as metric, so they are skipped when the study is restarted.
+
+    :param directory: directory with the coordinate files.
+    :param orders: list of Bernstein polynomial orders.
+    :param output: csv file where results are stored.
+    :param pattern: glob pattern of the coordinate files.
+    :param processes: number of processes (None uses all the cores).
+    :param solver: solver of fitting_shape_coefficients. Other keyword
+           arguments are also passed to it, except workers (the files
+           are already fitted in parallel, use processes instead).
+
+    :rtype: dictionary with all the stored results (see
+            read_shape_database).
+    """
+    import csv
+    import glob
+    from multiprocessing import Pool
+
+    if fitting_kwargs.get('workers', 1) != 1:
+        raise Exception('workers can not be used inside the pool of '
+                        'fit_database, use processes instead')
+    orders = sorted(orders)
+    files = sorted(glob.glob(os.path.join(directory, pattern)))
+
+    # Resume from previous results
+    stored = read_shape_database(output)
+    done = set(zip(stored['file'], stored['order']))
+    fitting_kwargs['solver'] = solver
+    tasks = []
+    for filename in files:
+        missing = [order for order in orders if (filename, order) not in done]
+        if missing:
+            # Warm start needs all the orders until the highest missing one
+            tasks.append((filename, [order for order in orders
+                                     if order <= missing[-1]], fitting_kwargs))
+
+    header = ['file', 'order', 'error', 'deltaz', 'Au', 'Al', 'metric']
+    new_file = not os.path.isfile(output)
+    with open(output, 'a', newline='') as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(header)
+        with Pool(processes) as pool:
+            for rows in pool.imap_unordered(_fit_file, tasks):
+                for row in rows:
+                    if (row['file'], row['order']) in done:
+                        continue
+                    if row['metric'] == 'failed':
+                        print('%s order %i failed (%s)' % (row['file'],
+                                                           row['order'],
+                                                           row['message']))
+                    writer.writerow([row['file'], row['order'],
+                                     repr(float(row['error'])),
+                                     repr(float(row['deltaz'])),
+                                     ' '.join(repr(float(A)) for A in row['Au']),
+                                     ' '.join(repr(float(A)) for A in row['Al']),
+                                     row['metric']])
+                # Flush after each file to not lose results
+                f.flush()
+    return read_shape_database(output)
+
 def find_inflection_points(Au, Al):
     """Detect how many inflections points and where are they"""
+    from scipy.optimize import minimize
+
     # Find solutions for several initial estimates
     x = np.linspace(0.000001,0.99999,100)
     psi_u_solutions = []
@@ -454,10 +648,17 @@ def calculate_camber(psi, Au, Al, delta_xi):
 
 def calculate_max_camber(Au, Al, delta_xi):
     """Calculate maximum camber and where it is. Returns (\psi, max_camber)"""
+    from scipy.optimize import fsolve
+
     def dcamber(psi, Au, Al, delta_xi):
         return 0.5*(dxi_u(psi, Au, delta_xi) + dxi_l(psi, Al, delta_xi))
 
-    solution = fsolve(dcamber, 0.5, args=(Au, Al, delta_xi))
+    def ddcamber(psi, Au, Al, delta_xi):
+        # ddxi_u and ddxi_l are defined with the opposite sign of the
+        # derivatives of dxi_u and dxi_l
+        return np.reshape(-0.5*(ddxi_u(psi, Au) + ddxi_l(psi, Al)), (1,1))
+
+    solution = fsolve(dcamber, 0.5, args=(Au, Al, delta_xi), fprime=ddcamber)
     
     # Outputs floats with psi and xi coordinates
     return solution[0], calculate_camber(solution, Au, Al, delta_xi)[0]
@@ -1,14 +1,18 @@
-from scipy.interpolate import interp1d
 import numpy as np
 import math
 import pickle
+from functools import partial
 
 from aeropy.geometry.airfoil import CST, create_x
-from aeropy.geometry.wing import Rotation_euler_vector
+from aeropy.geometry.wing import rotate_points
+from aeropy.geometry.bernstein import bernstein_basis
 from aeropy.CST_3D.meshing import uniform_mesh_generator
 from aeropy.filehandling.vtk import generate_surface
 
 class ControlPoints():
+    # Properties defined at each eta control point
+    properties = ('N1', 'N2', 'chord', 'sweep', 'twist', 'shear')
+
     def __init__(self):
         self.eta = [0,1]
         self.N1 = [.5, .5]
@@ -40,7 +44,7 @@ class ControlPoints():
 
     def _check_attributes(self):
         # Check if inputs are formatted properly
-        for property in ['N1', 'N2', 'chord', 'sweep', 'twist', 'shear']:
+        for property in self.properties:
             try: 
                 if len(self.eta) != len(getattr(self,property)):
                     raise Exception('All geometric properties must have same length')
@@ -50,12 +54,49 @@ class ControlPoints():
                                 ' for ' + property)
                 
     def _set_functions(self):
-        self.fN1 = interp1d(self.eta, self.N1)
-        self.fN2 = interp1d(self.eta, self.N2)
-        self.fchord = interp1d(self.eta, self.chord)
-        self.fsweep = interp1d(self.eta, self.sweep)
-        self.ftwist = interp1d(self.eta, self.twist)
-        self.fshear = interp1d(self.eta, self.shear)
+        # All the properties are packed in one table (one row per
+        # property), so each eta is located and weighted only once. The
+        # control points do not need to be sorted (as with interp1d)
+        eta = np.asarray(self.eta, dtype=float)
+        order = np.argsort(eta, kind='stable')
+        self._eta = eta[order]
+        self._table = np.array([getattr(self, property) for property
+                                in self.properties], dtype=float)[:, order]
+        self._last = None
+        # fN1, fN2, fchord, fsweep, ftwist and fshear
+        for property in self.properties:
+            setattr(self, 'f' + property, partial(self._property, property))
+
+    def _property(self, property, eta):
+        return self.interpolate(eta)[property]
+
+    def interpolate(self, eta):
+        """Linear interpolation of all the properties at eta.
+
+        :param eta: float or array of any shape (e.g. the eta column of a
+                    structured mesh, where each eta is repeated for every
+                    psi). Each unique value is only interpolated once.
+
+        :rtype: dictionary with a read-only array (same shape as eta) for
+                each property. The last result is reused if it is called
+                again with the same eta (e.g. by the transformations of
+                the same mesh).
+        """
+        eta = np.asarray(eta, dtype=float)
+        key = (eta.tobytes(), eta.shape)
+        if self._last is None or self._last[0] != key:
+            unique, inverse = np.unique(eta.ravel(), return_inverse=True)
+            if len(unique) and (unique[0] < self._eta[0] or
+                                unique[-1] > self._eta[-1]):
+                raise Exception('eta outside of the control points range')
+            i = np.searchsorted(self._eta, unique, side='right') - 1
+            i = np.clip(i, 0, len(self._eta) - 2)
+            w = (unique - self._eta[i])/(self._eta[i+1] - self._eta[i])
+            values = self._table[:, i]*(1. - w) + self._table[:, i+1]*w
+            values = values[:, inverse].reshape((-1,) + eta.shape)
+            values.setflags(write=False)
+            self._last = (key, dict(zip(self.properties, values)))
+        return self._last[1]
 
 class CST_Object():
     def __init__(self, B = {'upper':[[1]]}, cp=ControlPoints(), origin = [0,0,0], 
@@ -157,30 +198,22 @@ def parameterized_transformation(mesh, B, cp=ControlPoints(),
     def S(B, psi, eta):
         """ Cross section shape function. Validated for high dimensions.
            To debug just verify if it turns all ones when B=ones"""
-        def S_i(r, n, psi):
-            """Shape function"""
-            value = K(r,n)*(psi**r)*(1.-psi)**(n-r)
-            return value
-
-        # Bersntein Polynomial
-        def K(r,n):
-            K=math.factorial(n)/(math.factorial(r)*math.factorial(n-r))
-            return K
-
+        B = np.asarray(B, dtype=float)
         Ny = len(B)-1
         Nx = len(B[0])-1
 
-        output = np.zeros(psi.shape)
-        for i in range(Nx+1):
-            for j in range(Ny+1):
-                output += B[j][i]*S_i(i, Nx, psi)*S_i(j, Ny, eta)
-        return output
+        # sum over i and j of B[j][i]*S_i(i, Nx, psi)*S_i(j, Ny, eta)
+        return np.einsum('pi,ji,pj->p', bernstein_basis(psi, Nx), B,
+                         bernstein_basis(eta, Ny))
 
     def C(psi, eta):
         """Class function"""
-        psi_max = cp.fN1(eta)/(cp.fN1(eta)+cp.fN2(eta))
-        C_max = 2*((psi_max)**cp.fN1(eta))*((1.-psi_max)**cp.fN2(eta))
-        output = ((psi)**cp.fN1(eta))*((1.-psi)**cp.fN2(eta))/C_max/2
+        values = cp.interpolate(eta)
+        N1 = values['N1']
+        N2 = values['N2']
+        psi_max = N1/(N1+N2)
+        C_max = 2*((psi_max)**N1)*((1.-psi_max)**N2)
+        output = ((psi)**N1)*((1.-psi)**N2)/C_max/2
         return output
 
     psi = mesh[:,0]
@@ -216,8 +249,9 @@ def intermediate_transformation(data_nondimensional, cp = ControlPoints(),
     psi, eta, zeta = data_nondimensional.T
     if inverse:
         eta = eta/cp.half_span
-    chord = cp.fchord(eta)
-    sweep = cp.fsweep(eta)
+    values = cp.interpolate(eta)
+    chord = values['chord']
+    sweep = values['sweep']
 
     if not inverse:
         x0 = chord*psi + sweep
@@ -238,6 +272,7 @@ def physical_transformation(data, cp = ControlPoints(), inverse = False):
     if inverse:
         # CURRENTLY ONLY WORKS FOR NO TWIST ON FUSELAGE
         eta= data[:,1]/cp.half_span
+        values = cp.interpolate(eta)
 
         #Move to rotation and remove shear
         data[:,0] += cp.twist_origin['x']
@@ -245,14 +280,13 @@ def physical_transformation(data, cp = ControlPoints(), inverse = False):
         # Adjust if only two coordinates are provided. Using zero values
         # which is true if there is no twist
         try:
-            data[:,2] += cp.twist_origin['z'] - cp.fshear(eta)
+            data[:,2] += cp.twist_origin['z'] - values['shear']
         except:
             dummy_z = np.reshape(np.zeros(data.shape[0]),(data.shape[0],1))
             data = np.append(data,dummy_z, axis=1)
 
-        # Twisting
-        R = np.transpose(Rotation_euler_vector(cp.twist_axis, cp.ftwist(eta)),(1,0,2))
-        data = np.array([np.dot(R[:,:,l],data[l]) for l in range(len(eta))])
+        # Twisting (inverse rotation of every point at once)
+        data = rotate_points(data, cp.twist_axis, -values['twist'])
 
         # Returning from twist origin
         data[:,0] += cp.twist_origin['x']
@@ -260,18 +294,17 @@ def physical_transformation(data, cp = ControlPoints(), inverse = False):
 
     else:
         eta= data[:,1]/cp.half_span
+        values = cp.interpolate(eta)
         #displacing to center of rotation
         data[:,0] -= cp.twist_origin['x']
         data[:,2] -= cp.twist_origin['z']
 
-        # Twisting
-
-        R = Rotation_euler_vector(cp.twist_axis, cp.ftwist(eta))
-        data = np.array([np.dot(R[:,:,l],data[l]) for l in range(len(eta))])
+        # Twisting (every point at once)
+        data = rotate_points(data, cp.twist_axis, values['twist'])
 
         #Return to position and shear
         data[:,0] -= cp.twist_origin['x']
-        data[:,2] += -cp.twist_origin['z'] + cp.fshear(eta)
+        data[:,2] += -cp.twist_origin['z'] + values['shear']
     return(data)
 
 def assembly_transformation(data, axis_order, origin, inverse=False):
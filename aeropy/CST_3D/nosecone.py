@@ -4,6 +4,7 @@ import numpy as np
 import math
 
 from aeropy.airfoil_module import CST
+from aeropy.geometry.bernstein import bernstein_basis
 
 def taper_function(eta, shape = 'linear', points = {'eta':[0,1], 'chord':[1,.7]}):
     """Calculate chord along span of the wing.
@@ -37,42 +38,28 @@ def CST_3D(Bu, Bl, span, N={'eta':[0,1], 'N1':[.5, .5], 'N2':[1., 1.], 'chord':[
     """
     def S(B, psi, eta):
         """ Cross section shape function. Validated for high dimensions.
-           To debug just verify if it turns all ones when B=ones"""
-        def S_i(r, n, psi):
-            """Shape function"""
-            value = K(r,n)*(psi**r)*(1.-psi)**(n-r)
-            return value
-
-        # Bersntein Polynomial
-        def K(r,n):
-            K=math.factorial(n)/(math.factorial(r)*math.factorial(n-r))
-            return K
-
+           To debug just verify if it turns all ones when B=ones. Output
+           is a matrix with rows for eta and columns for psi."""
+        B = np.asarray(B, dtype=float)
         Nx = len(B)-1
         Ny = len(B[0])-1
 
-        output = 0
-        for i in range(Nx+1):
-            for j in range(Ny+1):
-                output += B[i][j]*S_i(i, Nx, psi)*S_i(j, Ny, eta)
-        return output
+        # sum over i and j of B[i][j]*S_i(i, Nx, psi)*S_i(j, Ny, eta)
+        return np.dot(np.dot(bernstein_basis(eta, Ny), B.T),
+                      bernstein_basis(psi, Nx).T)
 
     def C(N, psi, eta):
-        """Class function"""
-        N1 = interp1d(N['eta'], N['N1'])
-        N2 = interp1d(N['eta'], N['N2'])
-        output = ((psi)**N1(eta))*((1.-psi)**N2(eta))
+        """Class function (rows for eta and columns for psi)"""
+        N1 = interp1d(N['eta'], N['N1'])(eta)[:, np.newaxis]
+        N2 = interp1d(N['eta'], N['N2'])(eta)[:, np.newaxis]
+        output = ((psi)**N1)*((1.-psi)**N2)
         return output
 
     psi = np.linspace(0,1,mesh[0])
     eta = np.linspace(0,1,mesh[1])
 
-    zeta_u = np.zeros(mesh)
-    zeta_l = np.zeros(mesh)
-    for i in range(mesh[0]):
-        for j in range(mesh[1]):
-            zeta_u[j][i] = C(N, psi[i], eta[j])*S(Bu, psi[i], eta[j])
-            zeta_l[j][i] = -C(N, psi[i], eta[j])*S(Bl, psi[i], eta[j])
+    zeta_u = C(N, psi, eta)*S(Bu, psi, eta)
+    zeta_l = -C(N, psi, eta)*S(Bl, psi, eta)
     print(eta)
     print(chord['initial_chord'])
     print(chord['A'])
@@ -263,6 +263,313 @@ def calculate_moment_coefficient(x, y, Cp, alpha, c = 1., x_ref = 0.25,
         Cm += (1./2*c**2)*(Cp['lower'][0])*(((x['lower'][0] + x_ref)/2. - x_ref) *(x_ref - x['lower'][0]) + \
               ((y['lower'][0] + y_ref)/2. - y_ref) *(y_ref - y['lower'][0]))
     return Cm
+
+
+def _panel_indexes(n, i_separator = None, flap = False):
+    """Return arrays with the indexes of the first and last point of each
+    panel that is integrated (including the trailing edge panel for
+    flaps) and the indexes of the upper and lower points next to the
+    hinge (None if not a flap)."""
+    if i_separator is None:
+        if flap:
+            raise Exception('i_separator is necessary for flap = True')
+        start = np.arange(n - 1)
+    else:
+        if type(i_separator) == list:
+            i_upper, i_lower = i_separator
+        else:
+            i_upper, i_lower = i_separator + 1, i_separator + 1
+        start = np.append(np.arange(i_upper - 1), np.arange(i_lower, n - 1))
+    end = start + 1
+    if flap:
+        # Trailing edge, from the last lower point to the first upper point
+        start = np.append(start, n - 1)
+        end = np.append(end, 0)
+        return start, end, (i_upper - 1, i_lower)
+    return start, end, None
+
+class PressureIntegrator():
+    """Integrate pressure coefficients over a fixed geometry. The panel
+    midpoints, lengths and orientations are calculated once, so that
+    forces and moments for any number of Cp distributions (e.g. several
+    angles of attack or Mach numbers) are a single matrix product.
+
+    :param x: x coordinates in xfoil format (counterclockwise starting
+              from the trailing edge).
+    :param y: y coordinates.
+    :param c: chord
+    :param x_ref: x coordinate of the moment reference point
+    :param y_ref: y coordinate of the moment reference point
+    :param flap: if true, includes the trailing edge panel and the panels
+                 between the hinge (x_ref, y_ref) and the surfaces, same
+                 as calculate_moment_coefficient.
+    :param i_separator: see integrate_pressure_coefficients.
+    """
+    def __init__(self, x, y, c = 1., x_ref = 0.25, y_ref = 0., flap = False,
+                 i_separator = None):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        self.n = len(x)
+        self.c = c
+        self.x_ref = x_ref
+        self.y_ref = y_ref
+        self.flap = flap
+
+        start, end, hinge = _panel_indexes(self.n, i_separator, flap)
+        xs, ys, xe, ye = x[start], y[start], x[end], y[end]
+        if flap:
+            # Panels in front of the flap: only the surface point has a
+            # pressure, the other end is the hinge
+            i_upper, i_lower = hinge
+            xs = np.append(xs, [x[i_upper], x_ref])
+            ys = np.append(ys, [y[i_upper], y_ref])
+            xe = np.append(xe, [x_ref, x[i_lower]])
+            ye = np.append(ye, [y_ref, y[i_lower]])
+            hinge_panels = [i_upper, i_lower]
+        else:
+            hinge_panels = []
+        self.dx = xe - xs
+        self.dy = ye - ys
+        self.x_mid = (xs + xe)/2.
+        self.y_mid = (ys + ye)/2.
+
+        # Each row is the geometric weight of every point for the x and y
+        # components of the force and for the moment around the origin.
+        # Regular panels give half their weight to each of their points
+        # (trapezoidal rule) and hinge panels only to the surface point.
+        panels = np.array([self.dx, self.dy,
+                           -(self.x_mid*self.dx + self.y_mid*self.dy)])
+        n_regular = len(start)
+        self.matrix = np.zeros((3, self.n))
+        for i in range(3):
+            self.matrix[i] = np.bincount(start, panels[i, :n_regular],
+                                         minlength=self.n) + \
+                             np.bincount(end, panels[i, :n_regular],
+                                         minlength=self.n)
+            if flap:
+                self.matrix[i] += np.bincount(hinge_panels,
+                                              panels[i, n_regular:],
+                                              minlength=self.n)
+
+    def coefficients(self, Cp, alpha = 0., x_ref = None, y_ref = None):
+        """Calculate the moment, lift and drag coefficients.
+
+        :param Cp: pressure coefficients (n_points) or (n_cases x n_points)
+        :param alpha: angle of attack in degrees, float or array (n_cases)
+        :param x_ref: moment reference point, float or array (n_cases).
+                      If None, the one given to the integrator is used.
+                      Can not be changed for flaps.
+        :param y_ref: same as x_ref for the y coordinate.
+
+        :rtype: dictionary with keys 'Cm', 'Cl' and 'Cd'.
+        """
+        if x_ref is None:
+            x_ref = self.x_ref
+        if y_ref is None:
+            y_ref = self.y_ref
+        if self.flap and (np.any(x_ref != self.x_ref) or
+                          np.any(y_ref != self.y_ref)):
+            raise Exception('The reference point of a flap is the hinge '
+                            'and can not be changed')
+        # Sums of the pressures of the panels times their geometry
+        F = np.dot(np.atleast_2d(np.asarray(Cp, dtype=float)),
+                   self.matrix.T)
+        alpha = np.radians(np.asarray(alpha, dtype=float))
+        x_ref = np.asarray(x_ref, dtype=float)
+        y_ref = np.asarray(y_ref, dtype=float)
+        c = self.c
+
+        Cm = (1./2*c**2)*(F[:, 2] + x_ref*F[:, 0] + y_ref*F[:, 1])
+        Cl = (F[:, 0]*np.cos(alpha) + F[:, 1]*np.sin(alpha))/(2.*c)
+        Cd = -(F[:, 1]*np.cos(alpha) - F[:, 0]*np.sin(alpha))/(2.*c)
+        n_cases = np.broadcast(Cm, Cl).shape
+        return {'Cm': np.broadcast_to(Cm, n_cases),
+                'Cl': np.broadcast_to(Cl, n_cases),
+                'Cd': np.broadcast_to(Cd, n_cases)}
+
+def integrate_pressure_coefficients(x, y, Cp, alpha, c = 1., x_ref = 0.25,
+                                    y_ref = 0., flap = False,
+                                    i_separator = None):
+    """
+    Vectorized integration of the moment, lift and drag coefficients for
+    a stack of pressure distributions in one pass.
+
+    :param x: x coordinates in xfoil format (counterclockwise starting
+              from the trailing edge). Either one array (n_points) shared
+              by all the cases or an array (n_cases x n_points).
+    :param y: y coordinates with the same shape as x.
+    :param Cp: pressure coefficients (n_cases x n_points) or (n_points).
+    :param alpha: angle of attack in degrees, float or array (n_cases).
+    :param x_ref: x coordinate of the moment reference point, float or
+                  array (n_cases).
+    :param y_ref: y coordinate of the moment reference point, float or
+                  array (n_cases).
+    :param i_separator: if None, the whole contour is integrated. If an
+                        int or a list [i_upper, i_lower] only the upper
+                        and lower parts (as defined in
+                        airfoil.separate_upper_lower) are integrated.
+    :param flap: if true, also calculates the contribution from the
+                 trailing edge and the panels in front of the flap (that
+                 are not directly in contact with the air), same as
+                 calculate_moment_coefficient. Requires i_separator.
+
+    :rtype: dictionary with keys 'Cm', 'Cl' and 'Cd', each an array
+            (n_cases). Cm uses the same normalization as
+            calculate_moment_coefficient.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # If the geometry is shared, reuse it through a PressureIntegrator
+    if x.ndim == 1 and (not flap or (np.size(x_ref) == 1 and
+                                     np.size(y_ref) == 1)):
+        integrator = PressureIntegrator(x, y, c, np.ravel(x_ref)[0],
+                                        np.ravel(y_ref)[0], flap,
+                                        i_separator)
+        if flap:
+            return integrator.coefficients(Cp, alpha)
+        return integrator.coefficients(Cp, alpha, x_ref, y_ref)
+
+    Cp = np.atleast_2d(np.asarray(Cp, dtype=float))
+    alpha = np.radians(np.asarray(alpha, dtype=float)).reshape(-1, 1)
+    x_ref = np.asarray(x_ref, dtype=float).reshape(-1, 1)
+    y_ref = np.asarray(y_ref, dtype=float).reshape(-1, 1)
+    # Any of the inputs can define the number of cases
+    n = Cp.shape[1]
+    n_cases = np.broadcast(Cp[:, :1], np.atleast_2d(x)[:, :1], alpha,
+                           x_ref, y_ref).shape[0]
+    Cp = np.broadcast_to(Cp, (n_cases, n))
+    x = np.broadcast_to(x, (n_cases, n))
+    y = np.broadcast_to(y, (n_cases, n))
+
+    start, end, hinge = _panel_indexes(n, i_separator, flap)
+    xs, ys, xe, ye = x[:, start], y[:, start], x[:, end], y[:, end]
+    Cp_sum = Cp[:, start] + Cp[:, end]
+
+    if flap:
+        # Panels between the hinge and the surfaces (each only with the
+        # pressure of the surface point)
+        i_upper, i_lower = hinge
+        zeros = np.zeros((n_cases, 1))
+        ref_x = x_ref + zeros
+        ref_y = y_ref + zeros
+        xs = np.hstack([xs, x[:, [i_upper]], ref_x])
+        ys = np.hstack([ys, y[:, [i_upper]], ref_y])
+        xe = np.hstack([xe, ref_x, x[:, [i_lower]]])
+        ye = np.hstack([ye, ref_y, y[:, [i_lower]]])
+        Cp_sum = np.hstack([Cp_sum, Cp[:, [i_upper]], Cp[:, [i_lower]]])
+
+    dx = xe - xs
+    dy = ye - ys
+    # Moment is independent of the rotation of the coordinates
+    Cm = (1./2*c**2)*np.sum(Cp_sum*(((xs + xe)/2. - x_ref)*(-dx) +
+                                    ((ys + ye)/2. - y_ref)*(-dy)), axis=1)
+    # Forces in the wind frame
+    dx_wind = dx*np.cos(alpha) + dy*np.sin(alpha)
+    dy_wind = dy*np.cos(alpha) - dx*np.sin(alpha)
+    Cl = np.sum(Cp_sum*dx_wind, axis=1)/(2.*c)
+    Cd = -np.sum(Cp_sum*dy_wind, axis=1)/(2.*c)
+    return {'Cm': Cm, 'Cl': Cl, 'Cd': Cd}
+
+def compressibility_correction(Cp, Mach, method = 'Prandtl-Glauert',
+                               gamma = 1.4, elementwise = False):
+    """Correct incompressible pressure coefficients for a whole vector of
+    Mach numbers at once, instead of calling xfoil for each Mach number.
+
+    :param Cp: incompressible pressure coefficients (list or array), or
+               the dictionary output of xfoil_module's
+               find_pressure_coefficients.
+    :param Mach: float or array of (subsonic) Mach numbers.
+    :param method: 'Prandtl-Glauert', 'Karman-Tsien' or 'Laitone'.
+    :param elementwise: if True, Cp and Mach are broadcast against each
+                        other (e.g. one Mach number per Cp) instead of
+                        correcting every Cp for every Mach number.
+
+    :rtype: array (n_Mach x n_points) with the corrected Cp, or the
+            broadcast shape of Cp and Mach if elementwise. If Cp was a
+            dictionary, a copy of it where 'Cp' is the array and with an
+            extra 'Mach' key.
+    """
+    if type(Cp) == dict:
+        output = dict(Cp)
+        output['Cp'] = compressibility_correction(Cp['Cp'], Mach, method,
+                                                  gamma, elementwise)
+        output['Mach'] = np.atleast_1d(np.asarray(Mach, dtype=float))
+        return output
+
+    if elementwise:
+        Cp = np.asarray(Cp, dtype=float)
+        M = np.asarray(Mach, dtype=float)
+    else:
+        Cp = np.atleast_1d(np.asarray(Cp, dtype=float))
+        M = np.atleast_1d(np.asarray(Mach, dtype=float)).reshape(-1, 1)
+    if np.any(M >= 1) or np.any(M < 0):
+        raise Exception('Compressibility corrections are only valid for '
+                        'subsonic Mach numbers')
+    beta = np.sqrt(1. - M**2)
+
+    if method == 'Prandtl-Glauert':
+        return Cp/beta
+    elif method == 'Karman-Tsien':
+        return Cp/(beta + M**2/(1. + beta)*Cp/2.)
+    elif method == 'Laitone':
+        return Cp/(beta + M**2*(1. + (gamma - 1.)/2.*M**2)/(2.*beta)*Cp)
+    else:
+        raise Exception('Compressibility correction method can only be '
+                        'Prandtl-Glauert, Karman-Tsien or Laitone')
+
+def sonic_pressure_coefficient(Mach, gamma = 1.4):
+    """Pressure coefficient for which the local flow is sonic."""
+    M = np.asarray(Mach, dtype=float)
+    return 2./(gamma*M**2)*(((2. + (gamma - 1.)*M**2)/(gamma + 1.))**(
+                            gamma/(gamma - 1.)) - 1.)
+
+def critical_Mach(Cp, method = 'Prandtl-Glauert', gamma = 1.4,
+                  iterations = 60):
+    """Calculate the critical Mach number, where the corrected minimum
+    pressure coefficient is equal to the sonic pressure coefficient.
+
+    :param Cp: incompressible pressure coefficients (n_points) or
+               (n_cases x n_points), or the dictionary output of
+               find_pressure_coefficients.
+    :param method: same as compressibility_correction.
+    :param iterations: number of bisection iterations after bracketing
+                       (all cases are solved simultaneously).
+
+    :rtype: float, or array (n_cases) for 2D inputs. nan if there is no
+            suction peak to become sonic.
+    """
+    if type(Cp) == dict:
+        Cp = Cp['Cp']
+    Cp = np.asarray(Cp, dtype=float)
+    Cp_min = np.min(np.atleast_2d(Cp), axis=1)
+
+    def f(M):
+        # M has one Mach number per case (or is broadcast against them)
+        Cp_corrected = compressibility_correction(Cp_min, M, method, gamma,
+                                                  elementwise = True)
+        return Cp_corrected - sonic_pressure_coefficient(M, gamma)
+
+    # Bracket the first crossing on a coarse grid (Karman-Tsien and
+    # Laitone become singular close to Mach 1, so the crossing can not be
+    # bracketed by the bounds of the domain)
+    grid = np.linspace(1e-3, 1. - 1e-6, 200)
+    f_grid = f(grid[:, np.newaxis])
+    crossed = f_grid <= 0
+    valid = np.any(crossed, axis=0) & (f_grid[0] > 0)
+    i_crossing = np.argmax(crossed, axis=0)
+    lower = grid[np.maximum(i_crossing - 1, 0)]
+    upper = grid[i_crossing]
+    for i in range(iterations):
+        middle = (lower + upper)/2.
+        f_middle = f(middle)
+        positive = f_middle > 0
+        lower = np.where(positive, middle, lower)
+        upper = np.where(positive, upper, middle)
+    M_crit = np.where(valid, (lower + upper)/2., np.nan)
+    if Cp.ndim < 2:
+        return M_crit[0]
+    return M_crit
+
 #==============================================================================
 # Functions Intended for use with FInite ELement Methods
 #==============================================================================
@@ -367,6 +674,128 @@ def pressure_shell(Data, half_span, chord = 'MAX', air_density = 0, Velocity = 0
                                               Data['Pressure'][i]), )
         return PressureDistribution
 
+def pressure_slabs(Data, half_span, chord = 'MAX', air_density = 0,
+                   Velocity = 0, N = 10, thickness = 0,
+                   llt_distribution = False, distribution = 'Uniform',
+                   amplifier = 1, chunk_size = 1):
+    """Lazily generate the same 3D pressure field as pressure_shell, one
+       slab of spanwise stations at a time. Only the 2D section and the
+       current slab are kept in memory, so memory does not grow with N.
+
+       :param chunk_size: number of spanwise stations in each slab.
+
+       The other inputs are the same as for pressure_shell. Each yielded
+       slab is a numpy array with columns x, y, z and pressure."""
+    x = np.asarray(Data['x'], dtype=float)
+    y = np.asarray(Data['y'], dtype=float)
+
+    if chord == 'MAX':
+        chord = x.max()
+    # If data is in the form of pressure coefficients, convert to pressure
+    if 'Cp' in Data.keys():
+        pressure = np.asarray(Data['Cp'], dtype=float)*0.5*air_density* \
+                   Velocity**2*chord
+    else:
+        pressure = np.asarray(Data['Pressure'], dtype=float)
+
+    x = (chord - 2.*thickness)*x + thickness
+    y = (chord - 2.*thickness)*y
+    n = len(x)
+
+    for j_start in range(0, N, chunk_size):
+        j = np.arange(j_start, min(j_start + chunk_size, N))
+        if N > 1:
+            z = half_span*j/(N - 1.)
+        else:
+            z = np.zeros(len(j))
+
+        if distribution == 'Elliptical':
+            factor = amplifier*np.sqrt(1. - (z/half_span)**2)
+        elif distribution == 'LLT':
+            factor = amplifier*np.asarray(llt_distribution,
+                                          dtype=float).ravel()[j]
+        elif distribution == 'Uniform':
+            factor = amplifier*np.ones(len(j))
+        else:
+            raise Exception('Distribution can only be Uniform, Elliptical'
+                            ' or LLT')
+
+        slab = np.empty((len(j)*n, 4))
+        slab[:, 0] = np.tile(x, len(j))
+        slab[:, 1] = np.tile(y, len(j))
+        slab[:, 2] = np.repeat(z, n)
+        slab[:, 3] = np.outer(factor, pressure).ravel()
+        yield slab
+
+def write_pressure_field(Data, half_span, filename = 'Pressure_shell.txt',
+                         output = 'txt', N = 10, chunk_size = 10,
+                         load_label = 'P', element_offset = 1,
+                         elements = None, **kwargs):
+    """Stream the 3D pressure field of pressure_slabs to a file, chunk by
+       chunk, so that load cases with many spanwise stations never need
+       to be fully expanded in memory.
+
+       :param output: format of the file:
+                      - 'txt': tab separated x, y, z and pressure (same
+                        as pressure_shell with txt=True)
+                      - 'abaqus': *DLOAD input with one line per point:
+                        element label, load_label and the magnitude.
+                      - 'npy': binary numpy file with a (N*len(x), 4)
+                        array that can be read with numpy.load (also
+                        with mmap_mode).
+       :param elements: for 'abaqus', label of the element of the mesh
+                        where each point is applied (N*len(x) labels in
+                        the order of the points: all of x for each
+                        spanwise station). The points are not elements,
+                        so the mapping has to come from the caller's
+                        mesh.
+       :param element_offset: if elements is None, the labels are
+                        consecutive starting at element_offset, which is
+                        only valid for a mesh numbered with one element
+                        per point in the same order.
+
+       The remaining keyword arguments are passed to pressure_slabs.
+       Returns the number of points written."""
+    n = len(Data['x'])
+    slabs = pressure_slabs(Data, half_span, N = N, chunk_size = chunk_size,
+                           **kwargs)
+    count = 0
+    if output == 'txt':
+        with open(filename, 'w') as DataFile:
+            for slab in slabs:
+                np.savetxt(DataFile, slab, fmt = '%f', delimiter = '\t')
+                count += len(slab)
+    elif output == 'abaqus':
+        if elements is not None:
+            elements = np.asarray(elements, dtype=int).ravel()
+            if len(elements) != N*n:
+                raise Exception('elements needs one label per point (%i)'
+                                % (N*n))
+        line = '%i, ' + load_label.replace('%', '%%') + ', %f'
+        with open(filename, 'w') as DataFile:
+            DataFile.write('*DLOAD\n')
+            for slab in slabs:
+                if elements is None:
+                    labels = np.arange(count, count + len(slab)) + \
+                             element_offset
+                else:
+                    labels = elements[count:count + len(slab)]
+                np.savetxt(DataFile, np.column_stack([labels, slab[:, 3]]),
+                           fmt = line)
+                count += len(slab)
+    elif output == 'npy':
+        header = {'descr': np.lib.format.dtype_to_descr(np.dtype(float)),
+                  'fortran_order': False, 'shape': (N*n, 4)}
+        with open(filename, 'wb') as DataFile:
+            np.lib.format.write_array_header_1_0(DataFile, header)
+            for slab in slabs:
+                DataFile.write(np.ascontiguousarray(slab).tobytes())
+                count += len(slab)
+    else:
+        raise Exception('write_pressure_field can only output txt, abaqus'
+                        ' and npy files')
+    return count
+
 def pressure_shell_2D(Data, chord, thickness, half_span, height, Velocity, N,
                       txt=False):
     """Calculate pressure field for a 2D Shell."""
@@ -464,14 +893,133 @@ def air_properties(height, unit='feet'):
             'Atmospheric Temperature': T, 'R air': R_air,
             'Atmospheric Pressure': P}
 
-def Reynolds(height, V, c):
-    """Simple function to calculate Reynolds for a given height.
+#==============================================================================
+# International Standard Atmosphere (ISA) up to 86 km
+#==============================================================================
+# Base geopotential height (m), temperature lapse rate (K/m) and base
+# temperature (K) of each layer of the 1976 US Standard Atmosphere
+ISA_layers = {'height': np.array([0., 11000., 20000., 32000., 47000., 51000.,
+                                  71000., 84852.]),
+              'lapse': np.array([-0.0065, 0., 0.001, 0.0028, 0., -0.0028,
+                                 -0.002, 0.]),
+              'temperature': np.array([288.15, 216.65, 216.65, 228.65,
+                                       270.65, 270.65, 214.65, 186.946])}
+
+def atmosphere(height, unit='feet', table=None):
+    """Vectorized International Standard Atmosphere for all the layers up
+    to 86 km (geometric). height can be a float or an array of any shape
+    and all the outputs have the same shape.
+
+    :param unit: 'feet' or 'meter'
+    :param table: optional output of atmosphere_table. If given, the
+                  properties are linearly interpolated from the table
+                  instead of being calculated from the layer equations,
+                  which is faster for large repeated queries.
+
+    :rtype: dictionary with the same keys as air_properties and also
+            'Speed of Sound'.
+    """
+    height = np.asarray(height, dtype=float)
+    if unit == 'feet':
+        height = 0.3048*height
+    elif unit != 'meter':
+        raise Exception('atmosphere can only understand feet and meters')
+
+    if table is not None:
+        output = {'R air': table['R air']}
+        for key in ['Atmospheric Temperature', 'Dynamic Viscosity',
+                    'Speed of Sound']:
+            output[key] = np.interp(height, table['height'], table[key])
+        # Pressure and density vary exponentially, so interpolate the log
+        for key in ['Atmospheric Pressure', 'Density']:
+            output[key] = np.exp(np.interp(height, table['height'],
+                                           np.log(table[key])))
+        return output
+
+    #==================================================================
+    # Constants (same as air_properties)
+    #==================================================================
+    P0 = 101325. # Pa
+    g = 9.80665 # m/s2
+    R = 8.31447 # J/(mol K)
+    M = 0.0289644 #kg/mol
+    R_air = R/M
+    C1 = 1.458e-6 #kg/m.s.sqrt(K)
+    C2 = 110.4 #K
+    gamma = 1.4
+    # Earth radius for the geopotential height
+    r0 = 6356766. # m
+
+    H_b = ISA_layers['height']
+    L_b = ISA_layers['lapse']
+    T_b = ISA_layers['temperature']
+    # Base pressure of each layer
+    P_b = np.zeros(len(H_b))
+    P_b[0] = P0
+    for i in range(1, len(H_b)):
+        dH = H_b[i] - H_b[i-1]
+        if L_b[i-1] == 0:
+            P_b[i] = P_b[i-1]*np.exp(-g*M*dH/(R*T_b[i-1]))
+        else:
+            P_b[i] = P_b[i-1]*(T_b[i-1]/T_b[i])**(g*M/(R*L_b[i-1]))
+
+    # Geopotential height and layer of each point
+    H = r0*height/(r0 + height)
+    i = np.clip(np.searchsorted(H_b, H, side='right') - 1, 0, len(H_b) - 1)
+    L = L_b[i]
+    dH = H - H_b[i]
+
+    #==================================================================
+    # Temperature and pressure
+    #==================================================================
+    T = T_b[i] + L*dH
+    isothermal = L == 0
+    # The isothermal layers are calculated with a dummy lapse rate
+    L = np.where(isothermal, 1., L)
+    P = np.where(isothermal,
+                 P_b[i]*np.exp(-g*M*dH/(R*T_b[i])),
+                 P_b[i]*(T_b[i]/T)**(g*M/(R*L)))
+
+    density = P*M / (R*T)
+    dyn_viscosity = (C1 * T**(3./2)) / (T+C2)
+    speed_of_sound = np.sqrt(gamma*R_air*T)
+
+    return {'Density': density, 'Dynamic Viscosity': dyn_viscosity,
+            'Atmospheric Temperature': T, 'R air': R_air,
+            'Atmospheric Pressure': P, 'Speed of Sound': speed_of_sound}
+
+def atmosphere_table(max_height=86000., n=8601, unit='meter'):
+    """Precompute atmosphere at n equally spaced heights from sea level
+    to max_height. The output can be given to atmosphere (table=) or to
+    Reynolds for fast interpolated queries. Heights in the table are
+    always stored in meters."""
+    if unit == 'feet':
+        max_height = 0.3048*max_height
+    elif unit != 'meter':
+        raise Exception('atmosphere_table can only understand feet and'
+                        ' meters')
+    heights = np.linspace(0., max_height, n)
+    table = atmosphere(heights, unit='meter')
+    table['height'] = heights
+    return table
+
+def Reynolds(height, V, c, ISA=False, table=None):
+    """Simple function to calculate Reynolds for a given height (feet).
+    height, V and c can also be arrays, so that a whole flight envelope
+    is calculated at once.
+
+    :param ISA: if True, use the vectorized atmosphere function (all ISA
+                layers) instead of air_properties (only troposphere).
+    :param table: output of atmosphere_table, implies ISA.
 
     @author: Pedro Leal
     Created in Jul 17 2015
     """
-
-    Air_Data = air_properties(height, unit='feet')
+    if ISA or table is not None:
+        Air_Data = atmosphere(height, unit='feet', table=table)
+    else:
+        Air_Data = air_properties(np.asarray(height, dtype=float),
+                                  unit='feet')
     rho = Air_Data['Density']
     L = c
     nu = Air_Data['Dynamic Viscosity']
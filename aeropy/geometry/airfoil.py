@@ -4,6 +4,7 @@ Created on Fri Oct 09 17:31:59 2015
 
 Current functionalities:
 - CST
+- NACA four digit, modified four digit and five digit families
 - flaps
 - rotate
 @author: Pedro Leal
@@ -13,16 +14,20 @@ from __future__ import print_function
 import math
 import numpy as np
 
+from aeropy.geometry.bernstein import bernstein_basis, class_function, \
+                                     CST_basis, CST_surface
+
 def create_x(c, n = 230, distribution = 'linear'):
     """ Create set of points along the chord befitting for Xfoil. The x
     output is conviniently ordered from TE to LE.
 
     :param c: float value for the chord.
     :param n: number of points
-    :param distribution: linear or polar. linear uses a given delta x to
-           find the values of x. Polar uses a delta theta to find values
-           of theta that are then used in a circle equation to find the
-           x points. Usuallly good for airfoils.
+    :param distribution: linear, polar or adaptive. linear uses a given
+           delta x to find the values of x. Polar uses a delta theta to
+           find values of theta that are then used in a circle equation to
+           find the x points. Usuallly good for airfoils. adaptive places
+           the points by curvature and arc length (see adaptive_x).
     
     :rtype: x: numpy.array of values of x
     
@@ -65,9 +70,9 @@ def create_x(c, n = 230, distribution = 'linear'):
         nose_tip = 0.003*c
     
         # Amount of points for each part (this distribution is empirical)
-        N_tip = 10*n/230
-        N_middle = 180*n/230
-        N_endbody = 40*n/230
+        N_tip = 10*n//230
+        N_middle = 180*n//230
+        N_endbody = 40*n//230
     
         x_endbody = np.linspace(c, limit, N_endbody)
         x_middle = np.linspace(limit, nose_tip, N_middle)
@@ -84,8 +89,92 @@ def create_x(c, n = 230, distribution = 'linear'):
         theta = np.linspace(0, math.pi,n)
         
         x = x0 + r*np.cos(theta)
+
+    elif distribution == 'adaptive':
+        x = adaptive_x(c, n)
     return x
 
+def adaptive_x(c, n = 100, shape = None, curvature_weight = 1.,
+               LE_weight = 0., TE_weight = 1., tolerance = None,
+               n_min = 20, n_samples = 2000):
+    """Create a set of points along the chord (ordered from TE to LE, as
+    create_x) distributed by the curvature and arc length of a surface.
+
+    The density of points along the arc length is proportional to
+    1 + curvature_weight*sqrt(|kappa|*c) plus exponential clustering
+    terms at the leading and trailing edges, so flat regions get few
+    points and the leading edge gets many.
+
+    :param c: chord
+    :param n: number of points, or maximum number of points (panel
+           budget) if a tolerance is given.
+    :param shape: surface used to calculate the curvature. Function of x
+           (e.g. lambda x: CST(x, c, deltasz=0, Au=Au)), dictionary with
+           dense x and y keys, or None for a NACA 0012.
+    :param curvature_weight: weight of the curvature term.
+    :param LE_weight, TE_weight: weights of the extra clustering at the
+           leading and trailing edges.
+    :param tolerance: maximum distance (normalized by the chord) between
+           the surface and its linear interpolation at the points. If
+           given, the smallest number of points between n_min and n that
+           satisfies it is used.
+    :param n_samples: number of points used to sample the surface.
+
+    :rtype: x: numpy.array of values of x
+    """
+    # Sample the surface densely (cosine spacing so that the sqrt-like
+    # leading edge is smooth in the parameter beta)
+    beta = np.linspace(0., np.pi, n_samples)
+    if type(shape) == dict:
+        x_s = np.asarray(shape['x'], dtype=float)
+        y_s = np.asarray(shape['y'], dtype=float)
+        order = np.argsort(x_s)
+        x_s, y_s = x_s[order], y_s[order]
+        beta = np.arccos(1. - 2.*x_s/c)
+    else:
+        x_s = c*(1. - np.cos(beta))/2.
+        if shape is None:
+            y_s = c*NACA_thickness(x_s/c, 0.12)
+        else:
+            y_s = np.asarray(shape(x_s), dtype=float)
+
+    # Curvature and arc length along the parameter
+    dx = np.gradient(x_s, beta)
+    dy = np.gradient(y_s, beta)
+    ddx = np.gradient(dx, beta)
+    ddy = np.gradient(dy, beta)
+    kappa = np.abs(dx*ddy - dy*ddx)/(dx**2 + dy**2)**1.5
+    ds = np.sqrt(np.diff(x_s)**2 + np.diff(y_s)**2)
+
+    density = 1. + curvature_weight*np.sqrt(kappa*c) + \
+              LE_weight*np.exp(-x_s/(0.02*c)) + \
+              TE_weight*np.exp(-(c - x_s)/(0.05*c))
+    W = np.append(0., np.cumsum(0.5*(density[1:] + density[:-1])*ds))
+
+    def distribute(n_points):
+        return np.interp(np.linspace(0., W[-1], n_points), W, x_s)
+
+    def error(x):
+        # Distance between the surface and the interpolated surface
+        y = np.interp(x, x_s, y_s)
+        return np.max(np.abs(np.interp(x_s, x, y) - y_s))/c
+
+    if tolerance is None or error(distribute(n)) > tolerance:
+        x = distribute(n)
+    else:
+        # Bisection on the number of points
+        lower, upper = n_min, n
+        while upper - lower > 1:
+            middle = (lower + upper)//2
+            if error(distribute(middle)) > tolerance:
+                lower = middle
+            else:
+                upper = middle
+        x = distribute(upper)
+    x[0] = 0.
+    x[-1] = c
+    return x[::-1]
+
 #===========================================================================
 # The following functions are related to creating the airfoil outer mold
 #===========================================================================
@@ -143,21 +232,6 @@ def CST(x, c, deltasz=None, Au=None, Al=None, N1=0.5, N2=1., deltasLE=None):
     @author: Pedro Leal
     """
     
-    # Bersntein Polynomial
-    def K(r,n):
-        K=math.factorial(n)/(math.factorial(r)*math.factorial(n-r))
-        return K
-    
-    # Shape Function   
-    def S(r,n,psi):
-        S=K(r,n)*(psi**r)*(1.-psi)**(n-r)
-        return S
-    
-    # Class Function    
-    def C(N1,N2,psi):
-        C=((psi)**N1)*((1.-psi)**N2)
-        return C
-    
     if type(x)==list:
         x=np.array(x)
     # Adimensionalizing
@@ -168,7 +242,7 @@ def CST(x, c, deltasz=None, Au=None, Al=None, N1=0.5, N2=1., deltasLE=None):
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~    
     # The Coefficients for an airfoil with a rounded leading edge and a sharp
     # trailing edge are N1=0.5 and N2=1.0.
-    C=C(N1,N2,psi);
+    C=class_function(psi, N1, N2)
     
     #==========================================================================
     #                   Defining the working surfaces
@@ -231,14 +305,9 @@ def CST(x, c, deltasz=None, Au=None, Al=None, N1=0.5, N2=1., deltasLE=None):
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     #                           Shape Function
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~  
-            Shape[surface]=0    
-            for i in range(len(A[surface])):
-#                print A
-#                print S(i,n,psi)
-                if surface=='l':
-                    Shape[surface]-=A[surface][i]*S(i,n,psi)
-                else:
-                    Shape[surface]+=A[surface][i]*S(i,n,psi)
+            Shape[surface]=np.dot(bernstein_basis(psi, n), A[surface])
+            if surface=='l':
+                Shape[surface]=-Shape[surface]
     
     #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     #                           Airfoil Shape (eta=z/c)
@@ -257,6 +326,205 @@ def CST(x, c, deltasz=None, Au=None, Al=None, N1=0.5, N2=1., deltasLE=None):
     else:
         return y['l']
 
+def CST_batch(x, c, deltasz=None, Au=None, Al=None, N1=0.5, N2=1.,
+              deltasLE=None):
+    """Batched version of CST for many designs evaluated on the same x.
+
+    :param x: list or numpy.array of points along the chord.
+    :param c: chord
+    :param deltasz: trailing edge thicknesses. Array (n_designs x 2) with
+                    upper and lower values if both surfaces are analyzed,
+                    (n_designs,) if only one surface is given, or a
+                    scalar/pair shared by all designs. None is zero.
+    :param Au: array (n_designs x n_coeffs) of upper shape coefficients.
+    :param Al: array (n_designs x n_coeffs) of lower shape coefficients.
+    :param deltasLE: leading edge thicknesses, same format as deltasz.
+
+    :rtype: same structure as CST (dictionary with 'u' and 'l' or a single
+            surface), but each surface is an array (n_designs x n_points).
+            All designs are calculated with a single product with the
+            Bernstein basis of x (cached between calls).
+    """
+    def surface_function(psi, A, deltaz, deltaLE):
+        return CST_surface(psi, A, N1, N2, deltaz, deltaLE)
+    return surfaces_batch(x, c, deltasz, Au, Al, deltasLE, surface_function)
+
+def surfaces_batch(x, c, deltasz, Au, Al, deltasLE, surface_function):
+    """Shared part of the batched parameterizations (CST_batch and the
+    B-spline and Hicks-Henne versions in other_methods): splits the
+    thicknesses per surface, inverts the lower surface and gives back the
+    dimensions.
+
+    :param surface_function: function (psi, A, deltaz, deltaLE) that
+           returns the non-dimensional surface (n_designs x n_points) for
+           an array A (n_designs x n_coeffs) and deltaz and deltaLE
+           floats or arrays with one value per design.
+    """
+    psi = np.asarray(x, dtype=float)/c
+    A = {'u':Au, 'l':Al}
+    surfaces = [surface for surface in ['u','l'] if A[surface] is not None]
+    if not surfaces:
+        raise Exception("Au or Al need to have at least one value")
+
+    def per_surface(delta):
+        # Split thicknesses in a (n_designs,) or scalar value per surface
+        if delta is None:
+            return {'u':0., 'l':0.}
+        delta = np.asarray(delta, dtype=float)/c
+        if len(surfaces) == 2:
+            return {'u':delta[..., 0], 'l':delta[..., 1]}
+        return {surfaces[0]:delta}
+    deltaz = per_surface(deltasz)
+    deltaLE = per_surface(deltasLE)
+
+    y = {}
+    for surface in surfaces:
+        A[surface] = np.atleast_2d(np.asarray(A[surface], dtype=float))
+        eta = surface_function(psi, A[surface], deltaz[surface],
+                               deltaLE[surface])
+        if surface == 'l':
+            eta = -eta
+        y[surface] = c*eta
+    if len(surfaces) == 2:
+        if y['u'].shape != y['l'].shape:
+            raise Exception("Au and Al need to have the same dimensions")
+        return y
+    return y[surfaces[0]]
+
+def CST_jacobian(x, c, A, N1=0.5, N2=1., surface='u'):
+    """Analytic derivatives of one CST surface (same convention as CST)
+    with respect to its parameters.
+
+    :param x: list or numpy.array of points along the chord.
+    :param c: chord
+    :param A: list/array of shape coefficients of the surface.
+    :param surface: 'u' or 'l'. The lower surface has all signs inverted.
+
+    :rtype: dictionary with the derivatives of y at each x:
+            - 'A': matrix (n_points x len(A)), dy/dA_i
+            - 'N1' and 'N2': dy/dN1 and dy/dN2
+            - 'deltaz' and 'deltaLE': dy/ddeltasz and dy/ddeltasLE
+
+    The derivatives with respect to N1 and N2 go to zero at the leading
+    and trailing edges (psi**N1*log(psi) -> 0).
+    """
+    psi = np.asarray(x, dtype=float)/c
+    A = np.atleast_1d(np.asarray(A, dtype=float))
+    sign = -1. if surface == 'l' else 1.
+
+    dA = sign*c*CST_basis(psi, len(A) - 1, N1, N2)
+    xi = np.dot(dA, A)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dN1 = np.where(psi > 0., xi*np.log(psi), 0.)
+        dN2 = np.where(psi < 1., xi*np.log(1. - psi), 0.)
+    return {'A': dA, 'N1': dN1, 'N2': dN2,
+            'deltaz': sign*psi, 'deltaLE': sign*(1. - psi)}
+
+def least_squares_shape_coefficients(upper, lower, order, N1=0.5, N2=1.,
+                                     deltaz=0., bounds=None,
+                                     optimize_deltaz=False):
+    """Fit the shape coefficients of both surfaces for fixed N1 and N2.
+
+    For fixed class coefficients the CST surfaces are linear in Au, Al
+    and deltaz, so the fit is a linear least-squares problem solved
+    directly with the Bernstein basis instead of a global optimizer.
+
+    :param upper: dictionary with normalized x and y keys (upper surface).
+    :param lower: dictionary with normalized x and y keys (lower surface).
+    :param order: order of the Bernstein polynomials.
+    :param deltaz: trailing edge thickness (each surface has deltaz/2).
+    :param bounds: None for an unbounded fit (lstsq), or a list of
+           [min, max] pairs for Au + Al (+ deltaz) solved with a bounded
+           variable least-squares (BVLS) solver.
+    :param optimize_deltaz: if True, deltaz is also fitted.
+
+    :rtype: Au, Al, deltaz, error where error is the sum of the squared
+            residuals of both surfaces.
+    """
+    x_u = np.asarray(upper['x'], dtype=float)
+    x_l = np.asarray(lower['x'], dtype=float)
+    y_u = np.asarray(upper['y'], dtype=float)
+    y_l = np.asarray(lower['y'], dtype=float)
+    n_u = len(x_u)
+
+    # Rows: upper points followed by the lower points. Columns: Au, Al
+    # and (if fitted) deltaz
+    M = np.zeros((n_u + len(x_l), 2*order + 2 + int(optimize_deltaz)))
+    M[:n_u, :order+1] = CST_basis(x_u, order, N1, N2)
+    M[n_u:, order+1:2*order+2] = -CST_basis(x_l, order, N1, N2)
+    if optimize_deltaz:
+        M[:n_u, -1] = x_u/2.
+        M[n_u:, -1] = -x_l/2.
+        b = np.concatenate([y_u, y_l])
+    else:
+        b = np.concatenate([y_u - x_u*deltaz/2., y_l + x_l*deltaz/2.])
+
+    if bounds is None:
+        solution = np.linalg.lstsq(M, b, rcond=None)[0]
+    else:
+        from scipy.optimize import lsq_linear
+        bounds = np.asarray(bounds, dtype=float)
+        solution = lsq_linear(M, b, bounds=(bounds[:, 0], bounds[:, 1]),
+                              method='bvls').x
+    residual = np.dot(M, solution) - b
+
+    Au = solution[:order+1]
+    Al = solution[order+1:2*order+2]
+    if optimize_deltaz:
+        deltaz = solution[-1]
+    return Au, Al, deltaz, np.dot(residual, residual)
+
+def cosine_spacing(c = 1., n = 100):
+    """Points from the leading edge (0) to the trailing edge (c) clustered
+    at both edges (x = c*(1 - cos(beta))/2 for beta evenly spaced)."""
+    return c*(1. - np.cos(np.linspace(0., np.pi, n)))/2.
+
+def NACA_thickness(xc, t, TE_t = False, I = None, T = None):
+    """Half thickness of the NACA four digit family (y/c).
+
+    :param xc: array of x/c.
+    :param t: max thickness normalized by the chord. Float or array
+              (n_airfoils,), in which case the output is (n_airfoils x
+              len(xc)).
+    :param TE_t: trailing edge thickness (only for the standard family).
+                 If False it is the standard thickness for a NACA airfoil.
+    :param I: leading edge radius index of the modified four digit family
+              (e.g. 6 for NACA 0012-64). If None, standard family.
+    :param T: chordwise position (tenths of the chord) of the maximum
+              thickness for the modified family (e.g. 4 for 0012-64).
+    """
+    xc = np.asarray(xc, dtype=float)
+    t = np.asarray(t, dtype=float)[..., np.newaxis]
+    if I is None:
+        if TE_t == False:
+            a4 = -0.1015
+        else:
+            a4 = TE_t/(10*t) - 0.1036
+        return 5*t*(0.2969*np.sqrt(xc) - 0.1260*xc - 0.3516*xc**2 +
+                    0.2843*xc**3 + a4*xc**4)
+
+    # Modified four digit family (NASA TM X-3284): forward polynomial
+    # a0*sqrt(x) + a1*x + a2*x^2 + a3*x^3 and aft polynomial
+    # d0 + d1*(1-x) + d2*(1-x)^2 + d3*(1-x)^3 joined at x = m
+    I = np.asarray(I, dtype=float)[..., np.newaxis]
+    m = np.asarray(T, dtype=float)[..., np.newaxis]/10.
+    a0 = np.where(I < 9, 0.296904*I/6., 0.296904*np.sqrt(3.))
+    d0 = 0.002
+    d1 = np.interp(m, [0.2, 0.3, 0.4, 0.5, 0.6],
+                   [0.200, 0.234, 0.315, 0.465, 0.700])
+    s = 1. - m
+    # y(m) = 0.1 and y'(m) = 0 for the aft polynomial
+    d3 = (d1*s - 2*(0.1 - d0))/s**3
+    d2 = (0.1 - d0 - d1*s - d3*s**3)/s**2
+    # Same value, slope and curvature at m for the forward polynomial
+    curvature = 2*d2 + 6*d3*s
+    a3 = (curvature - 0.75*a0/m**1.5 + 0.2/m**2)/(2*m)
+    a2 = (0.5*a0*np.sqrt(m) - 2*a3*m**3 - 0.1)/m**2
+    a1 = -0.5*a0/np.sqrt(m) - 2*a2*m - 3*a3*m**2
+    forward = a0*np.sqrt(xc) + a1*xc + a2*xc**2 + a3*xc**3
+    aft = d0 + d1*(1 - xc) + d2*(1 - xc)**2 + d3*(1 - xc)**3
+    return 5*t*np.where(xc < m, forward, aft)
+
 def Naca00XX(c, t, x_list, TE_t = False, return_dict = 'y', for_xfoil = True):
     """
     Generates a simetric NACA airfoil.
@@ -276,53 +544,17 @@ def Naca00XX(c, t, x_list, TE_t = False, return_dict = 'y', for_xfoil = True):
     
     @author: Endryws and Pedro Leal
     """
-    y_upper = []
-    y_lower = []
+    def half_thickness(x):
+        xc = np.asarray(x, dtype=float)/c
+        return (c*NACA_thickness(xc, t, TE_t)).tolist()
+
     if type(x_list) == list:
-        for x in x_list:
-            xc= x/c # Is just for increase speed and facilitate future changes.
-            a1 = 5*t*c
-            t1 = 0.2969*(math.sqrt(xc))
-            t2 = -0.1260*xc
-            t3 = -0.3516*(xc**2)
-            t4 = 0.2843*(xc**3)
-            if TE_t == False:
-                t5 = -0.1015*(xc**4)
-            else:
-                t5 = (TE_t/(10*t) - 0.1036)*(xc**4)
-            y = (a1*(t1+t2+t3+t4+t5))
-            y_upper.append(y)
-            y_lower.append(y*(-1)) # is just for pick the y axis
-                                           # negative numbers
+        y_upper = half_thickness(x_list)
+        y_lower = [-y for y in y_upper] # is just for pick the y axis
+                                        # negative numbers
     elif type(x_list) == dict:
-        for x in x_list['u']:
-            xc= x/c # Is just for increase speed and facilitate future changes.
-            a1 = 5*t*c
-            t1 = 0.2969*(math.sqrt(xc))
-            t2 = -0.1260*xc
-            t3 = -0.3516*(xc**2)
-            t4 = 0.2843*(xc**3)
-            if TE_t == False:
-                t5 = -0.1015*(xc**4)
-            else:
-                t5 = (TE_t/(10*t) - 0.1036)*(xc**4)
-            y = (a1*(t1+t2+t3+t4+t5))
-            y_upper.append(y)
-
-        for x in x_list['l']:
-            xc= x/c # Is just for increase speed and facilitate future changes.
-            a1 = 5*t*c
-            t1 = 0.2969*(math.sqrt(xc))
-            t2 = -0.1260*xc
-            t3 = -0.3516*(xc**2)
-            t4 = 0.2843*(xc**3)
-            if TE_t == False:
-                t5 = -0.1015*(xc**4)
-            else:
-                t5 = (TE_t/(10*t) - 0.1036)*(xc**4)
-            y = (a1*(t1+t2+t3+t4+t5))
-            y_lower.append(y*(-1)) # is just for pick the y axis
-                                           # negative numbers
+        y_upper = half_thickness(x_list['u'])
+        y_lower = [-y for y in half_thickness(x_list['l'])]
     if len(x_list) == 1:
         y = {'u': y_upper[0],
              'l': y_lower[0]}        
@@ -349,97 +581,268 @@ def Naca00XX(c, t, x_list, TE_t = False, return_dict = 'y', for_xfoil = True):
         elif type(x_list) == dict:
             return x_list, y
 
-def NACA_four_digit(chord, t, p, m):
-
-    # Mean line coordinates
-    x_fwd = np.linspace(0,p*chord)
-    x_aft = np.linspace(p*chord, chord)
+def _NACA_coordinates(x, c, yc, dyc, yt):
+    """Upper and lower surfaces with the thickness perpendicular to the
+    mean line (all inputs normalized by the chord c)."""
+    theta = np.arctan(dyc)
+    upper = {'x': c*(x - yt*np.sin(theta)), 'y': c*(yc + yt*np.cos(theta))}
+    lower = {'x': c*(x + yt*np.sin(theta)), 'y': c*(yc - yt*np.cos(theta))}
+    return upper, lower
+
+def _squeeze(surfaces, *parameters):
+    """Return single airfoils (all parameters scalars) as 1D arrays."""
+    if all(np.ndim(parameter) == 0 for parameter in parameters):
+        for surface in surfaces:
+            for key in surface:
+                surface[key] = surface[key].reshape(-1)
+    return surfaces
+
+def NACA_four_digit(chord, t, p, m, n = 100, I = None, T = None,
+                    TE_t = False):
+    """NACA four digit (and modified four digit) airfoils.
+
+    :param chord: chord
+    :param t: max thickness normalized by the chord (t/c)
+    :param p: position of the maximum camber normalized by the chord
+    :param m: maximum camber normalized by the chord
+    :param n: number of points per surface (cosine spacing from the
+              leading to the trailing edge).
+    :param I, T: leading edge radius index and position of maximum
+              thickness (tenths of chord) of the modified family.
+    :param TE_t: trailing edge thickness (see Naca00XX).
 
-    y_fwd = (m/p**2)*(2*p*(x/chord)-(x/chord)**2)
-    y_aft = (m/(1-p)**2)*((1-2*p)+2*p*(x/chord)-(x/chord)**2)
+    t, p, m (and I, T) can be floats or arrays with one value per airfoil.
+    All the airfoils are calculated at once.
 
-    # Thickness coordinates
-    yt_fwd = Naca00XX(chord, t, x_fwd)
-    yt_aft = Naca00XX(chord, t, x_fwd)
+    :rtype: upper and lower dictionaries with x and y keys. For arrays of
+            parameters each value is a matrix (n_airfoils x n).
 
-    # Angle calculation so that thickness is perpendicular
-    dydx_fwd = (2*m/p**2)*(p-x/chord)
-    dydx_aft = (2*m/(1-p)**2)*(p-x/chord)
+    >>> upper, lower = NACA_four_digit(1., 0.12, 0.4, 0.02) # NACA 2412
+    """
+    x = cosine_spacing(1., n)
+    p_i = np.asarray(p, dtype=float)[..., np.newaxis]
+    m_i = np.asarray(m, dtype=float)[..., np.newaxis]
+    # Symmetric airfoils (m = 0) have p = 0
+    p_i = np.where(m_i == 0, 0.5, p_i)
+
+    forward = x < p_i
+    yc = np.where(forward, m_i/p_i**2*(2*p_i*x - x**2),
+                  m_i/(1 - p_i)**2*((1 - 2*p_i) + 2*p_i*x - x**2))
+    dyc = np.where(forward, 2*m_i/p_i**2*(p_i - x),
+                   2*m_i/(1 - p_i)**2*(p_i - x))
+    yt = NACA_thickness(x, t, TE_t, I, T)
+    yc, dyc, yt = np.broadcast_arrays(yc, dyc, yt)
+    return _squeeze(_NACA_coordinates(x, chord, yc, dyc, yt), t, p, m, I, T)
+
+def NACA_five_digit(chord, t, cl, p, reflex = False, n = 100):
+    """NACA five digit airfoils (e.g. 23012: cl = 0.3, p = 0.15, t = 0.12).
+
+    :param chord: chord
+    :param t: max thickness normalized by the chord (t/c)
+    :param cl: design lift coefficient (0.15 times the first digit)
+    :param p: position of the maximum camber (second digit/20), from
+              0.05 to 0.25 (0.10 to 0.25 for reflexed mean lines).
+    :param reflex: True for reflexed mean lines (third digit equal to 1).
+    :param n: number of points per surface (cosine spacing).
 
-    theta_fwd = np.atan(dydc_fwd)
-    theta_aft = np.atan(dydc_aft)
+    t, cl, p and reflex can be arrays with one value per airfoil.
 
-    # Calculate airfoil coordinates
-    y_upper = {'x': np.append(x_fwd - yt_fwd*np.sin(theta),
-                              x_aft - yt_aft*np.sin(theta)),
-               'y': np.append(y_fwd + yt_fwd*np.cos(theta),
-                              y_aft + yt_aft*np.cos(theta))}
-    y_lower = {'x': np.append(x_fwd + yt_fwd*np.sin(theta),
-                              x_aft + yt_aft*np.sin(theta)),
-               'y': np.append(y_fwd - yt_fwd*np.cos(theta),
-                              y_aft - yt_aft*np.cos(theta))}
-    return y_upper, y_lower
+    :rtype: upper and lower dictionaries with x and y keys (matrices
+            n_airfoils x n for arrays of parameters).
+    """
+    x = cosine_spacing(1., n)
+    p_i = np.asarray(p, dtype=float)[..., np.newaxis]
+    cl_i = np.asarray(cl, dtype=float)[..., np.newaxis]
+    reflex_i = np.asarray(reflex, dtype=bool)[..., np.newaxis]
+
+    # Mean line constants for cl = 0.3 (Abbott and von Doenhoff), there
+    # are no reflexed mean lines with p = 0.05
+    p_table = [0.05, 0.10, 0.15, 0.20, 0.25]
+    p_min = np.where(reflex_i, p_table[1], p_table[0])
+    if np.any((p_i < p_min - 1e-9) | (p_i > p_table[-1] + 1e-9)):
+        raise ValueError('NACA five digit mean lines only defined for p from '
+                         '0.05 (0.10 if reflexed) to 0.25')
+    r = np.where(reflex_i, np.interp(p_i, p_table[1:],
+                                     [0.1300, 0.2170, 0.3180, 0.4410]),
+                 np.interp(p_i, p_table,
+                           [0.0580, 0.1260, 0.2025, 0.2900, 0.3910]))
+    k1 = np.where(reflex_i, np.interp(p_i, p_table[1:],
+                                      [51.99, 15.793, 6.520, 3.191]),
+                  np.interp(p_i, p_table, [361.4, 51.64, 15.957, 6.643, 3.230]))
+    k21 = np.where(reflex_i, np.interp(p_i, p_table[1:],
+                                       [0.000764, 0.00677, 0.0303, 0.1355]), 0.)
+
+    forward = x < r
+    yc_standard = np.where(forward,
+                           k1/6.*(x**3 - 3*r*x**2 + r**2*(3 - r)*x),
+                           k1*r**3/6.*(1 - x))
+    dyc_standard = np.where(forward, k1/6.*(3*x**2 - 6*r*x + r**2*(3 - r)),
+                            -k1*r**3/6.)
+    yc_reflex = k1/6.*(np.where(forward, 1., k21)*(x - r)**3 -
+                       k21*(1 - r)**3*x - r**3*x + r**3)
+    dyc_reflex = k1/6.*(3*np.where(forward, 1., k21)*(x - r)**2 -
+                        k21*(1 - r)**3 - r**3)
+    yc = cl_i/0.3*np.where(reflex_i, yc_reflex, yc_standard)
+    dyc = cl_i/0.3*np.where(reflex_i, dyc_reflex, dyc_standard)
+    yt = NACA_thickness(x, t)
+    yc, dyc, yt = np.broadcast_arrays(yc, dyc, yt)
+    return _squeeze(_NACA_coordinates(x, chord, yc, dyc, yt), t, cl, p, reflex)
+
+def NACA(designations, chord = 1., n = 100):
+    """Coordinates of a list of NACA airfoils from their designations
+    ('2412', '0012-64' for the modified family, '23012', '23112').
+
+    :rtype: upper and lower dictionaries with x and y matrices
+            (n_airfoils x n), one row per designation in the given order.
+            Airfoils of the same family are calculated at once.
+    """
+    if type(designations) == str:
+        designations = [designations]
+    upper = {'x': np.zeros((len(designations), n)),
+             'y': np.zeros((len(designations), n))}
+    lower = {'x': np.zeros((len(designations), n)),
+             'y': np.zeros((len(designations), n))}
+
+    families = {'4': [], '4M': [], '5': []}
+    for i, designation in enumerate(designations):
+        digits = designation.upper().replace('NACA', '').strip()
+        if '-' in digits:
+            families['4M'].append(i)
+        elif len(digits) == 4:
+            families['4'].append(i)
+        elif len(digits) == 5:
+            families['5'].append(i)
+        else:
+            raise Exception('NACA designation not supported: ' + designation)
+
+    for family in families:
+        i = families[family]
+        if not i:
+            continue
+        digits = [designations[j].upper().replace('NACA', '').strip()
+                  for j in i]
+        if family == '5':
+            cl = [0.15*int(d[0]) for d in digits]
+            p = [int(d[1])/20. for d in digits]
+            reflex = [d[2] == '1' for d in digits]
+            t = [int(d[3:5])/100. for d in digits]
+            upper_i, lower_i = NACA_five_digit(chord, t, cl, p, reflex, n)
+        else:
+            m = [int(d[0])/100. for d in digits]
+            p = [int(d[1])/10. for d in digits]
+            t = [int(d[2:4])/100. for d in digits]
+            if family == '4M':
+                I = [int(d.split('-')[1][0]) for d in digits]
+                T = [int(d.split('-')[1][1]) for d in digits]
+            else:
+                I = T = None
+            upper_i, lower_i = NACA_four_digit(chord, t, p, m, n, I, T)
+        for key in ['x', 'y']:
+            upper[key][i] = upper_i[key]
+            lower[key][i] = lower_i[key]
+    return upper, lower
+
+class Airfoil():
+    """Coordinates of an airfoil (or of a single surface) stored as
+    contiguous float64 arrays. It can be used wherever the
+    {'x': [...], 'y': [...]} dictionaries are expected (airfoil['x'],
+    keys(), iteration over the keys), and the upper and lower surfaces
+    are views of the same arrays, so no data is copied.
+
+    :param x: x coordinates or a dictionary (or Airfoil) with x and y keys.
+    :param y: y coordinates (not necessary if x is a dictionary).
+    :param i_LE: index of the leading edge in XFOIL ordering (from the
+                 trailing edge along the upper surface and back along
+                 the lower surface). By default the frontmost point.
+    """
+    __slots__ = ('x', 'y', 'i_LE')
+
+    def __init__(self, x, y = None, i_LE = None):
+        if y is None:
+            x, y = x['x'], x['y']
+        self.x = np.ascontiguousarray(x, dtype=float)
+        self.y = np.ascontiguousarray(y, dtype=float)
+        if self.x.shape != self.y.shape:
+            raise Exception('x and y must have the same number of points')
+        if i_LE is None:
+            i_LE = int(np.argmin(self.x)) if len(self.x) else 0
+        self.i_LE = i_LE
+
+    @property
+    def upper(self):
+        """Upper surface, from the trailing edge to the leading edge."""
+        i = self.i_LE + 1
+        return Airfoil(self.x[:i], self.y[:i], self.i_LE)
+
+    @property
+    def lower(self):
+        """Lower surface, from the leading edge to the trailing edge
+        (without the leading edge point, same as separate_upper_lower)."""
+        i = self.i_LE + 1
+        return Airfoil(self.x[i:], self.y[i:], 0)
+
+    def __getitem__(self, key):
+        if key not in self.__slots__[:2]:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__[:2]:
+            raise KeyError(key)
+        setattr(self, key, np.ascontiguousarray(value, dtype=float))
+
+    def keys(self):
+        return ['x', 'y']
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.x)
+
+    def __repr__(self):
+        return 'Airfoil(%i points)' % len(self.x)
+
+    def to_dict(self):
+        """Dictionary of lists, as used by the rest of the package."""
+        return {'x': self.x.tolist(), 'y': self.y.tolist()}
+
+def _same_type(reference, x, y):
+    """Return x and y as an Airfoil if reference is an Airfoil or as a
+    dictionary of lists otherwise."""
+    if isinstance(reference, Airfoil):
+        return Airfoil(x, y)
+    return {'x': np.asarray(x, dtype=float).tolist(),
+            'y': np.asarray(y, dtype=float).tolist()}
 #==============================================================================
 # The following function are related to the use of plain flaps
 #==============================================================================
-    
+
+def _interpolate_surface(surface, x):
+    """Linear interpolation of the y coordinate of a surface (dictionary
+    or Airfoil, in any order) at x."""
+    xs = np.asarray(surface['x'], dtype=float)
+    ys = np.asarray(surface['y'], dtype=float)
+    if len(xs) > 1 and xs[0] > xs[-1]:
+        xs, ys = xs[::-1], ys[::-1]
+    if np.any(np.diff(xs) < 0):
+        i = np.argsort(xs, kind='stable')
+        xs, ys = xs[i], ys[i]
+    return np.interp(x, xs, ys)
+
 def find_hinge(x_hinge, upper, lower):
     """From the points of upper and lower surface find the y coordinate of
     the hinge at x_hinge
-    
+
     :param x_hinge: float x-coordinate of the hinge
     :param upper: dictionary with keys x and y, coordiantes of upper surface
-    :param lower: dictionary with keys x and y, coordiantes of lower surface    
+    :param lower: dictionary with keys x and y, coordiantes of lower surface
     """
-    def find_closest(data, x_hinge, fwd, aft):
-        """ Find the points afterwards(aft) and forwards(fwd) that are closest
-        to x_hinge. Retuns dictionaries aft and fwd, each with keys x and y."""
-        for i in range(len(data['x'])):
-            xi = data['x'][i]
-            yi = data['y'][i]
-            error = abs(xi - x_hinge)
-    
-            #If equal just save and break it
-            if x_hinge == xi:
-                aft['x'] = xi
-                aft['y'] = yi
-                aft['error'] = error
-                fwd['x'] = xi
-                fwd['y'] = yi
-                fwd['error'] = error
-                break
-            
-            if xi > x_hinge and error < aft['error']:
-                aft['x'] = xi
-                aft['y'] = yi
-                aft['error'] = error
-    
-            if xi < x_hinge and error < fwd['error']:
-                fwd['x'] = xi
-                fwd['y'] = yi
-                fwd['error'] = error
-        return fwd, aft
-        
-    #Find y hinge
-    upper_fwd = {'x': 9e9, 'y': 9e9, 'error': 9e9}
-    upper_aft = {'x': 9e9, 'y': 9e9, 'error': 9e9}
-    lower_fwd = {'x': 9e9, 'y': 9e9, 'error': 9e9}
-    lower_aft = {'x': 9e9, 'y': 9e9, 'error': 9e9}
-    hinge = {'x': x_hinge, 'y': 9e9}
-    
-    upper_fwd, upper_aft = find_closest(upper, x_hinge, upper_fwd, upper_aft)
-    lower_fwd, lower_aft = find_closest(lower, x_hinge, lower_fwd, lower_aft) 
-    
-    #Interpolate
-    hinge['y_upper'] =  upper_fwd['y'] + (
-                        hinge['x'] - upper_fwd['x'])*(
-                        upper_aft['y'] - upper_fwd['y'])/(
-                        upper_aft['x'] - upper_fwd['x'])
-    
-    hinge['y_lower'] =  lower_fwd['y'] + (
-                        hinge['x'] - lower_fwd['x'])*(
-                        lower_aft['y'] - lower_fwd['y'])/(
-                        lower_aft['x'] - lower_fwd['x'])
+    # The closest points forwards and afterwards of the hinge are found by
+    # a binary search on the sorted surfaces
+    hinge = {'x': x_hinge}
+    hinge['y_upper'] = _interpolate_surface(upper, x_hinge)
+    hinge['y_lower'] = _interpolate_surface(lower, x_hinge)
     hinge['y']  = (hinge['y_upper'] + hinge['y_lower'])/2.
 
     return hinge
@@ -449,141 +852,187 @@ def find_flap(data, hinge, extra_points = None):
     """Create the static airfoil and flap dictionaries containing the outer
     mold coordinates of both. Because it is necessary to have an intersection
     between the static lower surface and the flap lower surface, it is
-    sometimes interesting to have an extra poin in the static surface to 
+    sometimes interesting to have an extra poin in the static surface to
     garantee the intersection.
-    
+
     :param data: dictionary with x and y cooridnates of the whole outer mold
-    
+
     :param hinge: dictionary with x and y coordinates of hinge. Can be found
                   via find_hinge.
-                  
+
     :param extra_points: include extra points to surface, extending it more
                          than it will actually be (usefull for intersecting
-                         lines). Avaialble options: 'lower', 'upper' and None"""
-    #Generate empty dictionaries which will store final data.
+                         lines). Avaialble options: 'lower', 'upper' and None
+
+    The outputs are Airfoil objects if data is an Airfoil."""
+    x = np.asarray(data['x'], dtype=float)
+    y = np.asarray(data['y'], dtype=float)
+    # Points aft of the hinge belong to the flap. Because of the way that
+    # xfoil works, the upper list will always begin from the trailing edge
+    # and the lower list from the leading edge.
+    aft = x > hinge['x']
+    crossings = np.flatnonzero(aft[1:] != aft[:-1]) + 1
+
     flap_data = {'x':[], 'y':[]}
     static_data = {'x':[], 'y':[]}
-    
-    type = None
-    
-    for i in range(len(data['x'])):
-        xi = data['x'][i]
-        yi = data['y'][i]
-    #Because of the way that xfoil works, the upper list will always
-    #begin from the trailing edge    
-        if xi > hinge['x']:
-            if type == None:
-                type = 'upper'
-            elif type == 'lower':
-                flap_data['x'].append(hinge['x'])
-                flap_data['y'].append(hinge['y_' + type])
-                static_data['x'].append(hinge['x'])
-                static_data['y'].append(hinge['y_' + type])
-                # this will make the at the hinge to be included only once
-                type = 'upper'
-                #If the extra point is unecessary in the lower
-                if extra_points == 'lower':
-                    static_data['x'].append(data['x'][i+1])
-                    static_data['y'].append(data['y'][i+1])
-                    static_data['x'].append(data['x'][i+2])
-                    static_data['y'].append(data['y'][i+2])
-            flap_data['x'].append(xi)
-            flap_data['y'].append(yi)
-            
-    #Because of the way that xfoil works, the lower list will always
-    #begin from the  leading edge  
+    def store(part, xi, yi):
+        part['x'].append(xi)
+        part['y'].append(yi)
+
+    start = 0
+    for i in list(crossings) + [len(x)]:
+        part = flap_data if aft[start] else static_data
+        store(part, x[start:i], y[start:i])
+        if i == len(x):
+            break
+        # the hinge is included in both parts only once per crossing
+        if aft[i]:
+            hinge_point = np.array([hinge['x']]), np.array([hinge['y_lower']])
+            store(flap_data, *hinge_point)
+            store(static_data, *hinge_point)
+            if extra_points == 'lower':
+                store(static_data, x[i+1:i+3], y[i+1:i+3])
         else:
-            if type == None:
-                type = 'lower'
-            elif type == 'upper':
-                #If the extra point is unecessary in the upper
-                if extra_points == 'upper' and len(static_data['x']) == 0:
-                    static_data['x'].append(data['x'][i-2])
-                    static_data['y'].append(data['y'][i-2])
-                    static_data['x'].append(data['x'][i-1])
-                    static_data['y'].append(data['y'][i-1])
-                flap_data['x'].append(hinge['x'])
-                flap_data['y'].append(hinge['y_' + type])
-                static_data['x'].append(hinge['x'])
-                static_data['y'].append(hinge['y_' + type])
-                # this will make the at the hinge to be included only once
-                type = 'lower'
-                
-            static_data['x'].append(xi)
-            static_data['y'].append(yi)   
-    return static_data, flap_data
-
-def find_edges(x, y):
+            hinge_point = np.array([hinge['x']]), np.array([hinge['y_upper']])
+            if extra_points == 'upper' and not static_data['x']:
+                store(static_data, x[i-2:i], y[i-2:i])
+            store(flap_data, *hinge_point)
+            store(static_data, *hinge_point)
+        start = i
+
+    output = []
+    for part in [static_data, flap_data]:
+        if part['x']:
+            part = [np.concatenate(part[key]) for key in ['x', 'y']]
+        else:
+            part = [[], []]
+        output.append(_same_type(data, *part))
+    return output[0], output[1]
+
+def _edges(x, y, TE = 'ends'):
+    """Leading edge, trailing edge, chord and chord angle of airfoils
+    stored in the last axis of x and y (see normalize_airfoil)."""
+    if TE == 'ends':
+        x_TE = (x[..., 0] + x[..., -1])/2.
+        y_TE = (y[..., 0] + y[..., -1])/2.
+    elif TE == 'max':
+        i_TE = np.argmax(x, axis=-1)[..., np.newaxis]
+        x_TE = np.take_along_axis(x, i_TE, -1)[..., 0]
+        y_TE = np.take_along_axis(y, i_TE, -1)[..., 0]
+    else:
+        raise Exception('TE must be "ends" or "max"')
+    distance = np.hypot(x - x_TE[..., np.newaxis], y - y_TE[..., np.newaxis])
+    i_LE = np.argmax(distance, axis=-1)
+    x_LE = np.take_along_axis(x, i_LE[..., np.newaxis], -1)[..., 0]
+    y_LE = np.take_along_axis(y, i_LE[..., np.newaxis], -1)[..., 0]
+    return {'x_LE': x_LE, 'y_LE': y_LE, 'i_LE': i_LE,
+            'x_TE': x_TE, 'y_TE': y_TE,
+            'chord': np.take_along_axis(distance, i_LE[..., np.newaxis],
+                                        -1)[..., 0],
+            'theta': np.arctan2(y_TE - y_LE, x_TE - x_LE)}
+
+def normalize_airfoil(x, y = None, rotate = True, scale = True, TE = 'ends'):
+    """Translate the leading edge to the origin, rotate the trailing edge
+    to the x axis and scale the chord to one. The leading edge is the
+    point with the greatest distance from the trailing edge.
+
+    :param x: x coordinates in XFOIL order. Can be an array
+              (n_airfoils x n_points) to normalize several airfoils at
+              once, or a dictionary/Airfoil with x and y keys (and y None).
+    :param y: y coordinates with the same shape as x.
+    :param rotate: if False, the airfoil is only translated (and scaled).
+    :param scale: if False, the chord is not changed.
+    :param TE: 'ends' for the mean of the first and last points (thick
+               trailing edges) or 'max' for the point with the greatest x.
+
+    :returns: normalized x and y (arrays, or the same type as x for a
+              dictionary or Airfoil) and a dictionary with x_LE, y_LE,
+              i_LE, x_TE, y_TE, chord and theta (angle of the chord line
+              in radians, counter-clockwise) of each airfoil.
+    """
+    reference = None
+    if y is None:
+        reference = x
+        x, y = x['x'], x['y']
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = _edges(x, y, TE)
+
+    x_n = x - edges['x_LE'][..., np.newaxis]
+    y_n = y - edges['y_LE'][..., np.newaxis]
+    if rotate:
+        c = np.cos(edges['theta'])[..., np.newaxis]
+        s = np.sin(edges['theta'])[..., np.newaxis]
+        x_n, y_n = c*x_n + s*y_n, -s*x_n + c*y_n
+    if scale:
+        x_n = x_n/edges['chord'][..., np.newaxis]
+        y_n = y_n/edges['chord'][..., np.newaxis]
+
+    if reference is not None:
+        return _same_type(reference, x_n, y_n), edges
+    return x_n, y_n, edges
+
+def find_edges(x, y = None):
     '''Defining chord as the greatest distance from the trailing edge,
-       find the leading edge'''
-       
+       find the leading edge. x can also be an Airfoil (and y None)'''
+    if y is None:
+        x, y = x['x'], x['y']
     # The Trailing edge will always be the point with greatest x for small angles
-    TE_x = max(x)
-    TE_index = x.index(TE_x)
-    TE_y = y[TE_index]
-    
-    chord = 0
-    LE_index = 0
-    
-    for i in range(len(x)):
-        distance = math.sqrt((x[i]-TE_x)**2+(y[i]-TE_y)**2)
-        if distance > chord:
-            LE_index = i
-            chord = distance
-    theta = math.atan2(y[TE_index] - y[LE_index],
-                       x[TE_index] - x[LE_index])
-    return ({'x':x[LE_index], 'y':y[LE_index]},
-            {'x':x[TE_index], 'y':y[TE_index]},
-            theta, chord)
-     
-def rotate(upper, lower, origin, theta, unit_theta = 'deg', 
+    edges = _edges(np.asarray(x, dtype=float), np.asarray(y, dtype=float),
+                   TE = 'max')
+    return ({'x':float(edges['x_LE']), 'y':float(edges['y_LE'])},
+            {'x':float(edges['x_TE']), 'y':float(edges['y_TE'])},
+            float(edges['theta']), float(edges['chord']))
+
+def _rotation_matrix(theta):
+    """Clockwise rotation matrices with shape theta.shape + (2, 2)."""
+    theta = np.asarray(theta, dtype=float)
+    c = np.cos(theta)
+    s = np.sin(theta)
+    return np.stack([np.stack([c, s], -1), np.stack([-s, c], -1)], -2)
+
+def rotate(upper, lower, origin, theta, unit_theta = 'deg',
            move_to_origin = False, chord = 1.):
     """
     :param upper: dictionary with keys x and y, each a list
-    
+
     :param lower: dictionary with heys x and y, each a list
-    
+
     :param origin: dictionary with keys x and y, each a float
-    
-    :param theta: float representing angle in degrees clock-wise
-    
+
+    :param theta: float representing angle in degrees clock-wise. If it is
+                  a list of angles, all the rotations are calculated at
+                  once and each output is a list with one surface per angle.
+
     :param move_to_origin: if true, will establish origin as (0,0)
-    
+
     :param chord: will normalize results by this chors
-    output: rotated_upper, rotated_lower
+    output: rotated_upper, rotated_lower (Airfoil objects if the inputs
+            are Airfoil objects, dictionaries of lists otherwise)
     """
     output = []
-    
+
     #For trigonometric relations in numpy, theta must be in radians
+    theta = np.asarray(theta, dtype=float)
     if unit_theta == 'deg':
         theta = theta * np.pi/180.
-    # Rotation transformation Matrix
-
-    T = [[np.cos(theta), np.sin(theta)],
-        [-np.sin(theta), np.cos(theta)]]
+    # Rotation transformation Matrices (one per angle)
+    T = _rotation_matrix(np.atleast_1d(theta))
+    center = np.array([[origin['x']], [origin['y']]], dtype=float)
 
     for coordinates in [upper, lower]:
-        rotated_coordinates = {'x':[], 'y':[]}
-        for i in range(len(coordinates['x'])):
-            # The rotation must take place with the center of rotation
-            # as the origin
-            cx = coordinates['x'][i] - origin['x']
-            cy = coordinates['y'][i] - origin['y']
-            # Rotate
-            rot_x = (T[0][0]*cx + T[0][1]*cy)/chord
-            rot_y = (T[1][0]*cx + T[1][1]*cy)/chord
-            # Store and add back the values of the origin
-            if move_to_origin:
-                rotated_coordinates['x'].append(rot_x)
-                rotated_coordinates['y'].append(rot_y)            
-            else:
-                rotated_coordinates['x'].append(rot_x + origin['x'])
-                rotated_coordinates['y'].append(rot_y + origin['y'])
-        output.append(rotated_coordinates)
-        # import matplotlib.pyplot as plt
-        # plt.figure()
-        # plt.scatter(coordinates['x'],coordinates['y'])
-        # plt.show()
+        # The rotation must take place with the center of rotation
+        # as the origin
+        points = np.array([coordinates['x'], coordinates['y']],
+                          dtype=float).reshape(2, -1) - center
+        rotated = np.einsum('aij,jn->ain', T, points)/chord
+        # Add back the values of the origin
+        if not move_to_origin:
+            rotated += center
+        surfaces = [_same_type(coordinates, r[0], r[1]) for r in rotated]
+        if theta.ndim == 0:
+            surfaces = surfaces[0]
+        output.append(surfaces)
 
     # In case only one surface is of interest
 
@@ -592,236 +1041,234 @@ def rotate(upper, lower, origin, theta, unit_theta = 'deg',
     else:
         return output[0], output[1]
 
-def clean(upper_static, upper_flap, lower_static, lower_flap, hinge, 
+def _first_intersection(static, flap, surface):
+    """First intersection between the static and flap parts of a surface."""
+    x, y = intersect_curves(static[0], static[1], flap[0], flap[1],
+                            skip_TE_LE = False)
+    if len(x) == 0:
+        raise Exception('%s surfaces are not intersecting' % surface)
+    return x[0], y[0]
+
+def clean(upper_static, upper_flap, lower_static, lower_flap, hinge,
           deflection, N = None, return_flap_i = True,
           unit_deflection = 'rad'):
     """
     Function to remove intersecting lines and to round transition
     on upper surface.
-    
+
     :param N: number of points on smooth transition. If not defined, the
-             gap distance is taken in to consideration to define the 
+             gap distance is taken in to consideration to define the
              number of points inserted. If gap is to small, just created
              a node in the middle
-    
+
     :param return_flap_i: one of the returns is a list with the indexes
                           at which the upper flap surface ends and that
                           the lower flap surface begins.
     :param deflection: flap angular deflection, clockwise positive
     :param unit_deflection: 'rad'ians or 'deg'rees.
+
+    If the surfaces are Airfoil objects, so is the modified airfoil.
     """
     if unit_deflection == 'deg':
         deflection = deflection * np.pi/180.
+    # Work with [x, y] pairs of arrays for each part
+    us, uf, ls, lf = [[np.asarray(s[key], dtype=float) for key in ['x', 'y']]
+                      for s in [upper_static, upper_flap,
+                                lower_static, lower_flap]]
+    smooth = [np.array([]), np.array([])]
+    R = hinge['y_upper'] - hinge['y']
+
     if deflection > 0.:
         #The lower surface has a non-smooth transiton so we only have to
         # clean the intersecting lines
-        intersection = intersect_curves(lower_static['x'], lower_static['y'],
-                                       lower_flap['x'], lower_flap['y'],
-                                       input_type = 'list')
-        try:
-            intersection_x = intersection[0][0]
-            intersection_y = intersection[1][0]
-        except:
-            import matplotlib.pyplot as plt
-            plt.scatter(lower_static['x'], lower_static['y'], c='b')
-            plt.scatter(lower_flap['x'], lower_flap['y'], c='r')
-            raise Exception('Lower surfaces are not intersecting') 
-        
-        closest_x = min(lower_flap['x'], key=lambda x:abs(x-intersection_x))
-        closest_i = lower_flap['x'].index(closest_x)
-        for i in range(len(lower_flap['x'])):
-            # From the plots, every point of the flap before the intersection
-            # needs to be elimnated.
-            if i <= closest_i:
-                if ( i == closest_i and closest_x < intersection_x) or i != closest_i:
-                    lower_flap['x'][i] = None
-                    lower_flap['y'][i] = None
-
-        closest_x = min(lower_static['x'], key=lambda x:abs(x-intersection_x))
-        closest_i = lower_static['x'].index(closest_x)
-        for i in range(len(lower_static['x'])):
-            # From the plots, every point of the flap before the intersection
-            # needs to be elimnated.
-            if i >= closest_i:
-                if ( i == closest_i and closest_x > intersection_x) or i != closest_i:
-                    lower_static['x'][i] = None
-                    lower_static['y'][i] = None
-        
-        #Eliminatting the None vectors
-        lower_flap['x'] = filter(None, lower_flap['x'])
-        lower_flap['y'] = filter(None, lower_flap['y'])
-        lower_static['x'] = filter(None, lower_static['x'])
-        lower_static['y'] = filter(None, lower_static['y'])
-    
+        x_i, y_i = _first_intersection(ls, lf, 'Lower')
+        # Every point of the flap before the intersection and every point
+        # of the static surface after it need to be eliminated.
+        closest = np.argmin(np.abs(lf[0] - x_i))
+        if lf[0][closest] < x_i:
+            closest += 1
+        lf = [v[closest:] for v in lf]
+        closest = np.argmin(np.abs(ls[0] - x_i))
+        if ls[0][closest] <= x_i:
+            closest += 1
         # add intersection points
-        lower_static['x'].append(intersection_x)
-        lower_static['y'].append(intersection_y)
-          
-        R = hinge['y_upper'] - hinge['y']
-        
-        upper_smooth = {}
-        upper_smooth['x'] = []
-        upper_smooth['y'] = []
-        
-        #If N is not N, use an adaptive version to it
-        chord = min(lower_flap['x']) - min(lower_static['x'])
-        #Minimum step for between nodes at the joint
-        N_step = 0.002/chord
-        if N == None:
-            distance = R*deflection
-            if distance <= N_step:
-                N = 0 #Space too small, just connect points
-            else:
-                N = int(math.floor(distance/N_step))
-
-        # Need to create points connecting upper part in circle (part of plain flap
-        # exposed during flight). The points created are only for the new surface
-        #, the connecting points with the other surface have already been 
-        # created. If N == 0, substitute connecting nodes for an intermediate
-        #node
-        
-        if N == 0:
-            for key in ['x','y']:
-                upper_flap[key] = upper_flap[key][:-1]
-                upper_static[key] = upper_static[key][1:]
-            upper_smooth['x'].append(hinge['x'] + R*np.sin(deflection/2.))
-            upper_smooth['y'].append(hinge['y'] + R*np.cos(deflection/2.))
-        if N != 0:
-            for i in range(N):
-                theta = ((N-i)/(N+1.)) * deflection
-                upper_smooth['x'].append(hinge['x'] + R*np.sin(theta))
-                upper_smooth['y'].append(hinge['y'] + R*np.cos(theta))
-
-        # Assembling all together
-        
-        modified_airfoil = {'x':[], 'y':[]}
-
-        for key in ['x','y']:
-            modified_airfoil[key] = upper_flap[key] + upper_smooth[key] + \
-                                    upper_static[key] + lower_static[key] + \
-                                    lower_flap[key]
-        if return_flap_i == True:
-            i = [len(upper_flap[key]) + len(upper_smooth[key]),
-                 len(upper_flap[key]) + len(upper_smooth[key]) + \
-                 len(upper_static[key]) + len(lower_static[key])]
-            return modified_airfoil, i
-        else:
-            return modified_airfoil
+        ls = [np.append(v[:closest], v_i) for v, v_i in zip(ls, [x_i, y_i])]
+        distance = R*deflection
     elif deflection < 0.:
         #The upper surface has a non-smooth transiton so we only have to
         # clean the intersecting lines
-        intersection= intersect_curves(upper_static['x'], upper_static['y'],
-                                       upper_flap['x'], upper_flap['y'],
-                                       input_type = 'list')
-        try:
-            intersection_x = intersection[0][0]
-            intersection_y = intersection[1][0]
-        except:
-            import matplotlib.pyplot as plt
-            plt.scatter(upper_static['x'], upper_static['y'], c='b')
-            plt.scatter(upper_flap['x'], upper_flap['y'], c='r')
-            raise Exception('Upper surfaces are not intersecting')
-
-        closest_x = min(upper_flap['x'], key=lambda x:abs(x-intersection_x))
-        closest_i = upper_flap['x'].index(closest_x)
-        for i in range(len(upper_flap['x'])):
-            # From the plots, every point of the flap before the intersection
-            # needs to be elimnated.
-            if i >= closest_i:
-                if ( i == closest_i and closest_x < intersection_x) or i != closest_i:
-                    upper_flap['x'][i] = None
-                    upper_flap['y'][i] = None
-
-        closest_x = min(upper_static['x'], key=lambda x:abs(x-intersection_x))
-        closest_i = upper_static['x'].index(closest_x)
-        for i in range(len(upper_static['x'])):
-            # From the plots, every point of the flap before the intersection
-            # needs to be elimnated.
-            if i <= closest_i:
-                if ( i == closest_i and closest_x > intersection_x) or i != closest_i:
-                    upper_static['x'][i] = None
-                    upper_static['y'][i] = None
-        
-        #Eliminatting the None vectors
-        upper_flap['x'] = filter(None, upper_flap['x'])
-        upper_flap['y'] = filter(None, upper_flap['y'])
-        upper_static['x'] = filter(None, upper_static['x'])
-        upper_static['y'] = filter(None, upper_static['y'])
-    
+        x_i, y_i = _first_intersection(us, uf, 'Upper')
+        closest = np.argmin(np.abs(uf[0] - x_i))
+        if uf[0][closest] >= x_i:
+            closest += 1
+        uf = [v[:closest] for v in uf]
+        closest = np.argmin(np.abs(us[0] - x_i))
+        if us[0][closest] > x_i:
+            closest += 1
         # add intersection points
-        upper_static['x'] = [intersection_x] + upper_static['x']
-        upper_static['y'] = [intersection_y] + upper_static['y']
-          
-        R = hinge['y_upper'] - hinge['y']
-        
-        lower_smooth = {}
-        lower_smooth['x'] = []
-        lower_smooth['y'] = []
-        
+        us = [np.append(v_i, v[closest:]) for v, v_i in zip(us, [x_i, y_i])]
+        distance = - R*deflection
+
+    if deflection != 0.:
         #If N is not N, use an adaptive version to it
-        chord = min(lower_flap['x']) - min(lower_static['x'])
+        chord = np.min(lf[0]) - np.min(ls[0])
         #Minimum step for between nodes at the joint
         N_step = 0.002/chord
-        if N == None:
-            distance = - R*deflection
+        if N is None:
             if distance <= N_step:
                 N = 0 #Space too small, just connect points
             else:
                 N = int(math.floor(distance/N_step))
-        # Need to create points connecting lower part in circle (part of plain flap
-        # exposed during flight). The points created are only for the new surface
-        #, the connecting points with the other surface have already been 
-        # created. If N == 0, substitute connecting nodes for an intermediate
-        #node
-
+        # Need to create points connecting the surface in circle (part of
+        # plain flap exposed during flight). The points created are only
+        # for the new surface, the connecting points with the other surface
+        # have already been created. If N == 0, substitute connecting nodes
+        # for an intermediate node
         if N == 0:
-            for key in ['x','y']:
-                lower_flap[key] = lower_flap[key][1:]
-                lower_static[key] = lower_static[key][:-1]
-            lower_smooth['x'].append(hinge['x'] + R*np.sin(deflection/2.))
-            lower_smooth['y'].append(hinge['y'] - R*np.cos(deflection/2.))
- 
-        if N != 0:
-            for i in range(N):
-                theta = -((i+1)/(N+1.)) * deflection
-                lower_smooth['x'].append(hinge['x'] + R*np.sin(theta))
-                lower_smooth['y'].append(hinge['y'] - R*np.cos(theta))
-
-        # Assembling all together
-        
-        modified_airfoil = {'x':[], 'y':[]}
-        for key in ['x','y']:
-            modified_airfoil[key] = upper_flap[key] + upper_static[key] + \
-                                    lower_static[key] + lower_smooth[key] +\
-                                    lower_flap[key]
-        if return_flap_i == True:
-            i = [len(upper_flap[key]) - 1,
-                 len(upper_flap[key]) + len(upper_static[key]) + \
-                 len(lower_static[key])]
-            return modified_airfoil, i
+            theta = np.array([deflection/2.])
+        elif deflection > 0.:
+            theta = (N - np.arange(N))/(N + 1.) * deflection
         else:
-            return modified_airfoil
-    #If deflection equal to zero, just create flap
-    elif deflection == 0.:              
-        # add intersection points
-        upper_static['x'] = upper_static['x'][1:]
-        upper_static['y'] = upper_static['y'][1:]
-        lower_static['x'] = lower_static['x'][:-1]
-        lower_static['y'] = lower_static['y'][:-1]
-        
-        modified_airfoil = {'x':[], 'y':[]}
-        for key in ['x','y']:
-            modified_airfoil[key] = upper_flap[key] + upper_static[key] + \
-                                    lower_static[key] + lower_flap[key]
-        if return_flap_i == True:
-            i = [len(upper_flap[key]),
-                 len(upper_flap[key]) + len(upper_static[key]) + \
-                 len(lower_static[key])]
-            return modified_airfoil, i
+            theta = -(np.arange(N) + 1.)/(N + 1.) * deflection
+        if deflection > 0.:
+            smooth = [hinge['x'] + R*np.sin(theta),
+                      hinge['y'] + R*np.cos(theta)]
+            if N == 0:
+                uf = [v[:-1] for v in uf]
+                us = [v[1:] for v in us]
         else:
-            return modified_airfoil 
+            smooth = [hinge['x'] + R*np.sin(theta),
+                      hinge['y'] - R*np.cos(theta)]
+            if N == 0:
+                lf = [v[1:] for v in lf]
+                ls = [v[:-1] for v in ls]
+    else:
+        #If deflection equal to zero, just create flap
+        us = [v[1:] for v in us]
+        ls = [v[:-1] for v in ls]
+
+    # Assembling all together
+    if deflection < 0.:
+        parts = [uf, us, ls, smooth, lf]
+        i = [len(uf[0]) - 1, len(uf[0]) + len(us[0]) + len(ls[0])]
+    else:
+        parts = [uf, smooth, us, ls, lf]
+        i = [len(uf[0]) + len(smooth[0]),
+             len(uf[0]) + len(smooth[0]) + len(us[0]) + len(ls[0])]
+    modified_airfoil = _same_type(upper_static,
+                                  *[np.concatenate([p[k] for p in parts])
+                                    for k in range(2)])
+    if return_flap_i == True:
+        return modified_airfoil, i
+    else:
+        return modified_airfoil
+
+def _flap_parts(x_hinge, upper, lower):
+    """Hinge, flap surfaces and static surfaces of a plain flap. The flap
+    parts are the same for all the deflections, but the static parts are
+    extended on the surface where the intersection is calculated, so they
+    are stored for each sign of the deflection (-1., 0. and 1.)."""
+    upper = Airfoil(upper)
+    lower = Airfoil(lower)
+    hinge = find_hinge(x_hinge, upper, lower)
 
-def intersect_curves(x1, y1, x2, y2, input_type = 'list', 
+    upper_static, upper_flap = find_flap(upper, hinge)
+    lower_static, lower_flap = find_flap(lower, hinge)
+    statics = {0.: (upper_static, lower_static),
+               1.: (upper_static, find_flap(lower, hinge, 'lower')[0]),
+               -1.: (find_flap(upper, hinge, 'upper')[0], lower_static)}
+    return hinge, upper_flap, lower_flap, statics
+
+def flapped_airfoils(x_hinge, upper, lower, deflections, N = None,
+                     unit_deflection = 'deg', return_flap_i = False):
+    """Plain flapped airfoils for a list of deflections. The hinge, the
+    static and flap parts are found only once and the flap is rotated for
+    all deflections at once.
+
+    :param x_hinge: float x-coordinate of the hinge
+    :param upper: upper surface (dictionary or Airfoil) from the trailing
+                  edge to the leading edge
+    :param lower: lower surface (dictionary or Airfoil) from the leading
+                  edge to the trailing edge
+    :param deflections: float or list of deflections, clockwise positive
+    :param N: number of points on smooth transition (see clean)
+    :param unit_deflection: 'rad'ians or 'deg'rees.
+
+    :returns: list of Airfoil objects (in XFOIL order), one per deflection,
+              and the list of flap indexes (see clean) if return_flap_i.
+    """
+    deflections = np.atleast_1d(np.asarray(deflections, dtype=float))
+    if unit_deflection == 'deg':
+        deflections = deflections * np.pi/180.
+    hinge, upper_flap, lower_flap, statics = _flap_parts(x_hinge, upper,
+                                                         lower)
+    upper_rotated, lower_rotated = rotate(upper_flap, lower_flap, hinge,
+                                          deflections, unit_theta = 'rad')
+    airfoils = []
+    indexes = []
+    for k, deflection in enumerate(deflections):
+        upper_static, lower_static = statics[np.sign(deflection)]
+        airfoil, i = clean(upper_static, upper_rotated[k], lower_static,
+                           lower_rotated[k], hinge, deflection, N = N)
+        airfoils.append(airfoil)
+        indexes.append(i)
+    if return_flap_i:
+        return airfoils, indexes
+    return airfoils
+
+def _overlapping_segments(xs1, ys1, xs2, ys2):
+    """Indexes (i, j) of the segments of curve 2 (i) and curve 1 (j) with
+    overlapping bounding boxes. The segments of curve 2 are sorted by
+    their minimum x, so only a window of them is checked for each segment
+    of curve 1 instead of every combination."""
+    mix1, max1 = np.amin(xs1, axis=0), np.amax(xs1, axis=0)
+    miy1, may1 = np.amin(ys1, axis=0), np.amax(ys1, axis=0)
+    mix2, max2 = np.amin(xs2, axis=0), np.amax(xs2, axis=0)
+    miy2, may2 = np.amin(ys2, axis=0), np.amax(ys2, axis=0)
+    if len(mix1) == 0 or len(mix2) == 0:
+        return np.array([], dtype=int), np.array([], dtype=int)
+
+    order = np.argsort(mix2, kind='stable')
+    sorted_mix2 = mix2[order]
+    # a segment of curve 2 can only overlap if it starts after
+    # mix1 - (longest projection of the segments of curve 2)
+    length2 = np.amax(max2 - mix2)
+    start = np.searchsorted(sorted_mix2, mix1 - length2, side='left')
+    end = np.searchsorted(sorted_mix2, max1, side='right')
+    counts = np.maximum(end - start, 0)
+
+    j = np.repeat(np.arange(len(mix1)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                  counts)
+    i = order[np.repeat(start, counts) + offsets]
+
+    overlap = ((mix2[i] <= max1[j]) & (max2[i] >= mix1[j]) &
+               (miy2[i] <= may1[j]) & (may2[i] >= miy1[j]))
+    i, j = i[overlap], j[overlap]
+    # same order as looping over the segments of curve 2 and then 1
+    sort = np.lexsort((j, i))
+    return i[sort], j[sort]
+
+def _solve_segments(xs1, ys1, xs2, ys2, i, j):
+    """Solve xa0 + r0*dxa = xb0 + r1*dxb (and the same for y) with
+    Cramer's rule for the segments j of curve 1 (a) and i of curve 2 (b).
+    The segments intersect if both r0 and r1 are in [0, 1). Parallel (and
+    collinear) segments have no single intersection and return nan."""
+    dxa = xs1[1, j] - xs1[0, j]
+    dya = ys1[1, j] - ys1[0, j]
+    dxb = xs2[1, i] - xs2[0, i]
+    dyb = ys2[1, i] - ys2[0, i]
+    bx = xs2[0, i] - xs1[0, j]
+    by = ys2[0, i] - ys1[0, j]
+    det = dxb*dya - dxa*dyb
+    singular = np.abs(det) <= 2*np.finfo(float).eps*(dxa**2 + dya**2 +
+                                                     dxb**2 + dyb**2)
+    det = np.where(singular, np.nan, det)
+    r0 = (dxb*by - bx*dyb)/det
+    r1 = (dxa*by - dya*bx)/det
+    return r0, r1
+
+def intersect_curves(x1, y1, x2, y2, input_type = 'list',
                      skip_TE_LE = True):
     """
     Find all intersections betweens curves 1 and 2
@@ -829,23 +1276,25 @@ def intersect_curves(x1, y1, x2, y2, input_type = 'list',
     :param y1: y data vector for curve 1
     :param x2: x data vector for curve 1
     :param y2: y data vector for curve 2
-    
-    :returns tuple with all intersections.
-    
+    :param input_type: kept for compatibility, lists and arrays are
+                       accepted either way
+    :param skip_TE_LE: if True, intersections closer than 1e-4 to x=0 or
+                       x=1 are ignored
+
+    :returns tuple with all intersections (list of x, list of y).
+
+    The candidate segment pairs are found from bounding boxes sorted in x
+    and all the pairs are solved at once with Cramer's rule.
+
     source: http://stackoverflow.com/questions/24549247/
     how-to-compute-which-way-data-points-continue-beyond
     -an-intersection
     """
     #convert inputs to numpy arrays
-    if input_type == 'list':
-        x1 = np.array(x1)
-        x2 = np.array(x2)
-        y1 = np.array(y1)
-        y2 = np.array(y2)
-    # number of points in each curve, number of segments is one less,
-    # need at least one segment in each curve
-    N1 = x1.shape[0]
-    N2 = x2.shape[0]
+    x1 = np.asarray(x1, dtype=float)
+    x2 = np.asarray(x2, dtype=float)
+    y1 = np.asarray(y1, dtype=float)
+    y2 = np.asarray(y2, dtype=float)
 
     # get segment presentation (xi, xi+1; xi+1, xi+2; ..)
     xs1 = np.vstack((x1[:-1], x1[1:]))
@@ -853,77 +1302,57 @@ def intersect_curves(x1, y1, x2, y2, input_type = 'list',
     xs2 = np.vstack((x2[:-1], x2[1:]))
     ys2 = np.vstack((y2[:-1], y2[1:]))
 
-    # test if bounding-boxes of segments overlap
-    mix1 = np.tile(np.amin(xs1, axis=0), (N2-1,1))
-    max1 = np.tile(np.amax(xs1, axis=0), (N2-1,1))
-    miy1 = np.tile(np.amin(ys1, axis=0), (N2-1,1))
-    may1 = np.tile(np.amax(ys1, axis=0), (N2-1,1))
-    mix2 = np.transpose(np.tile(np.amin(xs2, axis=0), (N1-1,1)))
-    max2 = np.transpose(np.tile(np.amax(xs2, axis=0), (N1-1,1)))
-    miy2 = np.transpose(np.tile(np.amin(ys2, axis=0), (N1-1,1)))
-    may2 = np.transpose(np.tile(np.amax(ys2, axis=0), (N1-1,1)))
-    idx = np.where((mix2 <= max1) & (max2 >= mix1) & (miy2 <= may1) & (may2 >= miy1)) # overlapping segment combinations
-
-    # going through all the possible segments
-    x0 = []
-    y0 = []
-    for (i, j) in zip(idx[0], idx[1]):
-        # get segment coordinates
-        xa = xs1[:, j]
-        ya = ys1[:, j]
-        xb = xs2[:, i]
-        yb = ys2[:, i]
-        # ax=b, prepare matrices a and b
-        a = np.array([[xa[1] - xa[0], xb[0] - xb[1]], [ya[1] - ya[0], yb[0]- yb[1]]])
-        b = np.array([xb[0] - xa[0], yb[0] - ya[0]])
-        r, residuals, rank, s = np.linalg.lstsq(a, b)
-        # if this is not a
-        if rank == 2 and not residuals and r[0] >= 0 and r[0] < 1 and r[1] >= 0 and r[1] < 1:
-            if r[0] == 0 and r[1] == 0 and i > 0 and j > 0:
-                # super special case of one segment point (not the first) in common, need to differentiate between crossing or contact
-                angle_a1 = math.atan2(ya[1] - ya[0], xa[1] - xa[0])
-                angle_b1 = math.atan2(yb[1] - yb[0], xb[1] - xb[0])
-
-                # get previous segment
-                xa2 = xs1[:, j-1]
-                ya2 = ys1[:, j-1]
-                xb2 = xs2[:, i-1]
-                yb2 = ys2[:, i-1]
-                angle_a2 = math.atan2(ya2[0] - ya2[1], xa2[0] - xa2[1])
-                angle_b2 = math.atan2(yb2[0] - yb2[1], xb2[0] - xb2[1])
-
-                # determine in which order the 4 angle are
-                if angle_a2 < angle_a1:
-                    h = angle_a1
-                    angle_a1 = angle_a2
-                    angle_a2 = h
-                if (angle_b1 > angle_a1 and angle_b1 < angle_a2 and (angle_b2 < angle_a1 or angle_b2 > angle_a2)) or\
-                        ((angle_b1 < angle_a1 or angle_b1 > angle_a2) and angle_b2 > angle_a1 and angle_b2 < angle_a2):
-                    # both in or both out, just a contact point
-                    x0.append(xa[0])
-                    y0.append(ya[0])
-            else:
-                x0.append(xa[0] + r[0] * (xa[1] - xa[0]))
-                y0.append(ya[0] + r[0] * (ya[1] - ya[0]))
+    # overlapping segment combinations
+    i, j = _overlapping_segments(xs1, ys1, xs2, ys2)
+    r0, r1 = _solve_segments(xs1, ys1, xs2, ys2, i, j)
+    valid = (r0 >= 0) & (r0 < 1) & (r1 >= 0) & (r1 < 1)
+
+    # super special case of one segment point (not the first) in common,
+    # need to differentiate between crossing or contact
+    common = valid & (r0 == 0) & (r1 == 0) & (i > 0) & (j > 0)
+    for k in np.flatnonzero(common):
+        angle_a1 = math.atan2(ys1[1, j[k]] - ys1[0, j[k]],
+                              xs1[1, j[k]] - xs1[0, j[k]])
+        angle_b1 = math.atan2(ys2[1, i[k]] - ys2[0, i[k]],
+                              xs2[1, i[k]] - xs2[0, i[k]])
+
+        # get previous segment
+        angle_a2 = math.atan2(ys1[0, j[k]-1] - ys1[1, j[k]-1],
+                              xs1[0, j[k]-1] - xs1[1, j[k]-1])
+        angle_b2 = math.atan2(ys2[0, i[k]-1] - ys2[1, i[k]-1],
+                              xs2[0, i[k]-1] - xs2[1, i[k]-1])
+
+        # determine in which order the 4 angle are
+        if angle_a2 < angle_a1:
+            angle_a1, angle_a2 = angle_a2, angle_a1
+        # both in or both out, just a contact point
+        valid[k] = (angle_b1 > angle_a1 and angle_b1 < angle_a2 and
+                    (angle_b2 < angle_a1 or angle_b2 > angle_a2)) or \
+                   ((angle_b1 < angle_a1 or angle_b1 > angle_a2) and
+                    angle_b2 > angle_a1 and angle_b2 < angle_a2)
+
+    x0 = (xs1[0, j] + r0*(xs1[1, j] - xs1[0, j]))[valid]
+    y0 = (ys1[0, j] + r0*(ys1[1, j] - ys1[0, j]))[valid]
     # filter points close to leading edge and trailing edges
     if skip_TE_LE:
         tol=1e-4
-        try:
-            x0, y0 = zip(*[(i, j) for i, j in zip(x0, y0) if i < tol and i>1-tol])
-        except:
-            x0 = []
-            y0 = []
+        inside = (x0 >= tol) & (x0 <= 1-tol)
+        x0 = x0[inside]
+        y0 = y0[inside]
 
-    return (x0, y0)
+    return (x0.tolist(), y0.tolist())
 
-def separate_upper_lower(x, y, Cp = None, i_separator=None):
+def separate_upper_lower(x, y = None, Cp = None, i_separator=None):
     """Return dictionaries with upper and lower keys with respective
     coordiantes. It is assumed the leading edge is frontmost point at
-    alpha=0"""
+    alpha=0
+
+    If x is an Airfoil (and y is None), the upper and lower surfaces are
+    returned as Airfoil views instead (and Cp as a dictionary)."""
     #TODO: when using list generated by xfoil, there are two points for
     #the leading edge
     def separate(variable_list, i_separator):
-        if type(i_separator) == int:
+        if isinstance(i_separator, (int, np.integer)):
             variable_dictionary = {'upper': variable_list[0:i_separator+1],
                                    'lower': variable_list[i_separator+1:]}
         elif type(i_separator) == list:
@@ -933,12 +1362,23 @@ def separate_upper_lower(x, y, Cp = None, i_separator=None):
             variable_dictionary = {'upper': variable_list[0:i_upper],
                                    'lower': variable_list[i_lower:]}
         return variable_dictionary
+    if isinstance(x, Airfoil):
+        if i_separator is None:
+            i_separator = x.i_LE
+        # slices of the arrays, so no data is copied
+        x_i = separate(x.x, i_separator)
+        y_i = separate(x.y, i_separator)
+        upper = Airfoil(x_i['upper'], y_i['upper'])
+        lower = Airfoil(x_i['lower'], y_i['lower'])
+        if Cp is None:
+            return upper, lower
+        return upper, lower, separate(Cp, i_separator)
     #If i is not defined, separate upper and lower surface from the
     # leading edge
-    if i_separator == None:
-        i_separator = x.index(min(x))
+    if i_separator is None:
+        i_separator = int(np.argmin(x))
 
-    if Cp == None:
+    if Cp is None:
         x = separate(x, i_separator)
         y = separate(y, i_separator)
         return x, y
@@ -948,283 +1388,541 @@ def separate_upper_lower(x, y, Cp = None, i_separator=None):
         Cp = separate(Cp, i_separator)
         return x, y, Cp
             
-def find_deflection(x_hinge, upper_cruise, lower_cruise, 
-                    type = 'Match trailing edge', alpha=0, Reynolds = 0, 
+def find_deflection(x_hinge, upper_cruise, lower_cruise,
+                    type = 'Match trailing edge', alpha=0, Reynolds = 0,
                     **kwargs):
     """
     Function to calculate the flap deflection.
-    
+
     Required inputs:
     :param x_hinge
     :param upper_cruise
     :param lower_cruise
     :param type: can be:
-                - 'Match trailing edge': will find the deflection where the 
+                - 'Match trailing edge': will find the deflection where the
                 baseline's trailing edge matches that of the objective, i.e.
-                match the the trailing edge of a traditional flap with a 
+                match the the trailing edge of a traditional flap with a
                 morphing conitunous flap.
                 - 'Same Cl': will find deflection where Cl of flapped airfoil
                 is equal to the the objective airfoil.
+                - 'Same Cd': same as 'Same Cl' but for Cd.
                 - 'Range of deflection'
     kwrgs arguments for 'Match trailing edge':
     :param x_TE_objective
     :param y_TE_objective
     :param x_TE_baseline
     :param y_TE_baseline
-    
+
     kwrgs arguments for 'Same Cl':
     :param Cl_objective
 
     kwrgs arguments for 'Same Cd':
     :param Cd_objective
-    
+
+    optional kwrgs arguments for 'Same Cl' and 'Same Cd':
+    :param init_deflection: first deflection of the search (default 0)
+    :param max_deflection: largest deflection searched (default 90)
+    :param tolerance: tolerance of the deflection (default 0.03125)
+
     kwrgs arguments for 'Range of deflection'
     :param max_deflection
-    
+    :param init_deflection
+    :param step
+    :param processes: number of processes of the FlapMap (None uses all
+                      the cores)
+
     Optional arguments:
     :param alpha
     :param Reynolds
+    :param iteration: number of XFOIL iterations (default 100)
+    :param session: xfoil_module.XfoilSession to use. If not defined, a
+                    new session is started (and closed at the end).
+    :param return_history: if True, the history of the XFOIL runs, a list
+                           with [deflection, Cl, Cd] for each run, is
+                           also returned (default False)
+
+    For 'Same Cl' and 'Same Cd' the target is bracketed by doubling the
+    deflection step and then found with Brent's method (bracketed secant
+    and inverse quadratic interpolation), so only a few XFOIL runs are
+    necessary. Each deflection is only calculated once.
+
+    :returns: deflection, Cd, Cl, flapped_airfoil (and the history if
+              return_history is True). For 'Range of deflection' a
+              dictionary with CD, CL and deflection lists.
     """
-    import xfoil_module as xf
+    from scipy.optimize import brentq
+    from aeropy import xfoil_module as xf
+
+    airfoil = 'flapped_airfoil'
 
-    airfoil = 'flapped_airfoil'  
-    
     if type == 'Match trailing edge':
         x_TE_objective = kwargs['x_TE_objective']
         y_TE_objective = kwargs['y_TE_objective']
         x_TE_baseline = kwargs['x_TE_baseline']
         y_TE_baseline = kwargs['y_TE_baseline']
-    elif type == 'Same Cl':
-        Cl_objective = kwargs['Cl_objective']
-    elif type == 'Same Cd':
-        Cd_objective = kwargs['Cd_objective']
+    elif type == 'Same Cl' or type == 'Same Cd':
+        objective = kwargs['Cl_objective' if type == 'Same Cl'
+                           else 'Cd_objective']
+        init_deflection = kwargs.get('init_deflection', 0.)
+        max_deflection = kwargs.get('max_deflection', 90.)
+        tolerance = kwargs.get('tolerance', 0.5**5)
     elif type == 'Range of deflection':
-        max_deflection = kwargs['max_deflection']    
+        max_deflection = kwargs['max_deflection']
         init_deflection = kwargs['init_deflection']
-        step = kwargs['step']    
-    hinge = find_hinge(x_hinge, upper_cruise, lower_cruise)
+        step = kwargs['step']
 
-    upper_static, upper_flap = find_flap(upper_cruise, hinge)
-    lower_static, lower_flap = find_flap(lower_cruise, hinge)
-    
-    #==============================================================================
-    #  Find Deflection      
-    #==============================================================================
-    if type == 'Match trailing edge':
-        #Calculate deflection angle in radians
-        deflection = np.arctan2(hinge['y'] - y_TE_objective, x_TE_objective - hinge['x']) - np.arctan2(hinge['y'] - y_TE_baseline, x_TE_baseline - hinge['x'])
-        # Convet to degrees
-        deflection = deflection*180./np.pi
-    
-        upper_rotated, lower_rotated = rotate(upper_flap, lower_flap, hinge, deflection)
-        
-        flapped_airfoil = clean(upper_static, upper_rotated, lower_static, 
-                                lower_rotated, hinge, deflection, N = 5)
-    
-        xf.create_input(airfoil, 'Type 3', airfoil = flapped_airfoil)
-                                    
-        xf.call(airfoil, alfas = alpha, Reynolds = Reynolds, iteration=100, GDES = True,
-                output='Polar')
-        filename = xf.file_name(airfoil, alpha, output='Polar')
-        Data = xf.output_reader(filename, output='Polar')
-        
-        #Rename to make more convenient
-        Cd = Data['CD']
-        Cl = Data['CL']
-        
-    elif type == 'Same Cl':
-        current_Cl = 0
-        current_Cd = 0
-        previous_Cl = 0
-        deflection = 2.
-        history = []
-        # Rough search
-        step = 2.
-        while current_Cl < Cl_objective and deflection < 90.:# Convet to degrees
-            previous_Cl = current_Cl
-            previous_Cd = current_Cd
-            previous_deflection = deflection
-            history.append([previous_deflection, previous_Cl, previous_Cd])
-            deflection = deflection + step
-            print(deflection)
-            upper_rotated, lower_rotated = rotate(upper_flap, lower_flap, hinge, deflection)
-            
-            flapped_airfoil = clean(upper_static, upper_rotated, lower_static, 
-                                    lower_rotated, hinge, deflection, N = 5)
-        
-            xf.create_input(airfoil, 'Type 3', airfoil = flapped_airfoil)
-                                        
-            xf.call(airfoil, alfas = alpha, Reynolds = Reynolds, iteration=100, GDES = True,
-                    output='Polar')
-            filename = xf.file_name(airfoil, alpha, output='Polar')
-            Data = xf.output_reader(filename, output='Polar')
-            
-            #Rename to make more convenient
-            current_Cd = Data['CD'][0]
-            current_Cl = Data['CL'][0]
-
-        for i in range(1,6):
-            # Fine search
-            step = 0.5**i
-            current_Cl = previous_Cl
-            while current_Cl < Cl_objective and deflection < 90.:# Convet to degrees
-                previous_Cl = current_Cl
-                previous_Cd = current_Cd
-                previous_deflection = deflection
-                history.append([previous_deflection, previous_Cl, previous_Cd])
-                deflection = deflection + step
-            
-                upper_rotated, lower_rotated = rotate(upper_flap, lower_flap, hinge, deflection)
-                previous_flapped_airfoil = flapped_airfoil
-                flapped_airfoil = clean(upper_static, upper_rotated, lower_static, 
-                                        lower_rotated, hinge, deflection, N = 5)
-            
-                xf.create_input(airfoil, 'Type 3', airfoil = flapped_airfoil)
-                                            
-                xf.call(airfoil, alfas = alpha, Reynolds = Reynolds, iteration=100, GDES = True,
-                        output='Polar')
-                filename = xf.file_name(airfoil, alpha, output='Polar')
-                Data = xf.output_reader(filename, output='Polar')
-                
-                #Rename to make more convenient
-                current_Cd = Data['CD'][0]
-                current_Cl = Data['CL'][0]
-            print(current_Cl, deflection)
-
-    elif type == 'Same Cd':
-        current_Cl = 0
-        current_Cd = 0
-        previous_Cl = 0
-        deflection = 2.
-        history = []
-        # Rough search
-        step = 2.
-        while current_Cd < Cd_objective and deflection < 90.:# Convet to degrees
-            previous_Cl = current_Cl
-            previous_Cd = current_Cd
-            previous_deflection = deflection
-            history.append([previous_deflection, previous_Cl, previous_Cd])
-            deflection = deflection + step
-            print(deflection)
-            upper_rotated, lower_rotated = rotate(upper_flap, lower_flap, hinge, deflection)
-            
-            flapped_airfoil = clean(upper_static, upper_rotated, lower_static, 
-                                    lower_rotated, hinge, deflection, N = 5)
-        
-            xf.create_input(airfoil, 'Type 3', airfoil = flapped_airfoil)
-                                        
-            xf.call(airfoil, alfas = alpha, Reynolds = Reynolds, iteration=100, GDES = True,
-                    output='Polar')
-            filename = xf.file_name(airfoil, alpha, output='Polar')
-            Data = xf.output_reader(filename, output='Polar')
-            
-            #Rename to make more convenient
-            current_Cd = Data['CD'][0]
-            current_Cl = Data['CL'][0]
-
-        for i in range(1,6):
-            # Fine search
-            step = 0.5**i
-            current_Cd = previous_Cd
-            while current_Cd < Cd_objective or deflection < 90.:# Convet to degrees
-                previous_Cl = current_Cl
-                previous_Cd = current_Cd
-                previous_deflection = deflection
-                history.append([previous_deflection, previous_Cl, previous_Cd])
-                deflection = deflection + step
-            
-                upper_rotated, lower_rotated = rotate(upper_flap, lower_flap, hinge, deflection)
-                previous_flapped_airfoil = flapped_airfoil
-                flapped_airfoil = clean(upper_static, upper_rotated, lower_static, 
-                                        lower_rotated, hinge, deflection, N = 5)
-            
-                xf.create_input(airfoil, 'Type 3', airfoil = flapped_airfoil)
-                                            
-                xf.call(airfoil, alfas = alpha, Reynolds = Reynolds, iteration=1000, GDES = True,
-                        output='Polar')
-                filename = xf.file_name(airfoil, alpha, output='Polar')
-                Data = xf.output_reader(filename, output='Polar')
-                
-                #Rename to make more convenient
-                print(deflection)
-                current_Cd = Data['CD'][0]
-                current_Cl = Data['CL'][0]
-            print(current_Cd, deflection)
-            print(history)
-            print(Cd_objective)
-        deflection = previous_deflection
-        Cd = previous_Cd
-        Cl = previous_Cl
-        flapped_airfoil = previous_flapped_airfoil
-        
-    elif type == 'Range of deflection':
-        current_Cl = 0
-        current_Cd = 0
-        previous_Cl = 0
+    if type == 'Range of deflection':
+        deflections = []
         deflection = init_deflection
-        history = {'CD':[], 'CL':[], 'deflection':[]}
-        # Rough search
-        while deflection < max_deflection:# Convet to degrees
-            previous_Cl = current_Cl
-            previous_Cd = current_Cd
-            previous_deflection = deflection
-
+        while deflection + step <= max_deflection:
             deflection = deflection + step
-            print(deflection)
-            upper_rotated, lower_rotated = rotate(upper_flap, lower_flap, hinge, deflection)
-            
-            flapped_airfoil = clean(upper_static, upper_rotated, lower_static, 
-                                    lower_rotated, hinge, deflection, N = 5)
-        
-            xf.create_input(airfoil, 'Type 3', airfoil = flapped_airfoil)
-                                        
-            xf.call(airfoil, alfas = alpha, Reynolds = Reynolds, iteration=300, GDES = True,
-                    output='Polar')
-            filename = xf.file_name(airfoil, alpha, output='Polar')
-            Data = xf.output_reader(filename, output='Polar')
-            
+            deflections.append(deflection)
+        flap_map = FlapMap(x_hinge, upper_cruise, lower_cruise,
+                           Reynolds = Reynolds,
+                           iteration = kwargs.get('iteration', 300),
+                           processes = kwargs.get('processes', None))
+        Data = flap_map(deflections, alpha)
+        return {'CD': Data['CD'], 'CL': Data['CL'],
+                'deflection': Data['deflection']}
+
+    session = kwargs.get('session', None)
+    own_session = session is None
+    if own_session:
+        session = xf.XfoilSession(Reynolds = Reynolds, GDES = True,
+                                  iteration = kwargs.get('iteration', 100))
+
+    hinge, upper_flap, lower_flap, statics = _flap_parts(x_hinge,
+                                                         upper_cruise,
+                                                         lower_cruise)
+    results = {}
+    runs = []
+    def evaluate(deflection):
+        """Cl, Cd and flapped airfoil for a deflection in degrees."""
+        deflection = float(deflection)
+        if deflection not in results:
+            upper_static, lower_static = statics[np.sign(deflection)]
+            upper_rotated, lower_rotated = rotate(upper_flap, lower_flap,
+                                                  hinge, deflection)
+            flapped_airfoil = clean(upper_static, upper_rotated,
+                                    lower_static, lower_rotated, hinge,
+                                    deflection, N = 5, return_flap_i = False,
+                                    unit_deflection = 'deg')
+            xf.create_input(flapped_airfoil['x'], flapped_airfoil['y'],
+                            filename = airfoil,
+                            different_x_upper_lower = True)
+            Data = session.polar(airfoil, alpha)
+            if Data is None:
+                raise Exception('XFOIL did not converge for a deflection ' +
+                                'of %f degrees' % deflection)
             #Rename to make more convenient
-            print(deflection)
-            current_Cd = Data['CD'][0]
-            current_Cl = Data['CL'][0]
-            if deflection <= max_deflection:
-                history['CD'].append(current_Cd)
-                history['CL'].append(current_Cl)
-                history['deflection'].append(deflection)
-        return history
+            Cl = Data['CL'][0]
+            Cd = Data['CD'][0]
+            results[deflection] = (Cl, Cd, flapped_airfoil)
+            runs.append([deflection, Cl, Cd])
+        return results[deflection]
+
+    try:
+        #======================================================================
+        #  Find Deflection
+        #======================================================================
+        if type == 'Match trailing edge':
+            #Calculate deflection angle in radians
+            deflection = np.arctan2(hinge['y'] - y_TE_objective,
+                                    x_TE_objective - hinge['x']) - \
+                         np.arctan2(hinge['y'] - y_TE_baseline,
+                                    x_TE_baseline - hinge['x'])
+            # Convet to degrees
+            deflection = deflection*180./np.pi
+            Cl, Cd, flapped_airfoil = evaluate(deflection)
+
+        elif type == 'Same Cl' or type == 'Same Cd':
+            i = 0 if type == 'Same Cl' else 1
+            def residual(deflection):
+                return evaluate(deflection)[i] - objective
+
+            # Bracket the objective doubling the step
+            lower_bound = init_deflection
+            lower_residual = residual(lower_bound)
+            step = 2.
+            upper_bound = min(lower_bound + step, max_deflection)
+            while lower_residual*residual(upper_bound) > 0:
+                if upper_bound >= max_deflection:
+                    raise Exception('Objective not reached for deflections ' +
+                                    'up to %f degrees' % max_deflection)
+                lower_bound = upper_bound
+                lower_residual = residual(lower_bound)
+                step *= 2.
+                upper_bound = min(lower_bound + step, max_deflection)
+
+            deflection = brentq(residual, lower_bound, upper_bound,
+                                xtol = tolerance)
+            Cl, Cd, flapped_airfoil = evaluate(deflection)
+    finally:
+        if own_session:
+            session.close()
+    if kwargs.get('return_history', False):
+        return deflection, Cd, Cl, flapped_airfoil, runs
     return deflection, Cd, Cl, flapped_airfoil
 
+def _flap_polar(task):
+    """Polar points of one flapped airfoil for a list of angles of attack
+    (module-level so that it can be used by a pool of processes). Each
+    task has its own XFOIL session and airfoil file."""
+    import os
+    from aeropy import xfoil_module as xf
+
+    deflection, filename, x, y, alphas, session_kwargs = task
+    xf.create_input(x, y, filename = filename, different_x_upper_lower = True)
+    coefficients = []
+    with xf.XfoilSession(**session_kwargs) as session:
+        for alpha in alphas:
+            Data = session.polar(filename, alpha)
+            if Data is None:
+                coefficients.append((np.nan, np.nan))
+            else:
+                coefficients.append((Data['CL'][0], Data['CD'][0]))
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+    return deflection, alphas, coefficients
+
+class FlapMap():
+    """Cl and Cd of a plain flapped airfoil for a grid of deflections and
+    angles of attack.
+
+    The hinge and the static and flap parts of the airfoil are calculated
+    once, all the flapped geometries of a call are generated at once and
+    the XFOIL runs are distributed in a pool of processes. Results are
+    stored, so calling it again (e.g. with a finer step) only runs XFOIL
+    for the new deflections and angles of attack.
+
+    :param x_hinge: float x-coordinate of the hinge
+    :param upper: upper surface (dictionary or Airfoil) from the trailing
+                  edge to the leading edge
+    :param lower: lower surface (dictionary or Airfoil) from the leading
+                  edge to the trailing edge
+    :param Reynolds: Reynolds number (inviscid if 0)
+    :param iteration: number of XFOIL iterations
+    :param processes: number of processes (None uses all the cores and 1
+                      runs in the current process)
+    :param N: number of points on smooth transition (see clean)
+    :param airfoil: prefix of the airfoil files written for XFOIL
+
+        >>> flap_map = FlapMap(0.7, upper, lower, Reynolds=1e6)
+        >>> Data = flap_map(np.arange(-10, 11, 2.), alphas=[0, 2])
+        >>> Data = flap_map(np.arange(-10, 11, 1.), alphas=[0, 2])
+    """
+    def __init__(self, x_hinge, upper, lower, Reynolds = 0, iteration = 300,
+                 processes = None, N = 5, airfoil = 'flapped_airfoil'):
+        self.x_hinge = x_hinge
+        self.hinge, self.upper_flap, self.lower_flap, self.statics = \
+            _flap_parts(x_hinge, upper, lower)
+        self.session_kwargs = {'Reynolds': Reynolds, 'iteration': iteration,
+                               'GDES': True}
+        self.processes = processes
+        self.N = N
+        self.airfoil = airfoil
+        # (deflection, alpha): (Cl, Cd)
+        self.results = {}
+
+    def geometry(self, deflections):
+        """Flapped airfoils (Airfoil objects) for a list of deflections in
+        degrees, rotating all the flaps at once."""
+        deflections = np.atleast_1d(np.asarray(deflections, dtype=float))
+        upper_rotated, lower_rotated = rotate(self.upper_flap,
+                                              self.lower_flap, self.hinge,
+                                              deflections)
+        airfoils = []
+        for k, deflection in enumerate(deflections):
+            upper_static, lower_static = self.statics[np.sign(deflection)]
+            airfoils.append(clean(upper_static, upper_rotated[k],
+                                  lower_static, lower_rotated[k],
+                                  self.hinge, deflection, N = self.N,
+                                  return_flap_i = False,
+                                  unit_deflection = 'deg'))
+        return airfoils
+
+    def __call__(self, deflections, alphas = 0.):
+        """Calculate the missing points of the grid.
+
+        :param deflections: list of deflections in degrees
+        :param alphas: float or list of angles of attack in degrees
+
+        :rtype: dictionary with deflection, alpha, CL and CD lists for all
+                the points of the grid (CL and CD are nan for the points
+                where XFOIL did not converge).
+        """
+        from multiprocessing import Pool
+
+        deflections = [round(float(d), 9) for d in np.atleast_1d(deflections)]
+        alphas = [round(float(a), 9) for a in np.atleast_1d(alphas)]
+
+        missing = {}
+        for deflection in deflections:
+            new_alphas = [alpha for alpha in alphas
+                          if (deflection, alpha) not in self.results]
+            if new_alphas:
+                missing[deflection] = new_alphas
+
+        if missing:
+            airfoils = self.geometry(list(missing.keys()))
+            tasks = []
+            for (deflection, new_alphas), flapped in zip(missing.items(),
+                                                         airfoils):
+                # Unique file for each deflection
+                filename = '%s_%s' % (self.airfoil, ('%.6f' % deflection).replace(
+                    '-', 'n').replace('.', '_'))
+                tasks.append((deflection, filename, flapped['x'],
+                              flapped['y'], new_alphas, self.session_kwargs))
+            if self.processes == 1:
+                outputs = map(_flap_polar, tasks)
+                self._store(outputs)
+            else:
+                with Pool(self.processes) as pool:
+                    self._store(pool.imap_unordered(_flap_polar, tasks))
+
+        Data = {'deflection': [], 'alpha': [], 'CL': [], 'CD': []}
+        for deflection in deflections:
+            for alpha in alphas:
+                Cl, Cd = self.results[(deflection, alpha)]
+                Data['deflection'].append(deflection)
+                Data['alpha'].append(alpha)
+                Data['CL'].append(Cl)
+                Data['CD'].append(Cd)
+        return Data
+
+    def _store(self, outputs):
+        for deflection, alphas, coefficients in outputs:
+            for alpha, values in zip(alphas, coefficients):
+                self.results[(deflection, alpha)] = values
+
 def offset_point(x, y, rho, output_format = 'separate'):
     """Function to calculate offset curve for a line given by points x and y
-    with a distance rho. If output_format = 'separate', the output are 
+    with a distance rho. If output_format = 'separate', the output are
     two list x and y, if 'together, it outputs a unique set with where
-    each component is  apari of x and y.'"""
-    if type(x) == np.array and type(y) == np.array:
-        x_offset = x + rho*y/np.sqrt(x*x + y*y)
-        y_offset = y - rho*x/np.sqrt(x*x + y*y)
-    
+    each component is  apari of x and y.'
+
+    Each point is moved perpendicularly to its position vector (see
+    offset_curve for an offset normal to the curve)."""
+    x_offset = np.asarray(x, dtype=float)
+    y_offset = np.asarray(y, dtype=float)
+    r = np.sqrt(x_offset**2 + y_offset**2)
+    # Ignore 0 points because they result in zero denominator
+    nonzero = r != 0
+    x_offset, y_offset, r = x_offset[nonzero], y_offset[nonzero], r[nonzero]
+    x_offset, y_offset = x_offset + rho*y_offset/r, y_offset - rho*x_offset/r
     if type(x) == list and type(y) == list:
-        x_offset = []
-        y_offset = []
-        for i in range(len(x)):
-            # Ignore 0 points because they result in zero denominator
-            try:
-                x_offset.append(x[i] + rho*y[i]/np.sqrt(x[i]**2 + y[i]**2))
-                y_offset.append(y[i] - rho*x[i]/np.sqrt(x[i]**2 + y[i]**2))
-            except ZeroDivisionError:
-                continue
-    #TODO: include option of eliminating lines that intersect
-        
+        x_offset = x_offset.tolist()
+        y_offset = y_offset.tolist()
+
     if output_format == 'together':
-        return zip(x_offset, y_offset)
-    if output_format == 'separate': 
+        return list(zip(x_offset, y_offset))
+    if output_format == 'separate':
         return x_offset, y_offset
 
+def _trim_loops(x, y):
+    """Remove the loops of a curve that intersects itself. For each
+    self-intersection the smaller part of the curve (between the two
+    segments or outside of them) is replaced by the intersection point,
+    starting with the smallest loop."""
+    while len(x) > 3:
+        xs = np.vstack((x[:-1], x[1:]))
+        ys = np.vstack((y[:-1], y[1:]))
+        i, j = _overlapping_segments(xs, ys, xs, ys)
+        # non-adjacent segments, each pair only once
+        pair = j > i + 1
+        i, j = i[pair], j[pair]
+        r0, r1 = _solve_segments(xs, ys, xs, ys, i, j)
+        crossing = (r0 >= 0) & (r0 < 1) & (r1 >= 0) & (r1 < 1)
+        if not np.any(crossing):
+            break
+        i, j, r0 = i[crossing], j[crossing], r0[crossing]
+        # number of points inside (i+1 to j) and outside of the loop
+        inside = j - i
+        outside = len(x) - inside
+        k = np.argmin(np.minimum(inside, outside))
+        x_k = xs[0, j[k]] + r0[k]*(xs[1, j[k]] - xs[0, j[k]])
+        y_k = ys[0, j[k]] + r0[k]*(ys[1, j[k]] - ys[0, j[k]])
+        if inside[k] <= outside[k]:
+            x = np.concatenate([x[:i[k]+1], [x_k], x[j[k]+1:]])
+            y = np.concatenate([y[:i[k]+1], [y_k], y[j[k]+1:]])
+        else:
+            # closed curve, the ends are removed
+            x = np.concatenate([[x_k], x[i[k]+1:j[k]+1], [x_k]])
+            y = np.concatenate([[y_k], y[i[k]+1:j[k]+1], [y_k]])
+    return x, y
+
+def offset_curve(x, y, rho, dydx = None, trim = True):
+    """Offset curve at a distance rho along the normal of the curve (e.g.
+    the inner mold line of an airfoil skin with thickness rho).
+
+    :param x: x coordinates, a list or an array (n_curves x n_points) to
+              offset several curves at once.
+    :param y: y coordinates with the same shape as x.
+    :param rho: offset distance (float or one value per curve). Positive
+                values move the points to the left of the direction of the
+                curve, i.e. inwards for airfoils in XFOIL order.
+    :param dydx: derivatives dy/dx of the curve at the points (e.g. from
+                 the CST derivatives, can be inf at the leading edge). If
+                 not defined, the tangents are calculated with second
+                 order finite differences.
+    :param trim: if True, the loops created where rho is larger than the
+                 local radius of curvature (e.g. near the trailing edge)
+                 are removed.
+
+    :returns: x and y of the offset curves. Arrays with the same shape as
+              the inputs, except when trim is True for several curves, in
+              which case they are lists with one array per curve (the
+              number of points can change).
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # tangents along the last axis
+    tx = np.gradient(x, axis=-1)
+    ty = np.gradient(y, axis=-1)
+    if dydx is not None:
+        # angle of the derivative, with the direction of the curve
+        angle = np.arctan(np.asarray(dydx, dtype=float))
+        direction = np.sign(tx)
+        known = direction != 0
+        tx = np.where(known, direction*np.cos(angle), tx)
+        ty = np.where(known, direction*np.sin(angle), ty)
+    norm = np.hypot(tx, ty)
+    norm[norm == 0] = 1.
+
+    rho = np.asarray(rho, dtype=float)
+    if x.ndim > 1:
+        rho = np.reshape(rho, np.shape(rho) + (1,))
+    x_offset = x - rho*ty/norm
+    y_offset = y + rho*tx/norm
+
+    if not trim:
+        return x_offset, y_offset
+    if x.ndim == 1:
+        return _trim_loops(x_offset, y_offset)
+    trimmed = [_trim_loops(x_i, y_i) for x_i, y_i in
+               zip(x_offset.reshape(-1, x.shape[-1]),
+                   y_offset.reshape(-1, x.shape[-1]))]
+    return [t[0] for t in trimmed], [t[1] for t in trimmed]
+
+class ShapeDifference():
+    """Objective function of the CST fits. Defined at module level so that
+    it can be pickled and sent to a pool of workers.
+
+    :param upper: dictionary with normalized x and y keys (upper surface).
+    :param lower: dictionary with normalized x and y keys (lower surface).
+    :param order: order of the Bernstein polynomials.
+    :param deltaz: trailing edge thickness (each surface has deltaz/2).
+    :param N1, N2: class coefficients. If None, the two last inputs are
+           N1 and N2.
+    :param error: 'eucledian' (sum of the distances between the points
+           with the same x) or 'hausdorff'.
+    :param optimize_deltaz: if True, the input after Au and Al is deltaz.
+    :param parameterization: batched function with the same interface as
+           CST_batch (e.g. other_methods.bspline_batch or
+           functools.partial(hicks_henne_batch, peaks=...)), used instead
+           of CST. order is then the number of shape coefficients per
+           surface minus one, and N1 and N2 are not used.
+    :param early_termination: for 'hausdorff', the best error found so far
+           is the upper bound of the distance queries, and candidates that
+           exceed it are not calculated further. Their error is then
+           the largest vertical distance to the target, an upper bound of
+           the Hausdorff distance that is cheap to calculate and keeps the
+           candidates ranked for the optimizer.
+
+    The inputs are Au + Al (+ deltaz) (+ N1, N2). Called with a matrix
+    (n_inputs x S), as done by differential_evolution(vectorized=True),
+    the S candidates are calculated at once with CST_batch and an array
+    with S errors is returned.
+    """
+    def __init__(self, upper, lower, order, deltaz = 0., N1 = None,
+                 N2 = None, error = 'eucledian', optimize_deltaz = False,
+                 parameterization = None, early_termination = True):
+        self.upper = {'x': np.asarray(upper['x'], dtype=float),
+                      'y': np.asarray(upper['y'], dtype=float)}
+        self.lower = {'x': np.asarray(lower['x'], dtype=float),
+                      'y': np.asarray(lower['y'], dtype=float)}
+        self.order = order
+        self.deltaz = deltaz
+        self.N1 = N1
+        self.N2 = N2
+        self.error = error
+        self.optimize_deltaz = optimize_deltaz
+        self.parameterization = parameterization
+        self.early_termination = early_termination
+        self.best = np.inf
+        # The target surfaces do not change, so their KD-trees are only
+        # built once
+        if error == 'hausdorff':
+            from aeropy.geometry.shape_distance import ShapeIndex
+            self.upper_index = ShapeIndex(self.upper)
+            self.lower_index = ShapeIndex(self.lower)
+
+    def __call__(self, inputs):
+        inputs = np.asarray(inputs, dtype=float)
+        population = np.atleast_2d(inputs.T)
+        n = self.order + 1
+
+        Au = population[:, :n]
+        Al = population[:, n:2*n]
+        if self.optimize_deltaz:
+            deltaz = population[:, 2*n]
+        else:
+            deltaz = self.deltaz
+
+        if self.parameterization is not None:
+            y_u = self.parameterization(self.upper['x'], 1, deltaz/2., Au=Au)
+            y_l = self.parameterization(self.lower['x'], 1, deltaz/2., Al=Al)
+        else:
+            if self.N1 is None and self.N2 is None:
+                N1 = population[:, -2]
+                N2 = population[:, -1]
+            else:
+                N1 = 0.5 if self.N1 is None else self.N1
+                N2 = 1. if self.N2 is None else self.N2
+            y_u = CST_batch(self.upper['x'], 1, deltaz/2., Au=Au, N1=N1,
+                            N2=N2)
+            y_l = CST_batch(self.lower['x'], 1, deltaz/2., Al=Al, N1=N1,
+                            N2=N2)
+
+        if self.error == 'eucledian':
+            from aeropy.geometry.shape_distance import eucledian_shape_difference
+            d = eucledian_shape_difference(self.upper,
+                                           {'x': self.upper['x'], 'y': y_u}) + \
+                eucledian_shape_difference(self.lower,
+                                           {'x': self.lower['x'], 'y': y_l})
+        else:
+            # Candidates are discarded as soon as a directed distance is
+            # larger than the best error so far
+            bound = self.best if self.early_termination else np.inf
+            h_u = np.atleast_1d(self.upper_index.hausdorff(
+                {'x': self.upper['x'], 'y': y_u}, bound))
+            close = np.isfinite(h_u)
+            h_l = np.full(len(h_u), np.inf)
+            if np.any(close):
+                h_l[close] = self.lower_index.hausdorff(
+                    {'x': self.lower['x'], 'y': y_l[close]},
+                    bound - np.min(h_u[close]))
+            d = h_u + h_l
+            if np.any(np.isfinite(d)):
+                self.best = min(self.best, np.min(d[np.isfinite(d)]))
+            # The points of the candidates have the same x as the target,
+            # so the largest vertical distance is an upper bound of the
+            # Hausdorff distance
+            far = ~np.isfinite(d)
+            d[far] = np.max(np.abs(y_u[far] - self.upper['y']), axis=-1) + \
+                     np.max(np.abs(y_l[far] - self.lower['y']), axis=-1)
+        if inputs.ndim == 1:
+            return d[0]
+        return d
+
 def fitting_shape_coefficients(data, order, translate=True, rotate=True, 
                                mirror=True, filter_size = 10, deltaz = 0,
                                N1 = None, N2 = None, 
                                solver = 'differential_evolution',
-                               error = 'eucledian'):
+                               error = 'eucledian', popsize = 40,
+                               workers = 1, vectorized = False, seed = None):
     '''Fit shape coefficient to 2D geometry. Assumes data is sorted from 
       TE to LE along upper surface and back to TE along lower surface.
       Can calculate leading edge for a simple case where upper surface
@@ -1233,64 +1931,50 @@ def fitting_shape_coefficients(data, order, translate=True, rotate=True,
     :param data: dictionary with x and y keys.
     
     :param order: order of the CST equations.
+
+    :param solver: 'differential_evolution', 'gradient' or 'lstsq'. The
+           gradient solver minimizes the sum of the squared residuals of
+           both surfaces using the analytic gradient from CST_jacobian.
+           'lstsq' solves the shape coefficients directly as a linear
+           least-squares problem (see least_squares_shape_coefficients);
+           if N1 and N2 are not given, differential evolution is only
+           used to search N1 and N2.
+
+    :param popsize, workers, seed: passed to differential_evolution.
+           workers = -1 uses all the cores.
+
+    :param vectorized: if True, differential_evolution evaluates the
+           whole population at once (ShapeDifference is vectorized).
     '''
     from scipy.optimize import differential_evolution
-    from optimization_tools import hausdorff_distance_2D, eucledian_shape_difference
     from scipy.optimize import minimize
 
+    # error is reused for the outputs
+    error_type = error
 
-    def total_shape_difference(inputs, error_type = 'eucledian'):
+    def total_squared_difference(inputs):
+        """Sum of the squared residuals of both surfaces and its gradient
+        with respect to the inputs."""
         Au = inputs[:order+1]
         Al = inputs[order+1:2*order+2]
-
-        
         if find_class:
-            N1 = inputs[-2]
-            N2 = inputs[-1]
-            
+            N1_i, N2_i = inputs[-2], inputs[-1]
         else:
-            N1 = 0.5
-            N2 = 1.0
-
-        error = 0
-        error += shape_difference_upper(inputs, upper, error_type)
-        error += shape_difference_lower(inputs, lower, error_type)
+            N1_i, N2_i = class_coefficients
 
-        return error
+        r_u = CST(upper['x'], 1, deltasz = deltaz/2., Au=Au, N1 = N1_i,
+                  N2 = N2_i) - np.asarray(upper['y'])
+        r_l = CST(lower['x'], 1, deltasz = deltaz/2., Al=Al, N1 = N1_i,
+                  N2 = N2_i) - np.asarray(lower['y'])
+        J_u = CST_jacobian(upper['x'], 1, Au, N1_i, N2_i, 'u')
+        J_l = CST_jacobian(lower['x'], 1, Al, N1_i, N2_i, 'l')
 
-    def shape_difference_upper(inputs, raw_upper, error):
-        shape_coefficients = inputs[:order+1]
+        error = np.dot(r_u, r_u) + np.dot(r_l, r_l)
+        gradient = [np.dot(r_u, J_u['A']), np.dot(r_l, J_l['A'])]
         if find_class:
-            y = CST(raw_upper['x'], 1, deltasz = deltaz/2., Au=shape_coefficients,
-                    N1 = inputs[-2], N2 = inputs[-1])
-        else:
-            y = CST(raw_upper['x'], 1, deltasz = deltaz/2., Au=shape_coefficients)
-        a = raw_upper
-        b = {'x': raw_upper['x'], 'y': y}
-
-        if error == 'eucledian':
-            d = eucledian_shape_difference(a,b)
-        else:
-            d = hausdorff_distance_2D(a, b)
-
-        return d
-
-    def shape_difference_lower(inputs, raw_lower, error):
-        shape_coefficients = inputs[order+1:2*order+2]
-
-        if find_class:
-            y = CST(raw_lower['x'], 1, deltasz = deltaz/2., Al=shape_coefficients,
-                    N1 = inputs[-2], N2 = inputs[-1])
-        else:
-            y = CST(raw_lower['x'], 1, deltasz = deltaz/2., Al=shape_coefficients,)
-
-        a = raw_lower
-        b = {'x': raw_lower['x'], 'y': y}
-        if error == 'eucledian':
-            d = eucledian_shape_difference(a,b)
-        else:
-            d = hausdorff_distance_2D(a, b)
-        return d
+            gradient.append([np.dot(r_u, J_u['N1']) + np.dot(r_l, J_l['N1']),
+                             np.dot(r_u, J_u['N2']) + np.dot(r_l, J_l['N2'])])
+        return error, 2*np.concatenate(gradient)
 
     def separate_upper_lower(data):
         for i in range(len(data['x'])):
@@ -1302,76 +1986,30 @@ def fitting_shape_coefficients(data, order, translate=True, rotate=True,
                  'y': data['y'][i:]}
         return upper, lower
 
-    def processing_data():
-
-        processed_data = {'x':[], 'y':[]}
-        min_x = min(data['x'])
-        chord = max(data['x']) - min(data['x'])
-
-        # translate to origin and normalize everything
-        for i in range(len(data['x'])):
-            processed_data['x'].append((data['x'][i] - min_x)/chord)
-            processed_data['y'].append(data['y'][i]/chord)
-        data = processed_data
+    def processing_data(data):
+        x = np.array(data['x'], dtype=float)
+        y = np.array(data['y'], dtype=float)
 
         # Mirroring data
         if mirror:
-            processed_data = {'x':[], 'y':[]}
-            for i in range(len(data['x'])):
-                processed_data['x'].append(.5 - (data['x'][i] - .5))
-                processed_data['y'].append(data['y'][i])
-            data = processed_data
-
-        # plt.scatter(data['x'], data['y'])
-        # plt.show()
-
-        # Tranlating in y
-        if translate:
-            LE_x = min(data['x'])
-            LE_index = data['x'].index(LE_x)
-            LE_y = data['y'][LE_index]
-            for i in range(len(data['x'])):
-                data['y'][i] -= LE_y
-
-        # plt.scatter(data['x'], data['y'])
-        # plt.show()
-
-        if rotate:
-            x_TE = (data['x'][0] + data['x'][-1])/2.
-            y_TE = (data['y'][0] + data['y'][-1])/2.
-
-            # Rotating airfoil
-            theta_TE = math.atan(-y_TE/x_TE)
-
-            # position trailing edge at the x-axis
-            processed_data = {'x':[], 'y':[]}
-            for i in range(len(data['x'])):
-                x = data['x'][i]
-                y = data['y'][i]
-                c_theta = math.cos(theta_TE)
-                s_theta = math.sin(theta_TE)
-                x_rotated = c_theta*x - s_theta*y
-                y_rotated = s_theta*x + c_theta*y
-                processed_data['x'].append(x_rotated)
-                processed_data['y'].append(y_rotated)
-            data = processed_data
-
-        # Reduce number of points
-        if filter_size != 1:
-            processed_data = {'x':[], 'y':[]}
-            for i in range(len(data['x'])):
-                for key in data.keys():
-                    if i%filter_size == 0:
-                        processed_data[key].append(data[key][i])
-                    elif i == len(data['x']) -1:
-                        processed_data[key].append(data[key][i])
-            data = processed_data
+            x = -x
 
-        for key in data.keys():
-            data[key] = list(reversed(data[key]))
+        # translate the leading edge to the origin, position the trailing
+        # edge at the x-axis and normalize everything
+        x, y, edges = normalize_airfoil(x, y, rotate = rotate)
 
-        deltaz = (data['y'][0] - data['y'][-1])/2.
+        # Keep the vertical position of the leading edge
+        if not translate:
+            y = y + edges['y_LE']/edges['chord']
 
+        # Reduce number of points (the last point is always kept)
+        if filter_size != 1:
+            keep = np.arange(len(x)) % filter_size == 0
+            keep[-1] = True
+            x = x[keep]
+            y = y[keep]
+
+        data = {'x': list(x[::-1]), 'y': list(y[::-1])}
         upper, lower = separate_upper_lower(data)
         return upper, lower
 
@@ -1382,24 +2020,53 @@ def fitting_shape_coefficients(data, order, translate=True, rotate=True,
         # used. N1 and N2 are the same for upper and lower.
         if find_class:
             bounds += [[0., 1.],[0., 1.]]
+        if solver == 'lstsq':
+            def class_difference(class_inputs):
+                return least_squares_shape_coefficients(upper, lower, order,
+                                                        class_inputs[0],
+                                                        class_inputs[1],
+                                                        deltaz)[-1]
+            if find_class:
+                result = differential_evolution(class_difference, bounds[-2:])
+                N1, N2 = result.x
+            else:
+                N1, N2 = class_coefficients
+            Au, Al, _, error = least_squares_shape_coefficients(
+                upper, lower, order, N1, N2, deltaz)
+
         if solver == 'differential_evolution':
-            result = differential_evolution(total_shape_difference, bounds,
-                                                  disp=True, popsize = 40)
+            if find_class:
+                objective = ShapeDifference(upper, lower, order, deltaz,
+                                            error = error_type)
+            else:
+                objective = ShapeDifference(upper, lower, order, deltaz,
+                                            class_coefficients[0],
+                                            class_coefficients[1], error_type)
+            # Parallel and vectorized evaluations need deferred updating
+            if workers != 1 or vectorized:
+                updating = 'deferred'
+            else:
+                updating = 'immediate'
+            result = differential_evolution(objective, bounds, disp=True,
+                                            popsize = popsize, seed = seed,
+                                            workers = workers,
+                                            vectorized = vectorized,
+                                            updating = updating)
             Au = result.x[:order+1]
             Al = result.x[order+1:2*order+2]
             if find_class:
                 N1 = result.x[-2]
                 N2 = result.x[-1]
             else:
-                N1 = 0.5
-                N2 = 1.0
-            error = solution.fun
+                N1, N2 = class_coefficients
+            error = result.fun
 
         if solver == 'gradient':
             x0 = (2*order+2)*[0.05,]
             if find_class:
                 x0 += [0.5, 1.0]
-            solution = minimize(total_shape_difference, x0, bounds = bounds)
+            solution = minimize(total_squared_difference, x0, jac = True,
+                                bounds = bounds)
             # print solution
 
             Au = solution['x'][:order+1]
@@ -1408,8 +2075,7 @@ def fitting_shape_coefficients(data, order, translate=True, rotate=True,
                 N1 = solution['x'][-2]
                 N2 = solution['x'][-1]
             else:
-                N1 = 0.5
-                N2 = 1.0
+                N1, N2 = class_coefficients
             error = solution['fun']
         return Au, Al, N1, N2, deltaz, error
     # If data is a list with two dictionaries, it is assumed that the data
@@ -1418,10 +2084,11 @@ def fitting_shape_coefficients(data, order, translate=True, rotate=True,
         upper = data[0]
         lower = data[1]
     else:
-        [upper, lower] = processing_data()
+        [upper, lower] = processing_data(data)
     
-    if N1 is None and N2 is None:
-        find_class = True
+    find_class = N1 is None and N2 is None
+    # Class coefficients used when they are not part of the optimization
+    class_coefficients = [0.5 if N1 is None else N1, 1.0 if N2 is None else N2]
     # print total_shape_difference([0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0])
     # BREAK
     #==============================================================================
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Bernstein polynomial and CST kernel shared by all the CST modules.
+
+Current functionalities:
+- binomial coefficient tables (computed once per order)
+- Bernstein basis matrices and their derivatives, cached for each psi
+  grid and order
+- class function and CST basis, so that evaluating any CST surface is a
+  single matrix product
+"""
+from __future__ import print_function
+
+from functools import lru_cache
+
+import numpy as np
+
+@lru_cache(maxsize=None)
+def _binomial_row(n):
+    """Row n of Pascal's triangle as a tuple of integers."""
+    row = [1]
+    for r in range(n):
+        row.append(row[-1]*(n - r)//(r + 1))
+    return tuple(row)
+
+def binomial(n):
+    """Array with the binomial coefficients K(r,n) for r = 0, ..., n."""
+    return np.array(_binomial_row(n), dtype=float)
+
+def K(r, n):
+    """Binomial coefficient of the Bernstein polynomial (same as the
+    K(r,n) functions previously defined in each module)."""
+    return _binomial_row(n)[r]
+
+@lru_cache(maxsize=128)
+def _cached_basis(key, shape, n, derivative):
+    psi = np.frombuffer(key, dtype=float).reshape(shape)
+    if derivative == 0:
+        r = np.arange(n + 1)
+        psi = psi[..., np.newaxis]
+        basis = binomial(n)*psi**r*(1. - psi)**(n - r)
+    else:
+        # d/dpsi B(r,n) = n*(B(r-1,n-1) - B(r,n-1))
+        lower = np.zeros(shape + (n + 2,))
+        if n > 0:
+            lower[..., 1:-1] = _cached_basis(key, shape, n - 1,
+                                             derivative - 1)
+        basis = n*(lower[..., :-1] - lower[..., 1:])
+    basis.setflags(write=False)
+    return basis
+
+def bernstein_basis(psi, n, derivative = 0):
+    """Bernstein basis matrix for a grid psi and order n.
+
+    :param psi: float or array of any shape with non-dimensional
+                coordinates.
+    :param n: order of the Bernstein polynomial (number of shape
+              coefficients minus one).
+    :param derivative: order of the derivative with respect to psi.
+
+    :rtype: read-only array with shape psi.shape + (n+1,), where the
+            last axis is K(r,n)*psi**r*(1-psi)**(n-r) for r = 0, ..., n.
+            Results are cached, so the same grid and order are only
+            calculated once.
+    """
+    psi = np.asarray(psi, dtype=float)
+    return _cached_basis(psi.tobytes(), psi.shape, n, derivative)
+
+def degree_elevation(A):
+    """Coefficients of order n+1 that describe exactly the same Bernstein
+    polynomial as the n+1 coefficients in A (useful to warm start a fit of
+    a higher order from a previous one)."""
+    A = np.asarray(A, dtype=float)
+    n = len(A) - 1
+    i = np.arange(n + 2)/(n + 1.)
+    elevated = np.zeros(n + 2)
+    elevated[1:] += i[1:]*A
+    elevated[:-1] += (1. - i[:-1])*A
+    return elevated
+
+def class_function(psi, N1 = 0.5, N2 = 1.):
+    """Class function psi**N1*(1-psi)**N2."""
+    psi = np.asarray(psi, dtype=float)
+    return psi**N1*(1. - psi)**N2
+
+def CST_basis(psi, n, N1 = 0.5, N2 = 1.):
+    """Basis of the CST surface, class function times the Bernstein
+    basis, with shape psi.shape + (n+1,)."""
+    return class_function(psi, N1, N2)[..., np.newaxis]* \
+           bernstein_basis(psi, n)
+
+def CST_surface(psi, A, N1 = 0.5, N2 = 1., deltaz = 0., deltaLE = 0.):
+    """Non-dimensional CST surface (xi = y/c) for shape coefficients A.
+
+    A can be a list (one surface) or an array (n_designs x n+1), in which
+    case the output has shape (n_designs,) + psi.shape and N1, N2, deltaz
+    and deltaLE can be floats or arrays with one value per design."""
+    A = np.asarray(A, dtype=float)
+    psi = np.asarray(psi, dtype=float)
+    S = np.dot(bernstein_basis(psi, A.shape[-1] - 1), A.T)
+    if A.ndim > 1:
+        S = np.moveaxis(S, -1, 0)
+        # one value per design
+        N1, N2, deltaz, deltaLE = [np.reshape(v, np.shape(v) + (1,)*psi.ndim)
+                                   for v in (N1, N2, deltaz, deltaLE)]
+    return class_function(psi, N1, N2)*S + psi*deltaz + (1. - psi)*deltaLE
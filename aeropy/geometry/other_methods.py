@@ -1,53 +1,192 @@
-import math
+"""
+Alternative airfoil parameterizations to CST.
+
+Current functionalities:
+- B-spline basis (iterative Cox-de Boor, cached for each grid, knot
+  vector and degree) and B-spline curves
+- Hicks-Henne bump functions (cached for each grid and set of bumps)
+- bspline_batch and hicks_henne_batch, with the same interface as
+  CST_batch, so that optimizers (e.g. ShapeDifference) can switch
+  parameterizations and still evaluate all designs with one product
+"""
+from functools import lru_cache
+
 import numpy as np
-import matplotlib.pyplot as plt
-
-def hicks_henne(x, z, alfa):
-    z = np.array(z)
-    for j in range(len(x)):
-        x_j = x[j]
-        f_1 = math.sqrt(x_j)*(1-x_j)/math.exp(15*x_j)
-        f_2 = math.sqrt(x_j)*(1-x_j)/math.exp(15*x_j)
-        f_3 = math.sqrt(x_j)*(1-x_j)/math.exp(15*x_j)
-        f_4 = math.sqrt(x_j)*(1-x_j)/math.exp(15*x_j)
-        f_5 = math.sqrt(x_j)*(1-x_j)/math.exp(10*x_j)
-        for i in range(len(alfa)):
-            b_i = math.sin(math.pi*x[j]**(math.log(0.5)/math.log(x_list[i])))**t[i]
-            z[j] += alfa[i]*b_i
-    return z
+
+from aeropy.geometry.airfoil import surfaces_batch
+
+def clamped_knots(n, k):
+    """Uniform clamped knot vector in [0, 1] for n control points and
+    degree k (the curve starts at the first and ends at the last control
+    point)."""
+    if n < k + 1:
+        raise Exception('A B-spline of degree %i needs at least %i ' % (k, k+1)
+                        + 'control points')
+    interior = np.linspace(0., 1., n - k + 1)[1:-1]
+    return np.concatenate([np.zeros(k + 1), interior, np.ones(k + 1)])
+
+@lru_cache(maxsize=128)
+def _cached_bspline_basis(key, shape, t, k):
+    x = np.frombuffer(key, dtype=float).reshape(shape)[..., np.newaxis]
+    t = np.array(t)
+    # degree 0: indicator of each knot span
+    basis = ((t[:-1] <= x) & (x < t[1:])).astype(float)
+    # the end of the domain belongs to the last non-empty span
+    last = np.flatnonzero(t[:-1] < t[1:])
+    if len(last):
+        last = last[-1]
+        basis[..., last] = np.where(x[..., 0] == t[last + 1], 1.,
+                                    basis[..., last])
+    # Cox-de Boor, one degree at a time for all points and functions
+    # (0/0 is taken as 0)
+    for d in range(1, k + 1):
+        left = t[d:-1] - t[:-d-1]
+        right = t[d+1:] - t[1:-d]
+        left = np.where(left == 0, np.inf, left)
+        right = np.where(right == 0, np.inf, right)
+        basis = (x - t[:-d-1])/left*basis[..., :-1] + \
+                (t[d+1:] - x)/right*basis[..., 1:]
+    basis.setflags(write=False)
+    return basis
+
+def bspline_basis(x, t, k):
+    """B-spline basis matrix for a grid x, knot vector t and degree k.
+
+    :param x: float or array of any shape.
+    :param t: knot vector (non-decreasing).
+    :param k: degree.
+
+    :rtype: read-only array with shape x.shape + (len(t)-k-1,). Results
+            are cached, so the same grid, knots and degree are only
+            calculated once.
+    """
+    x = np.asarray(x, dtype=float)
+    t = tuple(float(t_i) for t_i in t)
+    return _cached_bspline_basis(x.tobytes(), x.shape, t, k)
 
 def B(x, k, i, t):
-    if k == 0:
-       return 1.0 if t[i] <= x < t[i+1] else 0.0
-    if t[i+k] == t[i]:
-       c1 = 0.0
-    else:
-       c1 = (x - t[i])/(t[i+k] - t[i]) * B(x, k-1, i, t)
-    if t[i+k+1] == t[i+1]:
-       c2 = 0.0
-    else:
-       c2 = (t[i+k+1] - x)/(t[i+k+1] - t[i+1]) * B(x, k-1, i+1, t)
-    return c1 + c2
+    """Value of the i-th B-spline basis function of degree k at x."""
+    return bspline_basis(x, t, k)[..., i][()]
 
 def bspline(x, t, c, k):
+    """B-spline curve with knots t, control points c and degree k at x
+    (float or array)."""
     n = len(t) - k - 1
     assert (n >= k+1) and (len(c) >= n)
-    return sum(c[i] * B(x, k, i, t) for i in range(n))    
-
-# Bezier Curve
-k = 2
-t = [0, 1, 2, 3, 4, 5, 6]
-c = [-1, 2, 0, -1]
-x = np.linspace(1.5, 4.5, 50)
-y_bezier = []
-for x_i in x:
-    y_bezier.append(bspline(x_i, t, c ,k))
-    
-# Hicks-Henne
-y_hh = hicks_henne(x, y_bezier, [.1], [.0000001],[4.])    
-plt.plot(x,y_bezier,label='Bezier')
-plt.plot(x,y_hh,label='Hickes-Henne')
-plt.xlabel('x')
-plt.ylabel('z')
-plt.legend()
-plt.show()
\ No newline at end of file
+    return np.dot(bspline_basis(x, t, k), np.asarray(c, dtype=float)[:n])
+
+def _linear_terms(psi, deltaz, deltaLE):
+    """Trailing and leading edge thickness terms with one value per
+    design (same convention as CST_surface)."""
+    deltaz, deltaLE = [np.reshape(v, np.shape(v) + (1,)*psi.ndim)
+                       for v in (deltaz, deltaLE)]
+    return psi*deltaz + (1. - psi)*deltaLE
+
+def bspline_batch(x, c, deltasz=None, Au=None, Al=None, k=3, knots=None,
+                  deltasLE=None):
+    """B-spline version of CST_batch, the shape coefficients are the
+    control points of the surfaces (y/c).
+
+    :param x: list or numpy.array of points along the chord.
+    :param c: chord
+    :param deltasz: trailing edge thicknesses (same format as CST_batch).
+    :param Au: array (n_designs x n_coeffs) of upper control points.
+    :param Al: array (n_designs x n_coeffs) of lower control points.
+    :param k: degree of the B-spline.
+    :param knots: knot vector. If None, a uniform clamped knot vector
+                  (see clamped_knots) is used.
+    :param deltasLE: leading edge thicknesses, same format as deltasz.
+
+    :rtype: same as CST_batch.
+    """
+    def surface_function(psi, A, deltaz, deltaLE):
+        t = clamped_knots(A.shape[-1], k) if knots is None else knots
+        S = np.dot(bspline_basis(psi, t, k), A.T)
+        return np.moveaxis(S, -1, 0) + _linear_terms(psi, deltaz, deltaLE)
+    return surfaces_batch(x, c, deltasz, Au, Al, deltasLE, surface_function)
+
+@lru_cache(maxsize=128)
+def _cached_hicks_henne_basis(key, shape, peaks, widths):
+    x = np.frombuffer(key, dtype=float).reshape(shape)[..., np.newaxis]
+    exponent = np.log(0.5)/np.log(np.array(peaks))
+    basis = np.sin(np.pi*x**exponent)**np.array(widths)
+    basis.setflags(write=False)
+    return basis
+
+def hicks_henne_basis(x, peaks, widths = 4.):
+    """Hicks-Henne bump functions sin(pi*x**(ln(0.5)/ln(h)))**w.
+
+    :param x: float or array of any shape in [0, 1].
+    :param peaks: list of the locations h of the maximum of each bump.
+    :param widths: float or list with the exponent w of each bump (larger
+                   values give narrower bumps).
+
+    :rtype: read-only array with shape x.shape + (len(peaks),), cached
+            as bspline_basis.
+    """
+    x = np.asarray(x, dtype=float)
+    peaks = tuple(float(h) for h in np.atleast_1d(peaks))
+    widths = tuple(float(w) for w in np.broadcast_to(widths, len(peaks)))
+    return _cached_hicks_henne_basis(x.tobytes(), x.shape, peaks, widths)
+
+def hicks_henne(x, z, alfa, peaks, widths = 4.):
+    """Add Hicks-Henne bumps with amplitudes alfa to the surface z at x
+    (see hicks_henne_basis)."""
+    return np.asarray(z, dtype=float) + \
+           np.dot(hicks_henne_basis(x, peaks, widths), alfa)
+
+def hicks_henne_batch(x, c, deltasz=None, Au=None, Al=None, peaks=None,
+                      widths=4., baseline=None, deltasLE=None):
+    """Hicks-Henne version of CST_batch, the shape coefficients are the
+    amplitudes of the bumps added to a baseline airfoil.
+
+    :param x: list or numpy.array of points along the chord.
+    :param c: chord
+    :param deltasz: trailing edge thicknesses (same format as CST_batch).
+    :param Au: array (n_designs x n_bumps) of upper amplitudes.
+    :param Al: array (n_designs x n_bumps) of lower amplitudes. As in
+               CST, positive values move the lower surface down.
+    :param peaks: locations of the bumps. If None, n_bumps locations
+                  equally spaced between 0 and 1 are used.
+    :param widths: float or list with the width exponent of each bump.
+    :param baseline: y of the baseline airfoil at x, with the same
+                     structure as the output (dictionary with 'u' and 'l'
+                     or one array). If None, the bumps are added to a
+                     flat plate.
+    :param deltasLE: leading edge thicknesses, same format as deltasz.
+
+    :rtype: same as CST_batch.
+    """
+    def surface_function(psi, A, deltaz, deltaLE):
+        if peaks is None:
+            h = np.linspace(0., 1., A.shape[-1] + 2)[1:-1]
+        else:
+            h = peaks
+        S = np.dot(hicks_henne_basis(psi, h, widths), A.T)
+        return np.moveaxis(S, -1, 0) + _linear_terms(psi, deltaz, deltaLE)
+    y = surfaces_batch(x, c, deltasz, Au, Al, deltasLE, surface_function)
+    if baseline is None:
+        return y
+    if type(y) == dict:
+        return {surface: y[surface] + np.asarray(baseline[surface])
+                for surface in y}
+    return y + np.asarray(baseline)
+
+if __name__ == '__main__':
+    import matplotlib.pyplot as plt
+
+    # Bezier Curve (B-spline of degree 2 with clamped knots)
+    k = 2
+    c = [0., .1, .08, 0.]
+    t = clamped_knots(len(c), k)
+    x = np.linspace(0., 1., 50)
+    y_bezier = bspline(x, t, c, k)
+
+    # Hicks-Henne
+    y_hh = hicks_henne(x, y_bezier, [.02], [.3], [4.])
+    plt.plot(x,y_bezier,label='Bezier')
+    plt.plot(x,y_hh,label='Hickes-Henne')
+    plt.xlabel('x')
+    plt.ylabel('z')
+    plt.legend()
+    plt.show()
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Distances between 2D shapes used as objective functions of the fits.
+
+Current functionalities:
+- eucledian_shape_difference: distance between corresponding points
+  (vectorized for a batch of shapes)
+- hausdorff_distance_2D: Hausdorff distance using a KD-tree
+- ShapeIndex: KD-tree of a fixed target shape that is reused for every
+  comparison
+"""
+from __future__ import print_function
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+def _points(shape):
+    """Matrix (N x 2) of the points of a dictionary with x and y keys."""
+    return np.column_stack([np.ravel(shape['x']), np.ravel(shape['y'])])
+
+def eucledian_shape_difference(a, b):
+    """Sum of the distances between corresponding points of a and b.
+
+    :param a: dictionary with x and y keys.
+    :param b: dictionary with x and y keys. b['y'] (and b['x']) can also
+              be matrices (n_shapes x n_points) to compare several shapes
+              with a at once.
+
+    :rtype: float, or array with one value per shape in b.
+    """
+    dx = np.asarray(b['x'], dtype=float) - np.asarray(a['x'], dtype=float)
+    dy = np.asarray(b['y'], dtype=float) - np.asarray(a['y'], dtype=float)
+    return np.sum(np.sqrt(dx**2 + dy**2), axis=-1)
+
+def _coordinates(shape):
+    """x and y arrays of a shape broadcast to the same shape (x can be a
+    vector shared by a matrix of y values)."""
+    return np.broadcast_arrays(np.asarray(shape['x'], dtype=float),
+                               np.asarray(shape['y'], dtype=float))
+
+class ShapeIndex():
+    """KD-tree of a target shape to calculate Hausdorff distances from
+    many shapes to the same target without rebuilding the index.
+
+    The shapes can be a single dictionary with x and y vectors or a batch
+    with y (and x) matrices (n_shapes x n_points), in which case all the
+    shapes are calculated with one query and one distance per shape is
+    returned.
+
+    :param target: dictionary with x and y keys.
+    """
+    def __init__(self, target):
+        self.points = _points(target)
+        self.tree = cKDTree(self.points)
+
+    def directed_distance(self, shape, upper_bound = np.inf):
+        """Largest distance from a point of shape to the target.
+
+        :param upper_bound: the nearest neighbour search of each point
+               stops at this distance, and shapes with a point farther
+               than upper_bound return inf.
+        """
+        x, y = _coordinates(shape)
+        d, i = self.tree.query(np.column_stack([x.ravel(), y.ravel()]),
+                               distance_upper_bound = upper_bound)
+        return np.max(d.reshape(x.shape), axis=-1)
+
+    def reverse_distance(self, shape, upper_bound = np.inf):
+        """Largest distance from a point of the target to shape (same
+        inputs and outputs as directed_distance).
+
+        The points of all the shapes are stored in a single tree,
+        separated along a third coordinate by more than the size of the
+        shapes and the target, so each point of the target is only
+        compared with the points of one shape and the whole batch is one
+        query.
+        """
+        x, y = _coordinates(shape)
+        x_all = np.atleast_2d(x)
+        y_all = np.atleast_2d(y)
+        n_shapes, n_points = x_all.shape
+        # Larger than any distance between the shapes and the target
+        gap = 2.*(np.ptp(np.concatenate([x_all.ravel(), self.points[:,0]])) +
+                  np.ptp(np.concatenate([y_all.ravel(), self.points[:,1]]))) + 1.
+        z = gap*np.arange(n_shapes)
+        tree = cKDTree(np.column_stack([x_all.ravel(), y_all.ravel(),
+                                        np.repeat(z, n_points)]))
+        queries = np.column_stack([np.tile(self.points, (n_shapes, 1)),
+                                   np.repeat(z, len(self.points))])
+        d, i = tree.query(queries, distance_upper_bound = upper_bound)
+        d = np.max(d.reshape(n_shapes, len(self.points)), axis=-1)
+        if x.ndim == 1:
+            return d[0]
+        return d
+
+    def hausdorff(self, shape, upper_bound = np.inf):
+        """Hausdorff distance between shape and the target.
+
+        :param upper_bound: if the distance is larger than upper_bound,
+               inf is returned. Shapes whose directed distance is already
+               larger are not calculated in the other direction (used to
+               discard bad candidates early).
+        """
+        x, y = _coordinates(shape)
+        h = self.directed_distance({'x': x, 'y': y}, upper_bound)
+        if x.ndim == 1:
+            if h == np.inf:
+                return h
+            return max(h, self.reverse_distance({'x': x, 'y': y},
+                                                upper_bound))
+        close = np.isfinite(h)
+        if np.any(close):
+            h[close] = np.maximum(h[close], self.reverse_distance(
+                {'x': x[close], 'y': y[close]}, upper_bound))
+        return h
+
+def hausdorff_distance_2D(a, b, upper_bound = np.inf):
+    """Hausdorff distance between two shapes.
+
+    :param a: dictionary with x and y keys or a prebuilt ShapeIndex (for
+              a target used several times).
+    :param b: dictionary with x and y keys.
+    :param upper_bound: distances above this value are returned as inf
+              without finishing the calculation.
+    """
+    if not isinstance(a, ShapeIndex):
+        a = ShapeIndex(a)
+    return a.hausdorff(b, upper_bound)
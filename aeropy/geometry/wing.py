@@ -1,30 +1,91 @@
 import math 
 import numpy as np
 
+def _unit_axes(euler_vector, shape):
+    """Normalized rotation axes broadcast to shape + (3,)."""
+    u = np.asarray(euler_vector, dtype=float)
+    u = u/np.linalg.norm(u, axis=-1, keepdims=True)
+    return np.broadcast_to(u, shape + (3,))
+
+def rotation_matrices(euler_vector, theta):
+    """Stack of rotation matrices around the axes euler_vector by the
+    angles theta (Rodrigues' formula, vectorized).
+
+    :param euler_vector: rotation axis (3,) or one axis per angle (N x 3).
+                         Axes are normalized.
+    :param theta: float or array (N,) of angles in radians.
+
+    :rtype: array theta.shape + (3, 3).
+    """
+    theta = np.asarray(theta, dtype=float)
+    u = _unit_axes(euler_vector, theta.shape)
+    c = np.cos(theta)[..., np.newaxis, np.newaxis]
+    s = np.sin(theta)[..., np.newaxis, np.newaxis]
+    # cross product matrix of u
+    K = np.zeros(u.shape + (3,))
+    K[..., 0, 1], K[..., 0, 2] = -u[..., 2], u[..., 1]
+    K[..., 1, 0], K[..., 1, 2] = u[..., 2], -u[..., 0]
+    K[..., 2, 0], K[..., 2, 1] = -u[..., 1], u[..., 0]
+    uu = u[..., :, np.newaxis]*u[..., np.newaxis, :]
+    return c*np.eye(3) + s*K + (1 - c)*uu
+
 def Rotation_euler_vector(euler_vector, theta):
-    ux = euler_vector[0]
-    uy = euler_vector[1]
-    uz = euler_vector[2]
-    # Check if vector are normalized
-    norm = math.sqrt(ux**2+uy**2+uz*2)
-    if norm != 1:
-        ux = ux/norm
-        uy = uy/norm
-        uz = uz/norm
-
-    R11 = np.cos(theta) + ux**2*(1-np.cos(theta))
-    R12 = ux*uy*(1-np.cos(theta)) - uz*np.sin(theta)
-    R13 = ux*uz*(1-np.cos(theta)) + uy*np.sin(theta)
-    R21 = ux*uy*(1-np.cos(theta)) + uz*np.sin(theta)
-    R22 = np.cos(theta) + uy**2*(1-np.cos(theta))
-    R23 = uy*uz*(1-np.cos(theta)) - ux*np.sin(theta)
-    R31 = ux*uz*(1-np.cos(theta)) - uy*np.sin(theta)
-    R32 = uy*uz*(1-np.cos(theta)) + ux*np.sin(theta)
-    R33 = np.cos(theta) + uz**2*(1-np.cos(theta))
-    R = np.array([[R11, R12, R13],
-                  [R21, R22, R23],
-                  [R31, R32, R33]])
-    return R
+    """Rotation matrix around euler_vector by theta (radians). For an
+    array of N angles the output is (3 x 3 x N), see rotation_matrices
+    for an (N x 3 x 3) stack."""
+    R = rotation_matrices(euler_vector, theta)
+    return np.moveaxis(R, (-2, -1), (0, 1))
+
+def quaternions(euler_vector, theta):
+    """Unit quaternions (w, x, y, z) of the rotations around euler_vector
+    by theta, with shape theta.shape + (4,)."""
+    theta = np.asarray(theta, dtype=float)
+    u = _unit_axes(euler_vector, theta.shape)
+    return np.concatenate([np.cos(theta/2.)[..., np.newaxis],
+                           np.sin(theta/2.)[..., np.newaxis]*u], axis=-1)
+
+def quaternion_matrices(q):
+    """Rotation matrices (... x 3 x 3) of unit quaternions (... x 4)."""
+    q = np.asarray(q, dtype=float)
+    w, x, y, z = np.moveaxis(q, -1, 0)
+    R = np.array([[1 - 2*(y**2 + z**2), 2*(x*y - w*z), 2*(x*z + w*y)],
+                  [2*(x*y + w*z), 1 - 2*(x**2 + z**2), 2*(y*z - w*x)],
+                  [2*(x*z - w*y), 2*(y*z + w*x), 1 - 2*(x**2 + y**2)]])
+    return np.moveaxis(R, (0, 1), (-2, -1))
+
+def rotate_points(points, euler_vector, theta, method = 'rodrigues'):
+    """Rotate each point around euler_vector (through the origin) by its
+    own angle in a single vectorized operation.
+
+    :param points: array (N x 3).
+    :param euler_vector: rotation axis (3,) or one axis per point (N x 3).
+    :param theta: float or array (N,) of angles in radians.
+    :param method: 'rodrigues' (default, applied directly to the points),
+                   'quaternion' (q*p*q^-1, also without matrices) or
+                   'matrix' (stack from rotation_matrices applied with
+                   einsum).
+
+    :rtype: array (N x 3) with the rotated points.
+    """
+    points = np.asarray(points, dtype=float)
+    theta = np.broadcast_to(np.asarray(theta, dtype=float),
+                            points.shape[:-1])
+    if method == 'rodrigues':
+        u = _unit_axes(euler_vector, theta.shape)
+        c = np.cos(theta)[..., np.newaxis]
+        s = np.sin(theta)[..., np.newaxis]
+        dot = np.einsum('...i,...i->...', u, points)[..., np.newaxis]
+        return c*points + s*np.cross(u, points) + (1 - c)*dot*u
+    elif method == 'quaternion':
+        q = quaternions(euler_vector, theta)
+        w, v = q[..., :1], q[..., 1:]
+        t = 2*np.cross(v, points)
+        return points + w*t + np.cross(v, t)
+    elif method == 'matrix':
+        return np.einsum('...ij,...j->...i',
+                         rotation_matrices(euler_vector, theta), points)
+    else:
+        raise Exception('method can only be rodrigues, quaternion or matrix')
 
 def Rotation_euler_angles(theta):
  
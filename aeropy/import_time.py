@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Cold import times of aeropy and its subpackages.
+
+Heavy dependencies (scipy, matplotlib, evtk, abaqus) are only imported
+inside the functions that use them, so importing a module should cost
+little more than numpy. Worker processes (e.g. the pools of FlapMap and
+fit_database) import the package again, so this is paid for every
+process. Each module is measured in a new interpreter and compared with
+BUDGET:
+
+    $ python -m aeropy.import_time
+"""
+from __future__ import print_function
+
+import subprocess
+import sys
+
+# Largest cold import time (seconds, numpy included) of each module
+BUDGET = {'aeropy': 0.01,
+          'aeropy.geometry': 0.01,
+          'aeropy.geometry.bernstein': 0.25,
+          'aeropy.geometry.airfoil': 0.25,
+          'aeropy.geometry.wing': 0.25,
+          'aeropy.geometry.other_methods': 0.25,
+          'aeropy.xfoil_module': 0.25,
+          'aeropy.aero_module': 0.25,
+          'aeropy.CST_2D': 0.01,
+          'aeropy.CST_2D.module': 0.25,
+          'aeropy.CST_3D': 0.01,
+          'aeropy.CST_3D.module': 0.25,
+          'aeropy.filehandling': 0.01,
+          'aeropy.filehandling.vtk': 0.25,
+          'aeropy.morphing': 0.01}
+
+# Modules that should not be loaded by an import
+HEAVY = ('scipy', 'matplotlib', 'evtk', 'abaqus')
+
+_SCRIPT = """
+import sys, time
+t = time.perf_counter()
+import %s
+t = time.perf_counter() - t
+print(t)
+print(' '.join(m for m in %r if m in sys.modules))
+"""
+
+def cold_import_time(module, repeat = 3):
+    """Time to import a module in a new interpreter (the interpreter
+    start-up is not included).
+
+    :param module: name of the module (e.g. 'aeropy.CST_2D.module')
+    :param repeat: number of interpreters, the fastest is used
+
+    :returns: time in seconds and list of the HEAVY modules that were
+              loaded by the import.
+    """
+    times = []
+    for i in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c',
+                                          _SCRIPT % (module, HEAVY)],
+                                         universal_newlines = True)
+        lines = output.split('\n')
+        times.append(float(lines[0]))
+        heavy = lines[1].split()
+    return min(times), heavy
+
+def check_budget(budget = BUDGET, repeat = 3):
+    """Measure the cold import time of every module of budget.
+
+    :param budget: dictionary with the largest time for each module
+    :param repeat: number of interpreters per module
+
+    :returns: dictionary with module, time, budget and heavy (modules in
+              HEAVY that were loaded) lists, and a list with the modules
+              that are over budget or load heavy modules.
+    """
+    Data = {'module': [], 'time': [], 'budget': [], 'heavy': []}
+    failed = []
+    for module in sorted(budget):
+        t, heavy = cold_import_time(module, repeat)
+        Data['module'].append(module)
+        Data['time'].append(t)
+        Data['budget'].append(budget[module])
+        Data['heavy'].append(heavy)
+        if t > budget[module] or heavy:
+            failed.append(module)
+    return Data, failed
+
+if __name__ == '__main__':
+    Data, failed = check_budget()
+    for module, t, limit, heavy in zip(Data['module'], Data['time'],
+                                       Data['budget'], Data['heavy']):
+        print('%-32s %7.3f s (budget %5.2f s) %s' % (module, t, limit,
+                                                   ' '.join(heavy)))
+    if failed:
+        print('Over budget: ' + ', '.join(failed))
+        sys.exit(1)
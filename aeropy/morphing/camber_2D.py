@@ -14,6 +14,7 @@ import numpy as np
 from numpy.linalg import inv
 
 from aeropy.geometry.airfoil import CST
+from aeropy.geometry.bernstein import bernstein_basis
 
 from aeropy.CST_2D.module import *
 
@@ -37,10 +38,6 @@ def calculate_dependent_shape_coefficients(Au_C_1_to_n,
         c_C = calculate_c_baseline(c_P, Au_C, Au_P, deltaz)
         return np.sqrt(c_P/c_C)*Au_P[0]
     
-    # Bersntein Polynomial
-    def K(r,n):
-        K=math.factorial(n)/(math.factorial(r)*math.factorial(n-r))
-        return K
     # Bernstein Polynomial order
     n = len(Au_C_1_to_n)
 
@@ -81,14 +78,9 @@ def calculate_dependent_shape_coefficients(Au_C_1_to_n,
             spar_thicknesses.append(t_j)
             b_list[j] = (t_j/c_C - psi_j*deltaz/c_C)/((psi_j**0.5)*(1-psi_j)) - A0*(1-psi_j)**n
 
-        B = np.zeros((n,n))
-        #j is the row dimension and i the column dimension in this case
-        for j in range(n):
-            for i in range(n):
-                #Because in Python counting starts at 0, need to add 1 to be
-                #coherent for equations
-                r = i +1
-                B[j][i] = K(r,n)*(psi_spars[j]**r)*(1-psi_spars[j])**(n-r)
+        #j is the row dimension and i the column dimension in this case.
+        #The first column (r=0) is not used because A0 is already known
+        B = bernstein_basis(psi_spars[:n], n)[:, 1:]
         
         A_bar = np.dot(inv(B), b_list)
 
@@ -139,15 +131,8 @@ def calculate_dependent_shape_coefficients(Au_C_1_to_n,
 
             f[j] = (2*xi_l_j + psi_l_j*deltaz/c_C)/(2*(psi_l_j**0.5)*(psi_l_j-1))  - AC_l0*(1-psi_l_j)**n
         print(psi_lower_children)
-        F = np.zeros((n,n))
         #j is the row dimension and i the column dimension in this case
-        for j in range(n):
-            for i in range(n):
-                #Because in Python counting starts at 0, need to add 1 to be
-                #coherent for equations
-                r = i +1
-                F[j][i] = K(r,n)*(psi_lower_children[j]**r)*(1-psi_lower_children[j])**(n-r)
-                print(K(r,n)*(psi_lower_children[j]**r)*(1-psi_lower_children[j])**(n-r))
+        F = bernstein_basis(psi_lower_children[:n], n)[:, 1:]
         A_lower = np.dot(inv(F), f)
 
         Al_C = [AC_l0]
@@ -162,11 +147,6 @@ def calculate_shape_coefficients_tracing(A0, x, y, N1, N2, chord = 1., EndThickn
         - other_points: {'x': value, 'y': value}
         - A0: float value for first shape coefficient. Usually related to a constraint.
     """
-    # Bersntein Polynomial
-    def K(r,n):
-        K=math.factorial(n)/(math.factorial(r)*math.factorial(n-r))
-        return K
- 
     n = len(x)
     
     print(x)
@@ -174,13 +154,9 @@ def calculate_shape_coefficients_tracing(A0, x, y, N1, N2, chord = 1., EndThickn
     Xi = np.array(y)/chord
     
     EndThickness = EndThickness/chord
-    T = np.zeros((n,n))
+    T = bernstein_basis(Psi, n)[:, 1:]
     t = np.zeros((n,1))
-    for j in range(1,n+1):
-        jj = j - 1
-        for i in range(1,n+1):
-            ii = i -1
-            T[jj][ii] = K(i,n)* Psi[jj]**i * (1-Psi[jj])**(n-i)
+    for jj in range(n):
         print(Xi[jj], EndThickness, Psi[jj], A0,Psi[jj]**N1*(1-Psi[jj])**N2)
         t[jj] = (Xi[jj] - Psi[jj]*EndThickness)/(Psi[jj]**N1*(1-Psi[jj])**N2) - A0*(1-Psi[jj])**n
     # Calculate the inverse
@@ -14,6 +14,7 @@ import numpy as np
 from numpy.linalg import inv
 
 from aeropy.airfoil_module import CST
+from aeropy.geometry.bernstein import bernstein_basis
 from aeropy.CST.module_3D import CST_3D
 from aeropy.CST.module_2D import calculate_c_baseline, calculate_psi_goal, calculate_spar_direction
 
@@ -44,11 +45,6 @@ def calculate_dependent_shape_coefficients(BP_p, BA_p, BP_c, chord_p, sweep_p,
         for i in range(n+1):
             A.append(B[i][j])
         return A
-    # Bersntein Polynomial
-    def K(r,n):
-        K=math.factorial(n)/(math.factorial(r)*math.factorial(n-r))
-        return K
-
     # Bernstein Polynomial orders (n is for psi, and m for eta)
     n = len(BP_p) - 1
     m = len(BP_p[0]) - 1
@@ -139,10 +135,8 @@ def calculate_dependent_shape_coefficients(BP_p, BA_p, BP_c, chord_p, sweep_p,
 
                 psi_lower_children.append(psi_l_k)
 
-                f_y = 0
-                for j in range(m+1):
-                    f_y += BA_c[0][j]*(1-psi_l_k)**n*(K(j,m)*eta_sampling[l]**j*(1-eta_sampling[l])**(m-j))
-                    # print j, eta_sampling[l]**j*(1-eta_sampling[l])**(m-j), BA_c[0][j]
+                f_y = (1-psi_l_k)**n*np.dot(bernstein_basis(eta_sampling[l], m),
+                                            BA_c[0])
                 f[l][k] = (2*xi_l_k + psi_l_k*deltaz/c_C)/(2*(psi_l_k**0.5)*(psi_l_k-1))  - f_y
                 
                 # print 'f_y',f_y, eta_sampling[l],m,j
@@ -164,17 +158,11 @@ def calculate_dependent_shape_coefficients(BP_p, BA_p, BP_c, chord_p, sweep_p,
                 # tempk.append(tempj)
             # F.append(tempk)
 
-        #j is the row dimension and i the column dimension in this case
-        for l in range(q):
-            for k in range(p):
-                for j in range(m+1):
-                    for i in range(n):
-                        #Because in Python counting starts at 0, need to add 1 to be
-                        #coherent for equations
-                        ii = i + 1
-                        Sx = K(ii,n)*(psi_A_c[l][k]**ii)*(1-psi_A_c[l][k])**(n-ii)
-                        Sy = K(j,m)*(eta_sampling[l]**j)*(1-eta_sampling[l])**(m-j)
-                        F[l][k][j][i] = Sx*Sy
+        #j is the row dimension and i the column dimension in this case.
+        #The first column of Sx (ii=0) is not used because A0 is known
+        Sx = bernstein_basis(psi_A_c, n)[:, :, 1:]
+        Sy = bernstein_basis(eta_sampling, m)
+        F[:] = np.einsum('lki,lj->lkji', Sx, Sy)
 
         # print len(F), len(F[0]), len(F[0][0]), len(F[0][0][0])
 
@@ -14,6 +14,7 @@ import numpy as np
 from numpy.linalg import inv
 
 from aeropy.airfoil_module import CST
+from aeropy.geometry.bernstein import bernstein_basis
 from aeropy.CST.module_2D import *
 
 # Just as quick trick, to make upper morph I just mirror the image in regards to x
@@ -59,13 +60,18 @@ def calculate_psi_goal(psi_baseline, Au_baseline, Au_goal, deltaz,
             L_baseline = 0
         L_LE, err = quad(integrand, 0, psi_1, args=(Au_baseline, deltaz, 
                                                          c_baseline))
-        y, err = quad(integrand, 0, psi_goal, args=(Au_goal, deltaz, c))
+        # fsolve works with arrays, quad needs a float as limit
+        y, err = quad(integrand, 0, np.ravel(psi_goal)[0], args=(Au_goal, deltaz, c))
         return y - (1-eps_LE)*(L_LE+c_baseline*l_LE) - L_baseline
 
+    def dequation(psi_goal, Au_goal, deltaz, c):
+        # Only the arc length of the goal depends on psi_goal
+        return np.reshape(integrand(psi_goal, Au_goal, deltaz, c), (1,1))
+
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
         y = fsolve(equation, psi_baseline, args=(Au_goal, deltaz,
-                                                 c_goal))
+                                                 c_goal), fprime=dequation)
     return y[0]
 
 def calculate_A0_moving_LE(psi_baseline, psi_goal_0, Au_baseline, Au_goal, deltaz,
@@ -134,10 +140,6 @@ def calculate_dependent_shape_coefficients(Au_C_1_to_n,
         else:
             return calculate_A0_moving_LE(psi_spars, psi_lower_children[0], Au_P, Au_C, deltaz,
                        c_P, l_LE, eps_LE)
-    # Bersntein Polynomial
-    def K(r,n):
-        K=math.factorial(n)/(math.factorial(r)*math.factorial(n-r))
-        return K
     # Bernstein Polynomial order
     # In case of leading edge radius constraint
     n = len(Au_C_1_to_n)
@@ -213,14 +215,8 @@ def calculate_dependent_shape_coefficients(Au_C_1_to_n,
 
                 f[j] = (2*xi_l_j + psi_l_j*deltaz/c_C)/(2*(psi_l_j**0.5)*(psi_l_j-1)) - Al_C0*(1-psi_l_j)**n
 
-            F = np.zeros((n,n))
             #j is the row dimension and i the column dimension in this case
-            for j in range(n):
-                for i in range(n):
-                    #Because in Python counting starts at 0, need to add 1 to be
-                    #coherent for equations
-                    r = i + 1
-                    F[j][i] = K(r,n)*(psi_lower_children[j]**r)*(1-psi_lower_children[j])**(n-r)
+            F = bernstein_basis(psi_lower_children[:n], n)[:, 1:]
             print(F)
             print(f)
             A_lower = np.dot(inv(F), f)
@@ -249,11 +245,6 @@ def calculate_shape_coefficients_tracing(A0, x, y, N1, N2, chord = 1., EndThickn
         - other_points: {'x': value, 'y': value}
         - A0: float value for first shape coefficient. Usually related to a constraint.
     """
-    # Bersntein Polynomial
-    def K(r,n):
-        K=math.factorial(n)/(math.factorial(r)*math.factorial(n-r))
-        return K
- 
     n = len(x)
     
     print(x)
@@ -261,13 +252,9 @@ def calculate_shape_coefficients_tracing(A0, x, y, N1, N2, chord = 1., EndThickn
     Xi = np.array(y)/chord
     
     EndThickness = EndThickness/chord
-    T = np.zeros((n,n))
+    T = bernstein_basis(Psi, n)[:, 1:]
     t = np.zeros((n,1))
-    for j in range(1,n+1):
-        jj = j - 1
-        for i in range(1,n+1):
-            ii = i -1
-            T[jj][ii] = K(i,n)* Psi[jj]**i * (1-Psi[jj])**(n-i)
+    for jj in range(n):
         print(Xi[jj], EndThickness, Psi[jj], A0,Psi[jj]**N1*(1-Psi[jj])**N2)
         t[jj] = (Xi[jj] - Psi[jj]*EndThickness)/(Psi[jj]**N1*(1-Psi[jj])**N2) - A0*(1-Psi[jj])**n
     # Calculate the inverse
@@ -70,6 +70,30 @@ class UnexpectedEndOfStream(Exception):
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 
+def _start_xfoil():
+    """Start an XFOIL process with PIPEs for stdin, stdout and stderr."""
+    # The following keys avoid the xfoil pop-up
+    # source: http://stackoverflow.com/questions/1765078/how-to-avoid-
+    # console-window-with-pyw-file-containing-os-system-call
+    if pf.system() == "Windows":
+        startupinfo = sp.STARTUPINFO()
+        startupinfo.dwFlags |= sp.STARTF_USESHOWWINDOW
+        xfoil_file = 'xfoil.exe'
+    else:
+        startupinfo = None
+        xfoil_file = 'Xfoil.app/Contents/Resources/xfoil'
+
+    # Calling xfoil with Poper
+    return sp.Popen([xfoil_file],
+                    stdin=sp.PIPE,
+                    stdout=sp.PIPE,
+                    stderr=sp.PIPE,
+                    cwd=os.getcwd(),
+                    startupinfo=startupinfo,
+                    encoding='utf8',
+                    bufsize=1)
+
+
 def call(airfoil, indir='', outdir='', alfas='none', output='Cp',  # noqa C901
          Reynolds=0, Mach=0,
          plots=False, echo=False, NACA=True, GDES=False, iteration=10,
@@ -258,26 +282,7 @@ def call(airfoil, indir='', outdir='', alfas='none', output='Cp',  # noqa C901
     #             cwd=None, env=None, universal_newlines=False,
     #             startupinfo=None, creationflags=0):
 
-    # The following keys avoid the xfoil pop-up
-    # source: http://stackoverflow.com/questions/1765078/how-to-avoid-
-    # console-window-with-pyw-file-containing-os-system-call
-    if pf.system() == "Windows":
-        startupinfo = sp.STARTUPINFO()
-        startupinfo.dwFlags |= sp.STARTF_USESHOWWINDOW
-        xfoil_file = 'xfoil.exe'
-    else:
-        startupinfo = None
-        xfoil_file = 'Xfoil.app/Contents/Resources/xfoil'
-
-    # Calling xfoil with Poper
-    xfoil = sp.Popen([xfoil_file],
-                     stdin=sp.PIPE,
-                     stdout=sp.PIPE,
-                     stderr=sp.PIPE,
-                     cwd=os.getcwd(),
-                     startupinfo=startupinfo,
-                     encoding='utf8',
-                     bufsize=1)
+    xfoil = _start_xfoil()
     # wrap with NonBlockingStreamReader object
     nbsr = NonBlockingStreamReader(xfoil.stdout)
     # Turn graphics off (since we are only sending and reading text)
@@ -355,6 +360,200 @@ def call(airfoil, indir='', outdir='', alfas='none', output='Cp',  # noqa C901
     xfoil.wait()
 
 
+class XfoilSession:
+    """Persistent XFOIL process to calculate many polar points.
+
+    Calling XFOIL for every geometry (as call does) starts a new process
+    each time. The session keeps the same process alive, loads each
+    airfoil file into it and polls the polar accumulation file for the
+    result. Results are cached, so the same geometry at the same angle of
+    attack is only calculated once.
+
+    :param outdir: directory where the polar files are written.
+
+    :param Reynolds: Reynolds number (inviscid if 0).
+
+    :param Mach: Mach number.
+
+    :param iteration: maximum number of iterations of the viscous solver.
+
+    :param GDES: if True, the corners are refined (CADD) and the
+          paneling regenerated after loading each airfoil.
+
+    :param timeout: seconds to wait for a polar point. If XFOIL does not
+          answer in time the process is restarted and the point is
+          considered not converged.
+
+    :param echo: if True, prints the commands and XFOIL output.
+
+    Use as a context manager (or call close) to end the process:
+
+        >>> with XfoilSession(Reynolds=1e6, iteration=100) as session:
+        ...     Data = session.polar('flapped_airfoil', 2.)
+    """
+
+    def __init__(self, outdir='', Reynolds=0, Mach=0, iteration=100,
+                 GDES=False, timeout=60., echo=False):
+        """Start the XFOIL process."""
+        self.outdir = outdir
+        self.Reynolds = Reynolds
+        self.Mach = Mach
+        self.iteration = iteration
+        self.GDES = GDES
+        self.timeout = timeout
+        self.echo = echo
+        self.cache = {}
+        self.n_calls = 0
+        self._start()
+
+    def _start(self):
+        self.xfoil = _start_xfoil()
+        self.nbsr = NonBlockingStreamReader(self.xfoil.stdout)
+        self.viscous = False
+        # Turn graphics off (since we are only sending and reading text)
+        self.issueCmd('PLOP')
+        self.issueCmd('G')
+        self.issueCmd('')
+        # Normalize airfoils (NORM is a toggle, so only issued once)
+        self.issueCmd('NORM')
+
+    def issueCmd(self, cmd: str):
+        """Submit a command through PIPE to xfoil."""
+        self.xfoil.stdin.write(cmd + '\n')
+        if self.echo:
+            print(cmd)
+
+    def _readlines(self, timeout=None):
+        """Lines from the XFOIL output available until timeout."""
+        lines = []
+        while True:
+            output = self.nbsr.readline(timeout)
+            if not output:
+                return lines
+            if self.echo:
+                print(output)
+            lines.append(output)
+
+    def polar(self, airfoil, alfa, indir=''):
+        """Polar point (CL, CD, CM, ...) of an airfoil file.
+
+        :param airfoil: name of the plain file where the airfoil geometry
+               is stored (i.e. created with create_input).
+
+        :param alfa: angle of attack in degrees.
+
+        :rtype: dictionary as returned by output_reader for a Polar, or
+                None if the point did not converge.
+        """
+        path_to_airfoil = os.path.join(indir, airfoil)
+        with open(path_to_airfoil) as f:
+            key = (f.read(), float(alfa))
+        if key in self.cache:
+            return self.cache[key]
+
+        # Unique polar file for each point
+        self.n_calls += 1
+        filename = file_name(f'{airfoil}_{os.getpid()}_{self.n_calls}',
+                             float(alfa), output='Polar')
+        path_to_output = os.path.join(self.outdir, filename)
+        try:
+            os.remove(path_to_output)
+        except OSError:
+            pass
+        # Discard the output of previous commands
+        self._readlines()
+
+        self.issueCmd(fr'load {path_to_airfoil}')
+        self.issueCmd(f'{airfoil}')
+        if self.GDES:
+            self.issueCmd('GDES')   # enter GDES menu
+            self.issueCmd('CADD')   # add points at corners
+            self.issueCmd('')       # accept default input
+            self.issueCmd('')       # accept default input
+            self.issueCmd('')       # accept default input
+            self.issueCmd('')       # accept default input
+            self.issueCmd('PANE')   # regenerate paneling
+        self.issueCmd('OPER')
+        self.issueCmd(f'ITER {self.iteration}')
+        if self.Reynolds != 0:
+            # VISC is a toggle, so the Reynolds number is only changed
+            # after the first time
+            if self.viscous:
+                self.issueCmd(f'RE {self.Reynolds}')
+            else:
+                self.issueCmd(f'v {self.Reynolds}')
+                self.viscous = True
+        self.issueCmd(f'MACH {self.Mach}')
+        self.issueCmd('PACC')
+        self.issueCmd(fr'{path_to_output}')
+        self.issueCmd('')  # do not save a dump file
+        self.issueCmd(f'ALFA {alfa:4f}')
+        self.issueCmd('PACC')  # stop accumulating
+        # XFOIL only stores a fixed number of polars (NPX), so the polar
+        # of this point is deleted (the file is already written)
+        self.issueCmd('PDEL 0')
+        self.issueCmd('')  # Exiting from OPER mode
+
+        # Poll the polar file until the point is written, the solver
+        # reports that it did not converge or the time is over
+        start = time.time()
+        converged = False
+        while time.time() - start < self.timeout:
+            if _polar_rows(path_to_output) > 0:
+                converged = True
+                break
+            lines = self._readlines(0.05)
+            if any('Convergence failed' in line for line in lines):
+                # the point is not added to the polar file
+                time.sleep(0.05)
+                converged = _polar_rows(path_to_output) > 0
+                break
+        else:
+            # XFOIL is not answering, start a new process
+            self.close()
+            self._start()
+
+        if converged:
+            Data = output_reader(filename, dir=self.outdir, output='Polar',
+                                 delete=True)
+        else:
+            Data = None
+            try:
+                os.remove(path_to_output)
+            except OSError:
+                pass
+        self.cache[key] = Data
+        return Data
+
+    def close(self):
+        """End the XFOIL process."""
+        try:
+            self.issueCmd('QUIT')
+            self.xfoil.stdin.close()
+            self.xfoil.wait(timeout=self.timeout)
+        except (OSError, ValueError, sp.TimeoutExpired):
+            self.xfoil.kill()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _polar_rows(path):
+    """Number of points already written to a polar accumulation file."""
+    try:
+        with open(path) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return 0
+    for i, line in enumerate(lines):
+        if line.strip().startswith('-----'):
+            return len([line for line in lines[i+1:] if line.strip()])
+    return 0
+
+
 def create_input(x, y_u, y_l=None,
                  filename='test', different_x_upper_lower=False):
     """Create a plain file that XFOIL can read.
@@ -412,129 +611,20 @@ def prepare_xfoil(Coordinates_Upper, Coordinates_Lower, chord,  # noqa C901
         Reposition the airfoils coordinates so that the leading
         edge is at x=y=0 and that the the trailing edge is on x=0 axis.
         """
-        # Find the coordinates of the trailing edge
-        LE = {'x': 0, 'y': 0}
-        cx = CoordinatesU['x']
-        LE['x'] = min(cx)
-        index_LE = cx.index(LE['x'])
-        LE['y'] = cx[index_LE]
-
-        All_Rotated_Coordinates = {}
-        count = 0
-        for Coordinates in [CoordinatesU, CoordinatesL]:
-            # Repositioning Leading Edge
-            for key in Coordinates:
-                c = Coordinates[key]
-                c = [i - LE[key] for i in c]
-                Coordinates[key] = c
-        """ Find the coordinates of the trailing edge. Because of the
-        thickness of the TE, it is necessary to find the point with
-        max(x) for both surfaces and take the average between them
-        to find the actual TE.
-        """
-
-        TE = {'x': 0, 'y': 0}
-
-        cxU = CoordinatesU['x']
-        cyU = CoordinatesU['y']
-        TExU = max(cxU)
-        index_TE = cxU.index(TExU)
-        TEyU = cyU[index_TE]
-
-        cxL = CoordinatesL['x']
-        cyL = CoordinatesL['y']
-        TExL = max(cxL)
-        index_TE = cxL.index(TExL)
-        TEyL = cyL[index_TE]
-
-        TE['x'] = (TExU+TExL) / 2.
-        TE['y'] = (TEyU+TEyL) / 2.
-
-        # Rotating according to the position of the trailing edge
-        theta = math.atan(TE['y'] / TE['x'])
-
-        # Rotation transformation Matrix
-        T = [[math.cos(theta), math.sin(theta)],
-             [-math.sin(theta), math.cos(theta)]]
-
-        for Coordinates in [CoordinatesU, CoordinatesL]:
-            Rotated_Coordinates = {'x': [], 'y': []}
-            for i in range(len(Coordinates['x'])):
-                cx = Coordinates['x'][i]
-                cy = Coordinates['y'][i]
-                rot_x = T[0][0]*cx + T[0][1]*cy
-                rot_y = T[1][0]*cx + T[1][1]*cy
-                Rotated_Coordinates['x'].append(rot_x)
-                Rotated_Coordinates['y'].append(rot_y)
-            All_Rotated_Coordinates['%s' % count] = Rotated_Coordinates
-            count += 1
-        # If there is a great rotation, noded that are not at the trailing edge
-        # can have a smaller x-coordinate. Have to rotate in relation to TE,
-        # and then translate. Angle gamma
-        if (min(All_Rotated_Coordinates['0']['x']) < 0
-                or min(All_Rotated_Coordinates['1']['x']) < 0):
-            count = 0
-
-            cxU = All_Rotated_Coordinates['0']['x']
-            cyU = All_Rotated_Coordinates['0']['y']
-            TExU = max(cxU)
-
-            cxL = All_Rotated_Coordinates['1']['x']
-            cyL = All_Rotated_Coordinates['1']['y']
-            TExL = max(cxL)
-
-            x_TE = (TExU+TExL) / 2.
-            print('trailing edge x', x_TE)
-            for i in range(len(cxU)):
-                cxU[i] = cxU[i] - x_TE
-            for i in range(len(cxL)):
-                cxL[i] = cxL[i] - x_TE
-            # find leading edge
-            # (it is the most distant node from the trailing edge)
-            max_d = 0
-            x_LE = 0
-            y_LE = 0
-
-            for i in range(len(cxU)):
-                d_i = math.sqrt(cxU[i]**2 + cyU[i]**2)
-                if d_i > max_d:
-                    max_d = d_i
-                    x_LE = cxU[i]
-                    y_LE = cyU[i]
-
-            for i in range(len(cxL)):
-                d_i = math.sqrt(cxL[i]**2 + cyL[i]**2)
-                if d_i > max_d:
-                    max_d = d_i
-                    x_LE = cxL[i]
-                    y_LE = cyL[i]
-
-            # Calculate rotation angle
-            gamma = math.atan(y_LE/x_LE)
-
-            # Rotation transformation Matrix
-            T = [[math.cos(gamma), math.sin(gamma)],
-                 [-math.sin(gamma), math.cos(gamma)]]
-
-            # Find x-coordinate of leading edge to subtract afterwards
-            rotated_x_LE = T[0][0]*x_LE + T[0][1]*y_LE + x_TE
-            rotated_y_LE = T[1][0]*x_LE + T[1][1]*y_LE  # noqa W0612
-
-            old_Rotated_Coordinates = All_Rotated_Coordinates  # noqa W0612
-            for Coordinates in [{'x': cxU, 'y': cyU}, {'x': cxL, 'y': cyL}]:
-                Rotated_Coordinates = {'x': [], 'y': []}
-                for i in range(len(Coordinates['x'])):
-                    cx = Coordinates['x'][i]
-                    cy = Coordinates['y'][i]
-                    rot_x = T[0][0]*cx + T[0][1]*cy
-                    rot_y = T[1][0]*cx + T[1][1]*cy
-                    Rotated_Coordinates['x'].append(rot_x + x_TE
-                                                    - rotated_x_LE)
-                    Rotated_Coordinates['y'].append(rot_y)
-
-                All_Rotated_Coordinates['%s' % count] = Rotated_Coordinates
-                count += 1
-        return All_Rotated_Coordinates['0'], All_Rotated_Coordinates['1']
+        from aeropy.geometry.airfoil import normalize_airfoil
+
+        # Both surfaces go from the leading edge to the trailing edge, so
+        # the airfoil is assembled in XFOIL order. Because of the thickness
+        # of the TE, the actual TE is the average of the last point of both
+        # surfaces and the LE is the most distant node from it.
+        n_upper = len(CoordinatesU['x'])
+        x = np.concatenate([CoordinatesU['x'][::-1], CoordinatesL['x']])
+        y = np.concatenate([CoordinatesU['y'][::-1], CoordinatesL['y']])
+        x, y, edges = normalize_airfoil(x, y, scale=False)
+
+        return ({'x': x[:n_upper][::-1].tolist(),
+                 'y': y[:n_upper][::-1].tolist()},
+                {'x': x[n_upper:].tolist(), 'y': y[n_upper:].tolist()})
 
     upper = []
     lower = []